@@ -10,11 +10,22 @@ Provides audio processing services including:
 Runs on port 8002 by default.
 """
 
+import argparse
 import asyncio
+import copy
+import hashlib
 import io
+import json
 import os
+import re
+import queue
+import shutil
+import subprocess
+import threading
+import time
 import uuid
 import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Dict, Optional
 from concurrent.futures import ThreadPoolExecutor
@@ -22,25 +33,52 @@ from concurrent.futures import ThreadPoolExecutor
 import torch
 import numpy as np
 import soundfile as sf
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+from job_store import JobStore, PendingLimitExceeded
+from uploads import receive_upload
+
 # Lazy import demucs to avoid import errors if not installed
 demucs = None
 
 app = FastAPI(title="Audio Processor Worker", version="1.0.0")
 
-# Job tracking
-jobs: Dict[str, dict] = {}
-executor = ThreadPoolExecutor(max_workers=2)
-
 # Configuration
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 MODEL_NAME = os.getenv("DEMUCS_MODEL", "htdemucs")
+MAX_WORKERS = int(os.getenv("AUDIO_MAX_WORKERS", "2"))
+# One resident separator per executor thread; copies share the loaded weights
+SHARE_WEIGHTS = os.getenv("DEMUCS_SHARE_WEIGHTS", "1") == "1"
+# Chunked separation: inputs longer than CHUNKED_MIN_SECONDS stream through in segments
+CHUNK_SECONDS = float(os.getenv("CHUNK_SECONDS", "30"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("CHUNK_OVERLAP_SECONDS", "1.0"))
+CHUNKED_MIN_SECONDS = float(os.getenv("CHUNKED_MIN_SECONDS", "120"))
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "4"))
+FFMPEG = shutil.which("ffmpeg")
+
+# Stem output formats. Lossy codecs go through ffmpeg for exact bitrates; MP3
+# falls back to libsndfile (approximate bitrate) when ffmpeg is missing.
+OUTPUT_FORMATS = {
+    "wav": {"ext": ".wav", "media_type": "audio/wav", "subtype": "FLOAT"},
+    "wav16": {"ext": ".wav", "media_type": "audio/wav", "subtype": "PCM_16"},
+    "flac": {"ext": ".flac", "media_type": "audio/flac", "subtype": "PCM_16"},
+    "mp3": {"ext": ".mp3", "media_type": "audio/mpeg", "codec": "libmp3lame", "bitrate": 192},
+    "opus": {"ext": ".opus", "media_type": "audio/ogg", "codec": "libopus", "bitrate": 128},
+}
+MEDIA_TYPES = {spec["ext"]: spec["media_type"] for spec in OUTPUT_FORMATS.values()}
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("PROGRESS_INTERVAL_SECONDS", "0.5"))
+SSE_KEEPALIVE_SECONDS = 15.0
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "/tmp/audio-processor"))
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Job tracking
+jobs = JobStore(roots=[OUTPUT_DIR], log=lambda msg: print(f"[AudioProcessor] {msg}"))
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS)
+
 
 class JobStatus(BaseModel):
     jobId: str
@@ -59,41 +97,512 @@ def load_demucs():
     return demucs
 
 
-def separate_audio(job_id: str, audio_path: Path):
-    """Run Demucs separation in background thread"""
+class SeparatorPool:
+    """
+    Resident Demucs separators, one per executor thread.
+
+    The first separator loads the weights; with SHARE_WEIGHTS the rest are
+    shallow copies sharing that model (inference doesn't mutate it), so the
+    pool holds one copy of htdemucs no matter how many threads use it.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = queue.Queue()
+        self.slots = 0  # separators created or being created
+        self.template = None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.load_seconds = 0.0
+
+    def _load(self):
+        with self.load_lock:
+            load_start = time.perf_counter()
+            if self.template is not None and SHARE_WEIGHTS:
+                separator = copy.copy(self.template)
+            else:
+                separator = load_demucs().Separator(model=MODEL_NAME, device=DEVICE)
+                self.template = self.template or separator
+            self.load_seconds += time.perf_counter() - load_start
+        return separator
+
+    def _grow(self):
+        """Create a separator if the pool has a free slot, else None"""
+        with self.lock:
+            if self.slots >= self.size:
+                return None
+            self.slots += 1
+        try:
+            return self._load()
+        except Exception:
+            with self.lock:
+                self.slots -= 1
+            raise
+
+    @contextmanager
+    def acquire(self, timings: Optional[dict] = None):
+        """Borrow a separator; timings gets modelLoadMs and waitMs for the job"""
+        wait_start = time.perf_counter()
+        load_ms = 0.0
+        try:
+            separator = self.idle.get_nowait()
+        except queue.Empty:
+            load_start = time.perf_counter()
+            separator = self._grow()
+            if separator is not None:
+                load_ms = (time.perf_counter() - load_start) * 1000
+            else:
+                separator = self.idle.get()
+        if timings is not None:
+            timings["modelLoadMs"] = round(load_ms, 1)
+            timings["waitMs"] = round((time.perf_counter() - wait_start) * 1000 - load_ms, 1)
+        try:
+            yield separator
+        finally:
+            self.idle.put(separator)
+
+    def warmup(self, seconds: float = 1.0) -> None:
+        """Fill every slot and run a short separation so kernels are compiled/cached"""
+        loaded = []
+        while (separator := self._grow()) is not None:
+            loaded.append(separator)
+        if loaded:
+            silence = torch.zeros(2, int(loaded[0].samplerate * seconds))
+            loaded[0].separate_tensor(silence, loaded[0].samplerate)
+        for separator in loaded:
+            self.idle.put(separator)
+
+    def snapshot(self) -> dict:
+        return {
+            "size": self.size,
+            "loaded": self.slots,
+            "idle": self.idle.qsize(),
+            "sharedWeights": SHARE_WEIGHTS,
+            "loadSeconds": round(self.load_seconds, 2),
+        }
+
+
+separators = SeparatorPool(MAX_WORKERS)
+
+
+class JobEvents:
+    """Fans job updates from executor threads out to SSE subscribers on the event loop"""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers: Dict[str, set] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        # Latest state wins: a slow client skips intermediate updates instead of queueing them
+        updates = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(job_id, set()).add(updates)
+        return updates
+
+    def unsubscribe(self, job_id: str, updates: asyncio.Queue) -> None:
+        listeners = self.subscribers.get(job_id)
+        if listeners is not None:
+            listeners.discard(updates)
+            if not listeners:
+                del self.subscribers[job_id]
+
+    def publish(self, job_id: str) -> None:
+        """Safe to call from any thread; a no-op while nobody is listening"""
+        if self.loop is not None and job_id in self.subscribers:
+            self.loop.call_soon_threadsafe(self._deliver, job_id)
+
+    def _deliver(self, job_id: str) -> None:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        snapshot = dict(job)
+        for updates in self.subscribers.get(job_id, ()):
+            if updates.full():
+                updates.get_nowait()
+            updates.put_nowait(snapshot)
+
+
+events = JobEvents()
+
+
+class ProgressReporter:
+    """
+    Demucs callback that turns segment completions into job progress.
+
+    Demucs reports the start and end of every segment with its offset,
+    the audio length, the model index within the bag and the shift
+    index; those give the fraction done, which is mapped onto span
+    (the job's progress range for the current separate call). Writes
+    are rate limited to one per PROGRESS_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, job_id: str, separator, span=(0.15, 0.85)):
+        self.job_id = job_id
+        self.shifts = max(getattr(separator, "_shifts", 1), 1)
+        self.span = span
+        self.stride = 0
+        self.last_write = 0.0
+
+    def __call__(self, info: dict) -> None:
+        if info.get("state") != "end":
+            return
+        offset, length = info.get("segment_offset", 0), max(info.get("audio_length", 1), 1)
+        if offset and not self.stride:
+            self.stride = offset  # offsets are multiples of the segment stride
+        within = min((offset + self.stride) / length, 1.0) if self.stride else offset / length
+        models = max(info.get("models", 1), 1)
+        fraction = (info.get("model_idx_in_bag", 0) + (info.get("shift_idx", 0) + within) / self.shifts) / models
+        low, high = self.span
+        self.set(low + (high - low) * fraction)
+
+    def set(self, progress: float, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_write < PROGRESS_INTERVAL_SECONDS:
+            return
+        self.last_write = now
+        job = jobs.get(self.job_id)
+        if job is None:
+            return
+        job["progress"] = round(max(progress, job.get("progress") or 0), 3)
+        events.publish(self.job_id)
+
+
+def input_duration(audio_path: Path) -> Optional[float]:
+    """Duration in seconds if soundfile can stream this file, else None"""
     try:
-        jobs[job_id]["status"] = "processing"
-        jobs[job_id]["progress"] = 0.1
+        info = sf.info(str(audio_path))
+        return info.frames / info.samplerate
+    except Exception:
+        return None
 
-        # Load model
-        api = load_demucs()
-        separator = api.Separator(model=MODEL_NAME, device=DEVICE)
 
-        jobs[job_id]["progress"] = 0.3
+def resolve_chunked(chunked: Optional[bool], duration: Optional[float]) -> bool:
+    """Whether to separate in segments; duration None means soundfile can't stream the input"""
+    if chunked is None:
+        return duration is not None and duration > CHUNKED_MIN_SECONDS
+    return chunked and duration is not None  # unstreamable input falls back to whole-file
 
-        # Load and separate
-        origin, separated = separator.separate_audio_file(str(audio_path))
 
-        jobs[job_id]["progress"] = 0.8
+def separate_whole(job_id: str, separator, audio_path: Path, output_path: Path,
+                   reporter: Optional[ProgressReporter] = None) -> Dict[str, str]:
+    """Separate the whole file in one call; memory grows with track length"""
+    origin, separated = separator.separate_audio_file(str(audio_path))
+    if reporter:
+        reporter.set(0.85, force=True)
 
-        # Save stems
-        stems = {}
-        output_path = OUTPUT_DIR / job_id
-        output_path.mkdir(parents=True, exist_ok=True)
+    stems = {}
+    for stem_name, stem_audio in separated.items():
+        stem_file = output_path / f"{stem_name}.wav"
+        sf.write(str(stem_file), stem_audio.T, separator.samplerate)
+        stems[stem_name] = str(stem_file)
+    return stems
+
+
+def separate_chunked(job_id: str, separator, audio_path: Path, output_path: Path,
+                     reporter: Optional[ProgressReporter] = None) -> Dict[str, str]:
+    """
+    Stream the input through the separator in overlapping segments.
+
+    Segment k covers source frames [k*hop - overlap, (k+1)*hop). The
+    separated overlap region is linearly crossfaded with the previous
+    segment's held-back tail, and everything before the new tail is
+    appended to the stem files, so memory is bounded by one segment
+    however long the input is.
+    """
+    from demucs.audio import convert_audio
+
+    job = jobs[job_id]
+    samplerate = separator.samplerate
+    overlap = int(CHUNK_OVERLAP_SECONDS * samplerate)
+    writers, tails, stems = {}, {}, {}
+    written = 0
+
+    try:
+        with sf.SoundFile(str(audio_path)) as source:
+            hop = int(CHUNK_SECONDS * source.samplerate)
+            source_overlap = int(CHUNK_OVERLAP_SECONDS * source.samplerate)
+            total_seconds = source.frames / source.samplerate
+            job["durationSeconds"] = round(total_seconds, 2)
+
+            for start in range(0, source.frames, hop):
+                begin = max(start - source_overlap, 0)
+                end = min(start + hop, source.frames)
+                last = end >= source.frames
+                source.seek(begin)
+                block = source.read(end - begin, dtype="float32", always_2d=True)
+                wav = convert_audio(torch.from_numpy(block.T.copy()), source.samplerate,
+                                    samplerate, separator.audio_channels)
+                if reporter:
+                    reporter.span = (0.15 + 0.7 * start / source.frames, 0.15 + 0.7 * end / source.frames)
+                _, separated = separator.separate_tensor(wav, samplerate)
+
+                for stem_name, stem in separated.items():
+                    stem = stem.cpu()
+                    if stem_name not in writers:
+                        stems[stem_name] = str(output_path / f"{stem_name}.wav")
+                        writers[stem_name] = sf.SoundFile(stems[stem_name], "w", samplerate=samplerate,
+                                                          channels=stem.shape[0], subtype="FLOAT")
+                    tail = tails.pop(stem_name, None)
+                    if tail is not None:
+                        n = min(tail.shape[-1], stem.shape[-1])
+                        ramp = torch.linspace(0, 1, n)
+                        stem = torch.cat([tail[:, :n] * (1 - ramp) + stem[:, :n] * ramp, stem[:, n:]], dim=-1)
+                    if not last and overlap and stem.shape[-1] > overlap:
+                        stem, tails[stem_name] = stem[:, :-overlap], stem[:, -overlap:]
+                    writers[stem_name].write(stem.numpy().T)
+                    writers[stem_name].flush()
+                    frames = stem.shape[-1]  # same for every stem
+
+                written += frames
+                job["stemsReady"] = sorted(writers)
+                job["secondsReady"] = round(written / samplerate, 2)
+                if reporter:
+                    reporter.set(0.15 + 0.7 * min(written / samplerate / total_seconds, 1.0), force=True)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return stems
+
+
+def validate_output_format(fmt: str, bitrate: Optional[int]) -> None:
+    """Raise ValueError for formats this worker can't produce"""
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(OUTPUT_FORMATS)}")
+    if fmt == "opus" and not FFMPEG:
+        raise ValueError("Opus output needs ffmpeg, which is not installed")
+    if bitrate is not None and not 32 <= bitrate <= 320:
+        raise ValueError("bitrate must be between 32 and 320 kbps")
+
+
+def encode_stem(wav_path: Path, fmt: str, bitrate: Optional[int] = None) -> Path:
+    """Transcode a float WAV stem in blocks; returns the encoded file (the WAV is replaced)"""
+    spec = OUTPUT_FORMATS[fmt]
+    if fmt == "wav":
+        return wav_path
+    out_path = wav_path.with_name(f"{wav_path.stem}.encoding{spec['ext']}")
+    bitrate = bitrate or spec.get("bitrate")
+
+    if "codec" in spec and FFMPEG:
+        subprocess.run([
+            FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-i", str(wav_path),
+            "-c:a", spec["codec"], "-b:a", f"{bitrate}k", "-f", "ogg" if fmt == "opus" else fmt, str(out_path),
+        ], check=True, capture_output=True)
+    else:
+        kwargs = {"subtype": spec.get("subtype")}
+        if fmt == "mp3":
+            # libsndfile maps compression_level 0..1 onto 320..32 kbps (constant bitrate)
+            kwargs = {"format": "MP3", "subtype": "MPEG_LAYER_III", "bitrate_mode": "CONSTANT",
+                      "compression_level": (320 - bitrate) / (320 - 32)}
+        with sf.SoundFile(str(wav_path)) as src, sf.SoundFile(
+            str(out_path), "w", samplerate=src.samplerate, channels=src.channels, **kwargs
+        ) as dst:
+            for block in src.blocks(blocksize=65536, dtype="float32"):
+                dst.write(block)
+
+    final_path = wav_path.with_suffix(spec["ext"])
+    os.replace(out_path, final_path)
+    if final_path != wav_path:
+        wav_path.unlink()
+    return final_path
+
+
+def encode_stems(stems: Dict[str, str], fmt: str, bitrate: Optional[int] = None) -> tuple:
+    """Encode all stems concurrently; returns (stem paths, encoding report)"""
+    wav_bytes = sum(Path(path).stat().st_size for path in stems.values())
+    encode_start = time.perf_counter()
+
+    def one(item):
+        name, path = item
+        stem_start = time.perf_counter()
+        encoded = encode_stem(Path(path), fmt, bitrate)
+        return name, encoded, (time.perf_counter() - stem_start) * 1000
+
+    encoded_stems, per_stem = {}, {}
+    for name, path, ms in encode_executor.map(one, stems.items()):
+        encoded_stems[name] = str(path)
+        per_stem[name] = {"bytes": path.stat().st_size, "encodeMs": round(ms, 1)}
+
+    total_bytes = sum(stem["bytes"] for stem in per_stem.values())
+    return encoded_stems, {
+        "format": fmt,
+        "bitrate": (bitrate or OUTPUT_FORMATS[fmt]["bitrate"]) if "codec" in OUTPUT_FORMATS[fmt] else None,
+        "encodeMs": round((time.perf_counter() - encode_start) * 1000, 1),
+        "totalBytes": total_bytes,
+        "wavBytes": wav_bytes,
+        "stems": per_stem,
+    }
 
-        for stem_name, stem_audio in separated.items():
-            stem_file = output_path / f"{stem_name}.wav"
-            sf.write(str(stem_file), stem_audio.T, separator.samplerate)
-            stems[stem_name] = str(stem_file)
 
+def separate_audio(job_id: str, audio_path: Path, chunked: Optional[bool] = None,
+                   output_format: str = "wav", bitrate: Optional[int] = None):
+    """Run Demucs separation in background thread"""
+    try:
+        jobs[job_id]["status"] = "processing"
+        jobs[job_id]["progress"] = 0.1
+        events.publish(job_id)
+
+        output_path = OUTPUT_DIR / job_id
+        output_path.mkdir(parents=True, exist_ok=True)
+        jobs.add_artifact(job_id, output_path)
+
+        chunked = resolve_chunked(chunked, input_duration(audio_path))
+        jobs[job_id]["chunked"] = chunked
+
+        timings = {}
+        with separators.acquire(timings) as separator:
+            jobs[job_id].update(timings)
+            reporter = ProgressReporter(job_id, separator)
+            reporter.set(0.15, force=True)
+            separator.update_parameter(callback=reporter)
+            try:
+                if chunked:
+                    stems = separate_chunked(job_id, separator, audio_path, output_path, reporter)
+                else:
+                    stems = separate_whole(job_id, separator, audio_path, output_path, reporter)
+            finally:
+                separator.update_parameter(callback=None)
+
+        reporter.set(0.9, force=True)
+        stems, jobs[job_id]["encoding"] = encode_stems(stems, output_format, bitrate)
         jobs[job_id]["stems"] = stems
-        jobs[job_id]["status"] = "completed"
         jobs[job_id]["progress"] = 1.0
+        jobs[job_id]["status"] = "completed"
 
     except Exception as e:
-        jobs[job_id]["status"] = "failed"
         jobs[job_id]["error"] = str(e)
+        jobs[job_id]["status"] = "failed"
         print(f"[AudioProcessor] Job {job_id} failed: {e}")
+    finally:
+        events.publish(job_id)
+        audio_path.unlink(missing_ok=True)
+
+
+# Content key -> (job id, executor future) for separations still running
+inflight: Dict[str, tuple] = {}
+
+# Job fields a deduplicated job takes over from the job that did the work
+RESULT_FIELDS = ("status", "progress", "stems", "stemsReady", "secondsReady", "durationSeconds",
+                 "chunked", "encoding", "error")
+
+
+def content_key(digest: str, chunked: bool, fmt: str, bitrate: Optional[int]) -> str:
+    """
+    Identity of a separation result: upload hash plus everything that changes
+    the output. chunked must already be resolved (resolve_chunked), so an
+    automatic request and an explicit one that pick the same mode share a key.
+    """
+    return f"{digest}:{MODEL_NAME}:{chunked}:{fmt}:{bitrate or OUTPUT_FORMATS[fmt].get('bitrate')}"
+
+
+def completed_duplicate(key: str) -> Optional[str]:
+    """A completed job for key whose stems are still on disk, if any"""
+    for job_id in jobs:
+        job = jobs.get(job_id)
+        if (job and job.get("contentKey") == key and job["status"] == "completed"
+                and all(Path(path).exists() for path in job["stems"].values())):
+            return job_id
+    return None
+
+
+def adopt_result(job_id: str, source_id: str) -> None:
+    """Point job_id at source_id's outcome; stem files are shared, not copied"""
+    job, source = jobs.get(job_id), jobs.get(source_id)
+    if job is None:
+        return
+    if source is None:
+        job.update(status="failed", error=f"Job {source_id} expired before it could be shared")
+    else:
+        jobs.add_artifact(job_id, OUTPUT_DIR / source_id)
+        job.update({field: source[field] for field in RESULT_FIELDS if field in source})
+    events.publish(job_id)
+
+
+def file_etag(path: Path) -> str:
+    stat = path.stat()
+    return '"' + hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest() + '"'
+
+
+def parse_range(header: str, size: int) -> Optional[tuple]:
+    """
+    (start, end) inclusive for a single "bytes=" range, None to serve the
+    whole file (absent or multi-range), ValueError when unsatisfiable
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def ranged_file_response(request: Request, path: Path, media_type: str, filename: str) -> Response:
+    """FileResponse with ETag/If-None-Match and single-range (206) support for seeking"""
+    size = path.stat().st_size
+    etag = file_etag(path)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None  # file changed since the client's copy: send it whole
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return FileResponse(path=str(path), media_type=media_type, filename=filename, headers=headers)
+
+    start, end = byte_range
+
+    def body():
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(UPLOAD_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(body(), status_code=206, media_type=media_type, headers={
+        **headers,
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+    })
+
+
+@app.on_event("startup")
+async def startup():
+    """Load and warm the separator pool before accepting jobs"""
+    events.loop = asyncio.get_running_loop()
+    warm_start = time.perf_counter()
+    try:
+        await asyncio.get_event_loop().run_in_executor(executor, separators.warmup)
+        print(f"[AudioProcessor] Warmed {separators.size} separator(s) in {time.perf_counter() - warm_start:.1f}s")
+    except Exception as e:
+        # Jobs will retry the load and report the error themselves
+        print(f"[AudioProcessor] Warmup failed: {e}")
+    jobs.start_collector()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    jobs.stop_collector()
 
 
 @app.get("/health")
@@ -105,37 +614,94 @@ async def health():
         "model": MODEL_NAME,
         "gpu_available": torch.cuda.is_available(),
         "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "separators": separators.snapshot(),
+        "jobs": jobs.snapshot(),
     }
 
 
 @app.post("/separate")
-async def separate(file: UploadFile = File(...)):
+async def separate(
+    request: Request,
+    chunked: Optional[bool] = Query(None),
+    format: str = Query("wav"),
+    bitrate: Optional[int] = Query(None),
+):
     """
     Separate audio file into stems (vocals, drums, bass, other)
 
+    Expects a multipart "file" field, streamed to disk under MAX_UPLOAD_MB.
+
+    chunked streams long inputs through in segments (default: automatic
+    above CHUNKED_MIN_SECONDS); status then reports stemsReady and
+    secondsReady as segments complete.
+
+    format is wav (float), wav16, flac, mp3 or opus; bitrate (kbps)
+    applies to mp3/opus. Stems are encoded concurrently and the job
+    result reports encode time and size.
+
+    Uploads are hashed as they stream in. If the same content with the
+    same model and settings already has completed stems, the new job
+    shares them and completes immediately; if an identical job is still
+    running, the new job waits for it. Either way dedupOf names the job
+    that did the work.
+
     Returns job ID for polling status
     """
-    job_id = str(uuid.uuid4())
-
-    # Save uploaded file
-    temp_path = OUTPUT_DIR / f"{job_id}_input{Path(file.filename).suffix}"
-    content = await file.read()
+    try:
+        validate_output_format(format, bitrate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        release_slot = jobs.reserve_pending()
+    except PendingLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
-    with open(temp_path, "wb") as f:
-        f.write(content)
+    job_id = str(uuid.uuid4())
 
-    # Initialize job
-    jobs[job_id] = {
-        "jobId": job_id,
-        "status": "queued",
-        "progress": 0,
-        "stems": None,
-        "error": None,
-    }
+    # Stream the upload to disk; never hold it in memory or spool it twice
+    temp_path = OUTPUT_DIR / f"{job_id}_input"
+    hasher = hashlib.sha256()
+    try:
+        filename, _ = await receive_upload(request, temp_path, hasher=hasher)
+        if Path(filename).suffix:
+            temp_path = temp_path.rename(temp_path.with_name(f"{temp_path.name}{Path(filename).suffix}"))
+        chunked = resolve_chunked(chunked, await asyncio.to_thread(input_duration, temp_path))
+        key = content_key(hasher.hexdigest(), chunked, format, bitrate)
+
+        # Initialize job; from here it counts as pending itself
+        jobs[job_id] = {
+            "jobId": job_id,
+            "status": "queued",
+            "progress": 0,
+            "stems": None,
+            "stemsReady": [],
+            "secondsReady": 0.0,
+            "error": None,
+            "contentKey": key,
+        }
+    finally:
+        release_slot()
+
+    source_id, running = completed_duplicate(key), None
+    if source_id is None and key in inflight:
+        source_id, running = inflight[key]
+    if source_id is not None:
+        temp_path.unlink(missing_ok=True)
+        # Before adopt_result publishes, so subscribers never see the result without it
+        jobs[job_id]["dedupOf"] = source_id
+        if running is None:
+            adopt_result(job_id, source_id)
+        else:
+            running.add_done_callback(lambda _: adopt_result(job_id, source_id))
+        return JSONResponse({"jobId": job_id, "status": jobs[job_id]["status"], "dedupOf": source_id})
+
+    jobs.add_artifact(job_id, temp_path)
 
     # Start processing in background
     loop = asyncio.get_event_loop()
-    loop.run_in_executor(executor, separate_audio, job_id, temp_path)
+    running = loop.run_in_executor(executor, separate_audio, job_id, temp_path, chunked, format, bitrate)
+    inflight[key] = (job_id, running)
+    running.add_done_callback(lambda _: inflight.pop(key, None))
 
     return JSONResponse({
         "jobId": job_id,
@@ -146,19 +712,54 @@ async def separate(file: UploadFile = File(...)):
 @app.get("/status/{job_id}")
 async def get_status(job_id: str):
     """Get job status and results"""
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    return JSONResponse(jobs[job_id])
+    jobs.touch(job_id)
+    return JSONResponse(job)
 
 
-@app.get("/download/{job_id}/{stem}")
-async def download_stem(job_id: str, stem: str):
-    """Download a specific stem file"""
+@app.get("/status/{job_id}/events")
+async def status_events(job_id: str, request: Request):
+    """
+    Server-sent events for one job: the full job state on connect and on
+    every progress update (at most one per PROGRESS_INTERVAL_SECONDS),
+    ending after the completed/failed event. Replaces polling /status.
+    """
     if job_id not in jobs:
         raise HTTPException(status_code=404, detail="Job not found")
+    updates = events.subscribe(job_id)
+
+    async def stream():
+        try:
+            job = dict(jobs.get(job_id) or {})
+            yield f"data: {json.dumps(job)}\n\n"
+            while job.get("status") not in ("completed", "failed"):
+                try:
+                    job = await asyncio.wait_for(updates.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if job_id not in jobs or await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                jobs.touch(job_id)
+                yield f"data: {json.dumps(job)}\n\n"
+        finally:
+            events.unsubscribe(job_id, updates)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    job = jobs[job_id]
+
+@app.get("/download/{job_id}/{stem}")
+async def download_stem(job_id: str, stem: str, request: Request):
+    """Download a specific stem file (Range/ETag aware so players can seek)"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    jobs.touch(job_id)
     if job["status"] != "completed":
         raise HTTPException(status_code=400, detail="Job not completed")
 
@@ -169,17 +770,137 @@ async def download_stem(job_id: str, stem: str):
     if not stem_path.exists():
         raise HTTPException(status_code=404, detail="Stem file not found")
 
-    from fastapi.responses import FileResponse
-    return FileResponse(
-        path=str(stem_path),
-        media_type="audio/wav",
-        filename=f"{stem}.wav"
-    )
+    return ranged_file_response(request, stem_path, MEDIA_TYPES.get(stem_path.suffix, "application/octet-stream"),
+                                f"{stem}{stem_path.suffix}")
+
+
+def benchmark_model_load(jobs_count: int, seconds: float) -> None:
+    """Per-job model load time: a fresh Separator per job (old path) vs the resident pool"""
+    api = load_demucs()
+    with tempfile.TemporaryDirectory() as tmp:
+        audio_path = Path(tmp) / "bench.wav"
+        t = np.arange(int(44100 * seconds)) / 44100
+        tone = 0.2 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.random.default_rng(0).normal(size=t.shape)
+        sf.write(str(audio_path), np.stack([tone, tone], axis=1), 44100)
+
+        fresh = []
+        for _ in range(jobs_count):
+            load_start = time.perf_counter()
+            separator = api.Separator(model=MODEL_NAME, device=DEVICE)
+            fresh.append((time.perf_counter() - load_start) * 1000)
+            separator.separate_audio_file(str(audio_path))
+            del separator
+
+        pool = SeparatorPool(1)
+        resident = []
+        for _ in range(jobs_count):
+            timings = {}
+            with pool.acquire(timings) as separator:
+                separator.separate_audio_file(str(audio_path))
+            resident.append(timings["modelLoadMs"])
+
+    print(f"{'path':<10} " + " ".join(f"{'job ' + str(i + 1):>9}" for i in range(jobs_count)))
+    for label, timings in (("per-job", fresh), ("resident", resident)):
+        print(f"{label:<10} " + " ".join(f"{ms:>7.0f}ms" for ms in timings))
+
+
+def write_test_clip(path: Path, seconds: float, samplerate: int = 44100) -> None:
+    """Tone-plus-noise stereo WAV written block by block, so hour-long clips need no RAM"""
+    rng = np.random.default_rng(0)
+    block = samplerate * 10
+    with sf.SoundFile(str(path), "w", samplerate=samplerate, channels=2, subtype="PCM_16") as f:
+        for start in range(0, int(seconds * samplerate), block):
+            t = (start + np.arange(min(block, int(seconds * samplerate) - start))) / samplerate
+            tone = 0.2 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.normal(size=t.shape)
+            f.write(np.stack([tone, tone], axis=1))
+
+
+def _rss_probe(audio_path: Path, chunked: bool, conn) -> None:
+    import resource
+
+    job_id = f"bench-{'chunked' if chunked else 'whole'}"
+    jobs[job_id] = {}
+    output_path = OUTPUT_DIR / job_id
+    output_path.mkdir(parents=True, exist_ok=True)
+    separator = load_demucs().Separator(model=MODEL_NAME, device=DEVICE)
+    # ru_maxrss is KB on Linux; baseline includes the loaded model
+    baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    run_start = time.perf_counter()
+    if chunked:
+        separate_chunked(job_id, separator, audio_path, output_path)
+    else:
+        separate_whole(job_id, separator, audio_path, output_path)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    conn.send((time.perf_counter() - run_start, peak_mb - baseline_mb))
+
+
+def benchmark_chunked(durations) -> None:
+    """Peak RSS growth (above the loaded model) of whole-file vs chunked separation"""
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")  # clean torch state per probe
+    print(f"{'seconds':>8} {'mode':<8} {'wall s':>8} {'peak +MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in durations:
+            audio_path = Path(tmp) / f"clip_{seconds:g}.wav"
+            write_test_clip(audio_path, seconds)
+            for chunked in (False, True):
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(target=_rss_probe, args=(audio_path, chunked, child))
+                proc.start()
+                wall, peak = parent.recv()
+                proc.join()
+                print(f"{seconds:>8g} {'chunked' if chunked else 'whole':<8} {wall:>8.1f} {peak:>9.0f}")
+
+
+def benchmark_encode(seconds: float) -> None:
+    """Encode time (4 stems in parallel) and size per output format"""
+    formats = [fmt for fmt in OUTPUT_FORMATS if fmt != "opus" or FFMPEG]
+    print(f"{seconds:g}s stereo stems x4, {ENCODE_WORKERS} encode workers, ffmpeg={'yes' if FFMPEG else 'no'}")
+    print(f"{'format':<8} {'encode ms':>10} {'MB':>8} {'vs wav':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "source.wav"
+        write_test_clip(source, seconds)
+        for fmt in formats:
+            job_dir = Path(tmp) / fmt
+            job_dir.mkdir()
+            stems = {}
+            for name in ("drums", "bass", "other", "vocals"):
+                stems[name] = str(job_dir / f"{name}.wav")
+                with sf.SoundFile(str(source)) as src, sf.SoundFile(
+                    stems[name], "w", samplerate=src.samplerate, channels=src.channels, subtype="FLOAT"
+                ) as dst:
+                    for block in src.blocks(blocksize=65536, dtype="float32"):
+                        dst.write(block)
+            _, report = encode_stems(stems, fmt)
+            print(f"{fmt:<8} {report['encodeMs']:>10.0f} {report['totalBytes'] / 1024 / 1024:>8.1f} "
+                  f"{report['totalBytes'] / report['wavBytes']:>7.1%}")
 
 
 if __name__ == "__main__":
     import uvicorn
 
+    parser = argparse.ArgumentParser(description="Audio Processor Worker")
+    parser.add_argument("--benchmark-load", action="store_true",
+                        help="Compare per-job model load time with and without the resident pool, then exit")
+    parser.add_argument("--jobs", type=int, default=4, help="Jobs per path for --benchmark-load")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Length of the benchmark clip")
+    parser.add_argument("--benchmark-encode", action="store_true",
+                        help="Report encode time and size per stem output format, then exit")
+    parser.add_argument("--benchmark-chunked", nargs="*", type=float, metavar="SECONDS",
+                        help="Peak RSS of whole-file vs chunked separation for these clip lengths, then exit")
+    args = parser.parse_args()
+
+    if args.benchmark_load:
+        benchmark_model_load(args.jobs, args.seconds)
+        raise SystemExit(0)
+    if args.benchmark_encode:
+        benchmark_encode(args.seconds)
+        raise SystemExit(0)
+    if args.benchmark_chunked is not None:
+        benchmark_chunked(args.benchmark_chunked or [60, 600, 3600])
+        raise SystemExit(0)
+
     port = int(os.getenv("PORT", 8002))
     print(f"[AudioProcessor] Starting on port {port}")
     print(f"[AudioProcessor] Device: {DEVICE}")
@@ -1,16 +1,20 @@
 import os
 import uuid
+import hashlib
+import asyncio
 import logging
 import torch
 import torchaudio
 from typing import Optional, List
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.responses import FileResponse
 from demucs.apply import apply_model
 from demucs.pretrained import get_model
 from stable_audio_tools import get_pretrained_model
 from stable_audio_tools.inference.generation import generate_diffusion_cond
+from job_store import JobStore, PendingLimitExceeded
+from uploads import receive_upload
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("audio-processor")
@@ -40,6 +44,7 @@ class ProcessingResponse(BaseModel):
     status: str
     result_urls: Optional[dict] = None
     error: Optional[str] = None
+    dedupOf: Optional[str] = None
 
 class SampleRequest(BaseModel):
     prompt: str
@@ -47,8 +52,44 @@ class SampleRequest(BaseModel):
     steps: Optional[int] = 50
     cfg_scale: Optional[float] = 7.0
 
-# In-memory job storage
-jobs = {}
+# In-memory job storage; finished jobs and their files expire (see job_store.py)
+jobs = JobStore(roots=[STEMS_DIR, SAMPLES_DIR, UPLOAD_DIR], log=logger.info)
+
+def admit_job(job_id: str, job: dict):
+    """Register a new job, 429 once MAX_PENDING_JOBS are unfinished"""
+    try:
+        jobs.check_pending()
+    except PendingLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    jobs[job_id] = job
+
+# Content key -> (job id, done event) for stem separations still running
+inflight = {}
+
+def completed_duplicate(key: str) -> Optional[str]:
+    """A completed separation job for key whose stems are still on disk, if any"""
+    for job_id in jobs:
+        job = jobs.get(job_id)
+        if (job and job.get("contentKey") == key and job["status"] == "completed"
+                and all(os.path.exists(os.path.join(STEMS_DIR, job_id, f"{name}.mp3"))
+                        for name in job.get("result_urls") or {})):
+            return job_id
+    return None
+
+def adopt_result(job_id: str, source_id: str):
+    """Point job_id at source_id's outcome; stem files are shared, not copied"""
+    job, source = jobs.get(job_id), jobs.get(source_id)
+    if job is None:
+        return
+    if source is None:
+        job.update(status="failed", error=f"Job {source_id} expired before it could be shared")
+        return
+    jobs.add_artifact(job_id, os.path.join(STEMS_DIR, source_id))
+    job.update({k: source[k] for k in ("status", "result_urls", "error") if k in source})
+
+async def follow_job(job_id: str, source_id: str, done: asyncio.Event):
+    await done.wait()
+    adopt_result(job_id, source_id)
 
 @app.on_event("startup")
 async def load_models():
@@ -65,10 +106,12 @@ async def load_models():
         # stable_audio_model.to(device)
     except Exception as e:
         logger.error(f"Error loading models: {e}")
+    jobs.start_collector()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutdown signal received. Cleaning up Audio Processor...")
+    jobs.stop_collector()
     # Explicitly clear VRAM
     global demucs_model, stable_audio_model
     if demucs_model: del demucs_model
@@ -100,6 +143,7 @@ async def process_stems(job_id: str, input_path: str):
         
         job_dir = os.path.join(STEMS_DIR, job_id)
         os.makedirs(job_dir, exist_ok=True)
+        jobs.add_artifact(job_id, job_dir)
         
         for source, name in zip(sources, stem_names):
             stem_path = os.path.join(job_dir, f"{name}.mp3")
@@ -119,22 +163,57 @@ async def process_stems(job_id: str, input_path: str):
             os.remove(input_path)
 
 @app.post("/separate", response_model=ProcessingResponse)
-async def separate_stems(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def separate_stems(request: Request, background_tasks: BackgroundTasks):
+    # The slot is held across the upload so concurrent uploads can't all pass the cap
+    try:
+        release_slot = jobs.reserve_pending()
+    except PendingLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     job_id = str(uuid.uuid4())
-    input_path = os.path.join(UPLOAD_DIR, f"{job_id}_{file.filename}")
-    
-    with open(input_path, "wb") as buffer:
-        buffer.write(await file.read())
-        
-    jobs[job_id] = {"status": "pending"}
-    background_tasks.add_task(process_stems, job_id, input_path)
+    try:
+        # Multipart "file" field, streamed straight to disk under MAX_UPLOAD_MB
+        upload_path = os.path.join(UPLOAD_DIR, f"{job_id}_upload")
+        hasher = hashlib.sha256()
+        filename, _ = await receive_upload(request, upload_path, hasher=hasher)
+        # basename only: the client controls filename
+        input_path = os.path.join(UPLOAD_DIR, f"{job_id}_{os.path.basename(filename) or 'upload'}")
+        os.replace(upload_path, input_path)
+        # Identical content separated by the same model gives identical stems
+        key = f"{hasher.hexdigest()}:htdemucs"
+        jobs[job_id] = {"status": "pending", "contentKey": key}
+    finally:
+        release_slot()
+
+    source_id, done = completed_duplicate(key), None
+    if source_id is None and key in inflight:
+        source_id, done = inflight[key]
+    if source_id is not None:
+        os.remove(input_path)
+        # Before the result is adopted, so a poll never sees it without dedupOf
+        jobs[job_id]["dedupOf"] = source_id
+        if done is None:
+            adopt_result(job_id, source_id)
+        else:
+            background_tasks.add_task(follow_job, job_id, source_id, done)
+        return {"jobId": job_id, "status": jobs[job_id]["status"], "dedupOf": source_id}
+
+    jobs.add_artifact(job_id, input_path)
+    inflight[key] = (job_id, asyncio.Event())
+    background_tasks.add_task(run_separation, job_id, input_path, key)
     
     return {"jobId": job_id, "status": "pending"}
 
+async def run_separation(job_id: str, input_path: str, key: str):
+    try:
+        await process_stems(job_id, input_path)
+    finally:
+        _, done = inflight.pop(key)
+        done.set()
+
 @app.post("/sample", response_model=ProcessingResponse)
 async def generate_sample(request: SampleRequest, background_tasks: BackgroundTasks):
     job_id = str(uuid.uuid4())
-    jobs[job_id] = {"status": "pending"}
+    admit_job(job_id, {"status": "pending"})
     
     async def run_sample_gen():
         try:
@@ -146,6 +225,7 @@ async def generate_sample(request: SampleRequest, background_tasks: BackgroundTa
             time.sleep(3) 
             
             output_path = os.path.join(SAMPLES_DIR, f"{job_id}.mp3")
+            jobs.add_artifact(job_id, output_path)
             # Fake save for UI testing
             with open(output_path, "wb") as f: f.write(b"fake audio data")
             
@@ -163,7 +243,7 @@ async def generate_sample(request: SampleRequest, background_tasks: BackgroundTa
 async def generate_sfx(request: SampleRequest, background_tasks: BackgroundTasks):
     # Specialized SFX endpoint (using AudioLDM2 optimized parameters)
     job_id = f"sfx_{uuid.uuid4()}"
-    jobs[job_id] = {"status": "pending"}
+    admit_job(job_id, {"status": "pending"})
     
     async def run_sfx_gen():
         try:
@@ -173,6 +253,7 @@ async def generate_sfx(request: SampleRequest, background_tasks: BackgroundTasks
             time.sleep(2)
             
             output_path = os.path.join(SAMPLES_DIR, f"{job_id}.mp3")
+            jobs.add_artifact(job_id, output_path)
             with open(output_path, "wb") as f: f.write(b"fake sfx data")
             
             jobs[job_id]["status"] = "completed"
@@ -187,7 +268,7 @@ async def generate_sfx(request: SampleRequest, background_tasks: BackgroundTasks
 @app.post("/theme-pack")
 async def generate_theme_pack(prompts: List[str], background_tasks: BackgroundTasks):
     job_id = f"pack_{uuid.uuid4()}"
-    jobs[job_id] = {"status": "pending", "results": []}
+    admit_job(job_id, {"status": "pending", "results": []})
     
     async def run_pack_gen():
         try:
@@ -198,6 +279,7 @@ async def generate_theme_pack(prompts: List[str], background_tasks: BackgroundTa
                 # Simulate batch generation
                 item_id = f"{job_id}_{i}"
                 output_path = os.path.join(SAMPLES_DIR, f"{item_id}.mp3")
+                jobs.add_artifact(job_id, output_path)
                 with open(output_path, "wb") as f: f.write(b"fake pack data")
                 results[f"sound_{i}"] = f"/generations/audio/samples/{item_id}.mp3"
             
@@ -212,9 +294,11 @@ async def generate_theme_pack(prompts: List[str], background_tasks: BackgroundTa
 
 @app.get("/status/{job_id}", response_model=ProcessingResponse)
 async def get_status(job_id: str):
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return {**jobs[job_id], "jobId": job_id}
+    jobs.touch(job_id)
+    return {**job, "jobId": job_id}
 
 if __name__ == "__main__":
     import uvicorn
@@ -7,6 +7,8 @@ from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.responses import FileResponse
 
+from job_store import JobStore, PendingLimitExceeded
+
 # Ensure we can import heartlib from the parent directory or site-packages
 sys.path.append(os.path.join(os.getcwd(), 'heartlib'))
 
@@ -48,14 +50,19 @@ class GenerationResponse(BaseModel):
     result_url: Optional[str] = None
     error: Optional[str] = None
 
-# In-memory storage for job status
-jobs = {}
+# In-memory storage for job status; finished jobs and their files expire (see job_store.py)
+jobs = JobStore(roots=[OUTPUT_DIR], log=logger.info)
 
 @app.on_event("startup")
 async def startup_event():
     logger.info(f"Checking for checkpoints in {CKPT_PATH}")
     if not os.path.exists(CKPT_PATH):
         logger.warning(f"Checkpoints not found at {CKPT_PATH}. Ensure download is complete.")
+    jobs.start_collector()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    jobs.stop_collector()
 
 async def run_generation(job_id: str, request: GenerationRequest):
     try:
@@ -63,6 +70,7 @@ async def run_generation(job_id: str, request: GenerationRequest):
         
         output_filename = f"{job_id}.mp3"
         save_path = os.path.join(OUTPUT_DIR, output_filename)
+        jobs.add_artifact(job_id, save_path)
         
         # This is where we call the heartlib model
         # Note: In a real implementation, we'd load the model once into VRAM
@@ -102,6 +110,10 @@ async def run_generation(job_id: str, request: GenerationRequest):
 
 @app.post("/generate", response_model=GenerationResponse)
 async def generate(request: GenerationRequest, background_tasks: BackgroundTasks):
+    try:
+        jobs.check_pending()
+    except PendingLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     job_id = str(uuid.uuid4())
     jobs[job_id] = {"status": "pending"}
     
@@ -114,10 +126,10 @@ async def generate(request: GenerationRequest, background_tasks: BackgroundTasks
 
 @app.get("/status/{job_id}", response_model=GenerationResponse)
 async def get_status(job_id: str):
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = jobs[job_id]
+    jobs.touch(job_id)
     return {
         "jobId": job_id,
         "status": job["status"],
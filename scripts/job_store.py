@@ -0,0 +1,263 @@
+"""
+Bounded job table and artifact garbage collection for the audio workers
+
+Shared by audio-processor-worker.py, audio-processor.py and heart-worker.py.
+Each job stays a plain dict that handlers mutate in place; the store notes
+when a job finishes and which files it produced, forgets finished jobs after
+JOB_TTL_SECONDS (deleting their files), and keeps the artifact roots under
+DISK_QUOTA_MB by evicting the least recently used finished jobs first.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", str(6 * 3600)))
+MAX_JOBS = int(os.getenv("MAX_JOBS", "1000"))
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "32"))
+DISK_QUOTA_BYTES = int(float(os.getenv("DISK_QUOTA_MB", "20480")) * 1024 * 1024)
+GC_INTERVAL_SECONDS = float(os.getenv("GC_INTERVAL_SECONDS", "60"))
+
+FINISHED_STATUSES = ("completed", "failed")
+
+logger = logging.getLogger("job-store")
+
+
+class PendingLimitExceeded(Exception):
+    """Too many unfinished jobs to accept another"""
+
+
+def path_size(path: Path) -> int:
+    """Bytes used by a file or directory tree (0 if it vanished)"""
+    try:
+        if path.is_dir() and not path.is_symlink():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file() and not f.is_symlink())
+        return path.lstat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def remove_path(path: Path) -> int:
+    """Delete a file or directory tree; returns the bytes freed"""
+    size = path_size(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+    return size
+
+
+class JobStore(MutableMapping):
+    """
+    Dict of job id -> job state with TTL expiry, a pending-job cap and disk GC
+
+    roots are the directories the worker writes job artifacts into. Entries
+    there that no live job owns (left by a restart or crash) are treated as
+    orphans and removed once older than the TTL.
+    """
+
+    def __init__(
+        self,
+        roots: Iterable = (),
+        ttl_seconds: float = JOB_TTL_SECONDS,
+        max_jobs: int = MAX_JOBS,
+        max_pending: int = MAX_PENDING_JOBS,
+        quota_bytes: int = DISK_QUOTA_BYTES,
+        log: Callable[[str], None] = logger.info,
+    ):
+        self.roots = [Path(root) for root in roots]
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self.quota_bytes = quota_bytes
+        self.log = log
+        self._jobs: Dict[str, dict] = {}
+        self._artifacts: Dict[str, List[Path]] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._accessed_at: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reserved = 0  # pending slots held by requests still uploading
+        self.stats = {
+            "runs": 0,
+            "expiredJobs": 0,
+            "evictedJobs": 0,
+            "orphansRemoved": 0,
+            "reclaimedBytes": 0,
+            "lastReclaimedBytes": 0,
+            "diskBytes": 0,
+        }
+
+    def __getitem__(self, job_id: str) -> dict:
+        return self._jobs[job_id]
+
+    def __setitem__(self, job_id: str, job: dict) -> None:
+        with self._lock:
+            self._jobs[job_id] = job
+            self._accessed_at[job_id] = time.time()
+
+    def __delitem__(self, job_id: str) -> None:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError(job_id)
+            self._forget(job_id)
+
+    def __iter__(self):
+        return iter(list(self._jobs))
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def pending(self) -> int:
+        """Jobs that have not completed or failed yet"""
+        return sum(1 for job in list(self._jobs.values()) if job.get("status") not in FINISHED_STATUSES)
+
+    def check_pending(self) -> None:
+        """Raise PendingLimitExceeded if a new job would exceed max_pending"""
+        if self.max_pending and self.pending() + self._reserved >= self.max_pending:
+            raise PendingLimitExceeded(f"{self.max_pending} jobs already pending; retry later")
+
+    def reserve_pending(self) -> Callable[[], None]:
+        """
+        Claim a pending slot for a job that is registered only after a slow
+        step (an upload), so concurrent requests can't all pass the cap.
+        Returns the release function; call it once the job is registered or
+        the request failed.
+        """
+        with self._lock:
+            self.check_pending()
+            self._reserved += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            with self._lock:
+                if not released:
+                    self._reserved -= 1
+                    released = True
+
+        return release
+
+    def touch(self, job_id: str) -> None:
+        """Mark a job as recently used (status poll, download) for LRU eviction"""
+        if job_id in self._jobs:
+            self._accessed_at[job_id] = time.time()
+
+    def add_artifact(self, job_id: str, path) -> None:
+        """Record a file or directory owned by job_id; it is deleted with the last job owning it"""
+        with self._lock:
+            if job_id in self._jobs:
+                self._artifacts.setdefault(job_id, []).append(Path(path))
+
+    def _forget(self, job_id: str) -> List[Path]:
+        self._jobs.pop(job_id, None)
+        self._finished_at.pop(job_id, None)
+        self._accessed_at.pop(job_id, None)
+        return self._artifacts.pop(job_id, [])
+
+    def _owned(self) -> set:
+        return {path.resolve() for paths in self._artifacts.values() for path in paths}
+
+    def collect(self) -> dict:
+        """Expire finished jobs past the TTL or MAX_JOBS, remove orphans, then enforce the disk quota"""
+        now = time.time()
+        expired, evicted, orphans, reclaimed = 0, 0, 0, 0
+        doomed: List[Path] = []
+
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job.get("status") in FINISHED_STATUSES:
+                    self._finished_at.setdefault(job_id, now)
+            by_age = sorted(self._finished_at, key=self._finished_at.get)
+            overflow = max(len(self._jobs) - self.max_jobs, 0) if self.max_jobs else 0
+            for index, job_id in enumerate(by_age):
+                if index < overflow or now - self._finished_at[job_id] >= self.ttl_seconds:
+                    doomed += self._forget(job_id)
+                    expired += 1
+            owned = self._owned()
+
+        # Deduplicated jobs share artifacts; keep those another live job still owns
+        reclaimed += sum(remove_path(path) for path in doomed if path.resolve() not in owned)
+
+        usage = 0
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            for entry in root.iterdir():
+                if entry.resolve() in owned:
+                    usage += path_size(entry)
+                    continue
+                try:
+                    age = now - entry.lstat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age >= self.ttl_seconds:
+                    reclaimed += remove_path(entry)
+                    orphans += 1
+                else:
+                    usage += path_size(entry)
+
+        if self.quota_bytes and usage > self.quota_bytes:
+            with self._lock:
+                lru = sorted(self._finished_at, key=lambda job_id: self._accessed_at.get(job_id, 0))
+            for job_id in lru:
+                if usage <= self.quota_bytes:
+                    break
+                with self._lock:
+                    paths = self._forget(job_id)
+                    owned = self._owned()
+                freed = sum(remove_path(path) for path in paths if path.resolve() not in owned)
+                usage -= freed
+                reclaimed += freed
+                evicted += 1
+
+        self.stats["runs"] += 1
+        self.stats["expiredJobs"] += expired
+        self.stats["evictedJobs"] += evicted
+        self.stats["orphansRemoved"] += orphans
+        self.stats["reclaimedBytes"] += reclaimed
+        self.stats["lastReclaimedBytes"] = reclaimed
+        self.stats["diskBytes"] = usage
+        if expired or evicted or orphans:
+            self.log(
+                f"GC reclaimed {reclaimed / 1024 / 1024:.1f} MB: {expired} expired, {evicted} evicted "
+                f"over quota, {orphans} orphans; {usage / 1024 / 1024:.1f} MB in use"
+            )
+        return {"expired": expired, "evicted": evicted, "orphans": orphans, "reclaimedBytes": reclaimed,
+                "diskBytes": usage}
+
+    def start_collector(self, interval: float = GC_INTERVAL_SECONDS) -> None:
+        """Run collect() every interval seconds on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.collect()
+                except Exception as e:
+                    self.log(f"GC failed: {e}")
+
+        self._thread = threading.Thread(target=loop, name="job-store-gc", daemon=True)
+        self._thread.start()
+
+    def stop_collector(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> dict:
+        """Job counts, limits and GC totals for health endpoints"""
+        return {
+            "jobs": len(self._jobs),
+            "pending": self.pending(),
+            "maxPending": self.max_pending,
+            "ttlSeconds": self.ttl_seconds,
+            "quotaBytes": self.quota_bytes,
+            **self.stats,
+        }
@@ -6,51 +6,183 @@ Provides image segmentation via BullMQ job queue with real-time progress updates
 import time
 import json
 import os
+import argparse
 import asyncio
+import base64
+import hashlib
+import math
 import redis
 import torch
 import numpy as np
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+from typing import Optional, List, Dict
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 import uvicorn
 import threading
+import itertools
+from collections import OrderedDict
+from concurrent.futures import Future
 from PIL import Image
+import httpx
 import requests
 from io import BytesIO
+from urllib.parse import urlparse
 
 # Try importing SAM2
 try:
-    from sam2.build_sam import build_sam2
+    from sam2.build_sam import build_sam2, build_sam2_video_predictor
     from sam2.sam2_image_predictor import SAM2ImagePredictor
+    from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
     SAM2_AVAILABLE = True
 except ImportError:
     SAM2_AVAILABLE = False
     print("[!] SAM2 not installed, using mock mode")
 
+# OpenCV is only needed for polygon mask output and video decoding
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
 # Configuration
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 MODEL_ID = "facebook/sam2"
 QUEUE_NAME = "batch-generation-queue"
 PORT = int(os.getenv("SAM2_PORT", "8006"))
+SAM2_CHECKPOINT_DIR = os.getenv("SAM2_CHECKPOINT_DIR", "checkpoints")
+DEFAULT_MODEL = os.getenv("SAM2_DEFAULT_MODEL", "large")
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("SAM2_MODEL_MEMORY_BUDGET_MB", "4096"))
+VIDEO_WINDOW_FRAMES = int(os.getenv("SAM2_VIDEO_WINDOW_FRAMES", "48"))
+# video_path is only honoured inside this directory; unset disables local paths
+VIDEO_INPUT_DIR = os.getenv("SAM2_VIDEO_INPUT_DIR")
+MAX_DOWNLOAD_BYTES = int(os.getenv("SAM2_MAX_DOWNLOAD_MB", "50")) * 1024 * 1024
+MAX_INPUT_PIXELS = int(os.getenv("SAM2_MAX_INPUT_MEGAPIXELS", "120")) * 1_000_000
+MODEL_INPUT_SIDE = 1024  # SAM2 resizes every image to 1024x1024 before encoding
+DOWNLOAD_TIMEOUT = float(os.getenv("SAM2_DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_POOL_SIZE = int(os.getenv("SAM2_DOWNLOAD_POOL_SIZE", "32"))
+MAX_PENDING_INFERENCE = int(os.getenv("SAM2_MAX_PENDING_INFERENCE", "16"))
+BATCH_MAX_WAIT = float(os.getenv("SAM2_BATCH_MAX_WAIT", "10"))
+SESSION_TTL = float(os.getenv("SAM2_SESSION_TTL", "300"))
+MAX_SESSIONS = int(os.getenv("SAM2_MAX_SESSIONS", "32"))
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SAM2_SESSION_MEMORY_MB", "2048"))  # stored image features
+
+# Scheduler priorities (lower runs first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
 
 # Initialize Redis
 r = redis.from_url(REDIS_URL)
 app = FastAPI(title="SAM2 Worker", version="1.0.0")
 
+# Selectable checkpoints: name -> (model config, checkpoint file in SAM2_CHECKPOINT_DIR)
+SAM2_MODELS: Dict[str, tuple] = {
+    "tiny": ("sam2_hiera_t.yaml", "sam2_hiera_tiny.pt"),
+    "small": ("sam2_hiera_s.yaml", "sam2_hiera_small.pt"),
+    "base-plus": ("sam2_hiera_b+.yaml", "sam2_hiera_base_plus.pt"),
+    "large": ("sam2_hiera_l.yaml", "sam2_hiera_large.pt"),
+}
+
+# Automatic mask generation presets, ordered from fastest to most thorough.
+# Denser grids and extra crop layers find more (and smaller) objects at the
+# cost of more decoder passes per image.
+AMG_PRESETS: Dict[str, dict] = {
+    "fast": {
+        "points_per_side": 16,
+        "points_per_batch": 256,
+        "crop_n_layers": 0,
+        "pred_iou_thresh": 0.86,
+        "stability_score_thresh": 0.92,
+        "box_nms_thresh": 0.7,
+        "crop_nms_thresh": 0.7,
+        "min_mask_region_area": 0,
+    },
+    "balanced": {
+        "points_per_side": 32,
+        "points_per_batch": 128,
+        "crop_n_layers": 0,
+        "pred_iou_thresh": 0.8,
+        "stability_score_thresh": 0.95,
+        "box_nms_thresh": 0.7,
+        "crop_nms_thresh": 0.7,
+        "min_mask_region_area": 0,
+    },
+    "quality": {
+        "points_per_side": 64,
+        "points_per_batch": 128,
+        "crop_n_layers": 1,
+        "crop_n_points_downscale_factor": 2,
+        "pred_iou_thresh": 0.7,
+        "stability_score_thresh": 0.92,
+        "box_nms_thresh": 0.7,
+        "crop_nms_thresh": 0.7,
+        "min_mask_region_area": 25,
+    },
+}
+AMG_OPTION_KEYS = {
+    "points_per_side", "points_per_batch", "crop_n_layers",
+    "crop_n_points_downscale_factor", "pred_iou_thresh",
+    "stability_score_thresh", "box_nms_thresh", "crop_nms_thresh",
+    "min_mask_region_area",
+}
+
 # Global state
-predictor: Optional["SAM2ImagePredictor"] = None
 model_loaded = False
 start_time = time.time()
 
+# One pooled client for HTTP-path downloads
+http_client: Optional[httpx.AsyncClient] = None
+
 
 class SegmentRequest(BaseModel):
     image_url: str
+    model: Optional[str] = None  # tiny, small, base-plus, large
     points: Optional[List[List[float]]] = None
     labels: Optional[List[int]] = None
     boxes: Optional[List[List[float]]] = None
     mode: str = "automatic"
     multimask_output: bool = False
+    amg_preset: str = "balanced"
+    amg_options: Optional[Dict[str, float]] = None
+    mask_encoding: str = "png"  # png, rle, bitpacked, polygons, labelmap
+    inline_masks: bool = False
+    mask_resolution: str = "original"  # original, decoded
+
+
+class VideoPrompt(BaseModel):
+    obj_id: int
+    frame_idx: int = 0
+    points: Optional[List[List[float]]] = None
+    labels: Optional[List[int]] = None
+    box: Optional[List[float]] = None
+
+
+class VideoSegmentRequest(BaseModel):
+    video_url: Optional[str] = None
+    video_path: Optional[str] = None
+    prompts: List[VideoPrompt]
+    window_frames: Optional[int] = None
+    model: Optional[str] = None
+
+
+class EmbeddingRequest(BaseModel):
+    image_url: str
+    model: Optional[str] = None
+    dtype: str = "float16"  # float16, float32
+
+
+class SessionRequest(BaseModel):
+    image_url: str
+    model: Optional[str] = None
+
+
+class SessionClickRequest(BaseModel):
+    points: List[List[float]] = []
+    labels: Optional[List[int]] = None
+    box: Optional[List[float]] = None
+    reset: bool = False
+    mask_encoding: str = "rle"
+    inline_masks: bool = True
+    mask_resolution: str = "original"
 
 
 class HealthResponse(BaseModel):
@@ -59,6 +191,11 @@ class HealthResponse(BaseModel):
     vram_used_mb: float
     vram_total_mb: float
     uptime: float
+    scheduler_pending: int = 0
+    models_available: List[str] = []
+    model_memory_mb: float = 0
+    active_sessions: int = 0
+    session_memory_mb: float = 0
 
 
 def get_vram_usage() -> float:
@@ -96,11 +233,689 @@ def publish_result(job_id: str, status: str, data: dict = None, error: str = Non
     r.publish(f"job-results:{job_id}", json.dumps(result))
 
 
-def download_image(url: str) -> Image.Image:
-    """Download image from URL and return PIL Image."""
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
-    return Image.open(BytesIO(response.content)).convert("RGB")
+class CachedEmbeddingPredictor:
+    """
+    Wraps SAM2ImagePredictor so repeated set_image calls on the same pixels
+    reuse the existing image embedding instead of re-running the encoder.
+    """
+
+    def __init__(self, inner: "SAM2ImagePredictor"):
+        self.inner = inner
+        self._image_key: Optional[str] = None
+
+    @staticmethod
+    def image_key(image_np: np.ndarray) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(image_np).data, digest_size=16)
+        return f"{image_np.shape}:{digest.hexdigest()}"
+
+    def set_image(self, image_np: np.ndarray, key: Optional[str] = None) -> None:
+        key = key or self.image_key(image_np)
+        if key == self._image_key and self.inner._is_image_set:
+            return
+        self.inner.set_image(image_np)
+        self._image_key = key
+
+    def reset_predictor(self) -> None:
+        # Keep the embedding around; the next set_image decides whether it is stale.
+        pass
+
+    def export_features(self) -> tuple:
+        """(key, features, orig_hw) of the current image, for use_features later."""
+        return self._image_key, self.inner._features, self.inner._orig_hw[-1]
+
+    def use_features(self, key: str, features: dict, orig_hw: tuple) -> None:
+        """Point the predictor at previously exported features without re-encoding."""
+        if key == self._image_key and self.inner._is_image_set:
+            return
+        self.inner._features = features
+        self.inner._orig_hw = [orig_hw]
+        self.inner._is_image_set = True
+        self._image_key = key
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def model_paths(name: str) -> tuple:
+    """Config and checkpoint path for a registry entry."""
+    model_cfg, filename = SAM2_MODELS[name]
+    checkpoint = os.path.join(SAM2_CHECKPOINT_DIR, filename)
+    # Deployments that predate the registry point SAM2_CHECKPOINT_PATH at the default model
+    if name == DEFAULT_MODEL and os.getenv("SAM2_CHECKPOINT_PATH"):
+        checkpoint = os.getenv("SAM2_CHECKPOINT_PATH")
+    return model_cfg, checkpoint
+
+
+def resolve_model_name(name: Optional[str]) -> str:
+    name = name or DEFAULT_MODEL
+    if name not in SAM2_MODELS:
+        raise ValueError(f"Unknown SAM2 model '{name}', expected one of {list(SAM2_MODELS)}")
+    return name
+
+
+class ModelRegistry:
+    """
+    Lazily loaded SAM2 image and video predictors, kept resident under one
+    memory budget. Loading a model that would exceed the budget evicts the
+    least recently used ones first. Only the scheduler thread (and the CLI
+    benchmarks) call get()/get_video(), so an evicted model is never in use.
+    """
+
+    def __init__(self, budget_mb: float):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Image predictors under the model name, video predictors under "<name>:video"
+        self._models: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+        # Snapshot for /health, which must not wait on a load in progress
+        self.loaded: List[str] = []
+
+    @staticmethod
+    def _model_bytes(model) -> int:
+        tensors = itertools.chain(model.parameters(), model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    @property
+    def memory_mb(self) -> float:
+        return sum(self._sizes.values()) / 1024 / 1024
+
+    def _evict_for(self, incoming_bytes: int) -> None:
+        evicted = False
+        while self._models and sum(self._sizes.values()) + incoming_bytes > self.budget_bytes:
+            name, _ = self._models.popitem(last=False)
+            self._sizes.pop(name)
+            evicted = True
+            print(f"[*] Evicted SAM2 '{name}' to stay under {self.budget_bytes / 1024 / 1024:.0f}MB")
+        if evicted:
+            import gc
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def get(self, name: Optional[str] = None) -> "CachedEmbeddingPredictor":
+        name = resolve_model_name(name)
+
+        def build(model_cfg: str, checkpoint: str) -> tuple:
+            model = build_sam2(model_cfg, checkpoint, device=self.device)
+            return CachedEmbeddingPredictor(SAM2ImagePredictor(model)), model
+
+        return self._get(name, name, build)
+
+    def get_video(self, name: Optional[str] = None):
+        """The SAM2 video predictor for name, under the same budget as the image predictors."""
+        if not SAM2_AVAILABLE:
+            raise RuntimeError("SAM2 is not installed")
+        name = resolve_model_name(name)
+
+        def build(model_cfg: str, checkpoint: str) -> tuple:
+            # The video predictor is itself the model module
+            predictor = build_sam2_video_predictor(model_cfg, checkpoint, device=self.device)
+            return predictor, predictor
+
+        return self._get(f"{name}:video", name, build)
+
+    def _get(self, key: str, name: str, build):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model_cfg, checkpoint = model_paths(name)
+            if not os.path.exists(checkpoint):
+                raise ValueError(f"Checkpoint for SAM2 '{name}' not found at {checkpoint}")
+            self._evict_for(os.path.getsize(checkpoint))
+
+            print(f"[*] Loading SAM2 '{key}' from {checkpoint}...")
+            load_start = time.time()
+            entry, model = build(model_cfg, checkpoint)
+            self.load_seconds[key] = time.time() - load_start
+            self._models[key] = entry
+            self._sizes[key] = self._model_bytes(model)
+            self.loaded = list(self._models)
+            print(f"[+] SAM2 '{key}' loaded in {self.load_seconds[key]:.1f}s "
+                  f"({self._sizes[key] / 1024 / 1024:.0f}MB, resident: {self.loaded})")
+            return entry
+
+
+registry = ModelRegistry(MODEL_MEMORY_BUDGET_MB)
+
+
+class SegmentationTask:
+    __slots__ = ("image_np", "image_key", "model", "fn", "priority", "seq", "enqueued_at", "future")
+
+    def __init__(self, image_np: np.ndarray, image_key: str, model: Optional[str], fn, priority: int, seq: int):
+        self.image_np = image_np
+        self.image_key = image_key
+        self.model = model
+        self.fn = fn
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.future: Future = Future()
+
+
+class InferenceScheduler:
+    """
+    Sole user of the model registry. Both the HTTP handler and the queue
+    thread submit work here; a single thread runs it so set_image calls never
+    interleave and models are never evicted mid-request.
+
+    Interactive work runs before batch work, except that batch tasks waiting
+    longer than BATCH_MAX_WAIT are promoted so they cannot starve. Once a task
+    is picked, every pending task for the same image runs right after it
+    against the one embedding. Tasks for the same pixels on different models
+    are different groups.
+    """
+
+    def __init__(self):
+        self._pending: List[SegmentationTask] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self.images_set = 0
+        self.tasks_run = 0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sam2-scheduler", daemon=True)
+            self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, image_np: Optional[np.ndarray], fn, priority: int = PRIORITY_BATCH,
+               model: Optional[str] = None, image_key: Optional[str] = None) -> Future:
+        """
+        Queue fn(predictor, image_np) to run once image_np is set on the
+        predictor for `model`. With image_np=None, fn(None, None) just gets
+        exclusive device time. image_key skips hashing the pixels here.
+        """
+        key = None
+        if image_np is not None:
+            model = resolve_model_name(model)
+            # Pixels only: each model has its own predictor, and the generator's
+            # own set_image calls must hit the same cache entry
+            key = image_key or CachedEmbeddingPredictor.image_key(image_np)
+        with self._cond:
+            task = SegmentationTask(image_np, key, model, fn, priority, next(self._seq))
+            self._pending.append(task)
+            self._cond.notify()
+        return task.future
+
+    async def submit_async(self, image_np: Optional[np.ndarray], fn, priority: int = PRIORITY_INTERACTIVE,
+                           model: Optional[str] = None):
+        """submit() from the event loop: hash the pixels on a thread, then await the result."""
+        image_key = None
+        if image_np is not None:
+            image_key = await asyncio.to_thread(CachedEmbeddingPredictor.image_key, image_np)
+        return await asyncio.wrap_future(self.submit(image_np, fn, priority, model, image_key))
+
+    def _effective_priority(self, task: SegmentationTask, now: float) -> tuple:
+        priority = task.priority
+        if priority == PRIORITY_BATCH and now - task.enqueued_at > BATCH_MAX_WAIT:
+            priority = PRIORITY_INTERACTIVE
+        return (priority, task.seq)
+
+    def _next_group(self) -> List[SegmentationTask]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            now = time.time()
+            head = min(self._pending, key=lambda t: self._effective_priority(t, now))
+            if head.image_key is None:
+                group = [head]
+            else:
+                group = [t for t in self._pending if t.image_key == head.image_key and t.model == head.model]
+                group.sort(key=lambda t: self._effective_priority(t, now))
+            self._pending = [t for t in self._pending if t not in group]
+            return group
+
+    def _run(self) -> None:
+        while True:
+            group = self._next_group()
+            group = [t for t in group if t.future.set_running_or_notify_cancel()]
+            if not group:
+                continue
+            predictor = None
+            try:
+                if group[0].image_key is not None:
+                    predictor = registry.get(group[0].model)
+                    predictor.set_image(group[0].image_np, key=group[0].image_key)
+                    self.images_set += 1
+            except Exception as e:
+                for task in group:
+                    task.future.set_exception(e)
+                continue
+            for index, task in enumerate(group):
+                try:
+                    if index and predictor is not None:
+                        # An earlier task may have moved the predictor off this image
+                        # (automatic crop layers set_image each crop); normally a cache hit
+                        predictor.set_image(task.image_np, key=task.image_key)
+                    task.future.set_result(task.fn(predictor, task.image_np))
+                except Exception as e:
+                    task.future.set_exception(e)
+                self.tasks_run += 1
+
+
+scheduler = InferenceScheduler()
+
+
+def resolve_amg_options(preset: str, overrides: Optional[dict] = None) -> dict:
+    """Merge a named preset with per-request overrides."""
+    if preset not in AMG_PRESETS:
+        raise ValueError(f"Unknown automatic preset '{preset}', expected one of {list(AMG_PRESETS)}")
+    options = dict(AMG_PRESETS[preset])
+    for key, value in (overrides or {}).items():
+        if key not in AMG_OPTION_KEYS:
+            raise ValueError(f"Unknown automatic option '{key}'")
+        options[key] = value
+    for key in ("points_per_side", "points_per_batch", "crop_n_layers",
+                "crop_n_points_downscale_factor", "min_mask_region_area"):
+        if key in options:
+            options[key] = int(options[key])
+    return options
+
+
+def generate_automatic_masks(predictor: CachedEmbeddingPredictor, image_np: np.ndarray, options: dict):
+    """
+    Whole-image segmentation by prompting the decoder with a point grid.
+
+    The generator shares the given predictor, so the full-image crop reuses
+    the cached embedding and only additional crop layers re-run the encoder.
+    """
+    generator = SAM2AutomaticMaskGenerator(predictor.model, output_mode="binary_mask", **options)
+    generator.predictor = predictor
+    records = generator.generate(image_np)
+    records.sort(key=lambda rec: rec["area"], reverse=True)
+
+    if records:
+        masks = np.stack([rec["segmentation"] for rec in records])
+    else:
+        masks = np.zeros((0,) + image_np.shape[:2], dtype=bool)
+    scores = np.array([rec["predicted_iou"] for rec in records], dtype=np.float32)
+    extra = {
+        "boxes": [rec["bbox"] for rec in records],
+        "areas": [int(rec["area"]) for rec in records],
+        "stabilityScores": [float(rec["stability_score"]) for rec in records],
+    }
+    return masks, scores, extra
+
+
+def run_segmentation(predictor: CachedEmbeddingPredictor, image_np: np.ndarray, payload: dict):
+    """
+    Run the requested prompt mode against the given predictor.
+    Must be called from the scheduler thread, after image_np has been set.
+    """
+    mode = payload.get("mode", "automatic")
+    points = payload.get("points")
+    labels = payload.get("labels")
+    boxes = payload.get("boxes")
+    multimask = payload.get("multimask_output", False)
+
+    if mode == "point" and points:
+        masks, scores, _ = predictor.predict(
+            point_coords=np.array(points),
+            point_labels=np.array(labels or [1] * len(points)),
+            multimask_output=multimask
+        )
+        return masks, scores, {}
+    if mode == "box" and boxes:
+        masks, scores, _ = predictor.predict(
+            box=np.array(boxes[0]),
+            multimask_output=multimask
+        )
+        return masks, scores, {}
+
+    preset = payload.get("amg_preset", "balanced")
+    options = resolve_amg_options(preset, payload.get("amg_options"))
+    gen_start = time.time()
+    masks, scores, extra = generate_automatic_masks(predictor, image_np, options)
+    extra["preset"] = preset
+    extra["generationMs"] = int((time.time() - gen_start) * 1000)
+    return masks, scores, extra
+
+
+def save_masks(masks: np.ndarray, output_dir: str) -> List[str]:
+    """Write each mask as a grayscale PNG and return the paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    mask_paths = []
+    for i, mask in enumerate(masks):
+        mask_img = Image.fromarray((mask * 255).astype(np.uint8))
+        mask_path = f"{output_dir}/mask_{i}.png"
+        mask_img.save(mask_path)
+        mask_paths.append(mask_path)
+    return mask_paths
+
+
+MASK_ENCODINGS = ("png", "rle", "bitpacked", "polygons", "labelmap")
+
+
+def encode_rle(mask: np.ndarray) -> dict:
+    """COCO-style uncompressed RLE: column-major run lengths, starting with zeros."""
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds)
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts.tolist()}
+
+
+def decode_rle(rle: dict) -> np.ndarray:
+    """Inverse of encode_rle."""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.zeros(counts.size, dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, counts).reshape((height, width), order="F")
+
+
+def encode_polygons(mask: np.ndarray) -> List[List[float]]:
+    """Outer contours as flat [x0, y0, x1, y1, ...] lists."""
+    if cv2 is None:
+        raise ValueError("polygons encoding requires opencv-python")
+    contours, _ = cv2.findContours(
+        np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    )
+    return [c.reshape(-1).tolist() for c in contours if len(c) >= 3]
+
+
+def build_label_map(masks: np.ndarray) -> np.ndarray:
+    """
+    Combine all masks into one label image where pixel value i+1 means mask i.
+    Masks are painted largest first so smaller objects stay visible on top.
+    """
+    height, width = masks.shape[1:]
+    dtype = np.uint8 if len(masks) < 256 else np.uint16
+    labels = np.zeros((height, width), dtype=dtype)
+    areas = masks.reshape(len(masks), -1).sum(axis=1)
+    for i in np.argsort(-areas, kind="stable"):
+        labels[masks[i]] = i + 1
+    return labels
+
+
+class RestoredMasks:
+    """
+    Decoded-resolution masks read back at the original resolution. Each mask
+    is upsampled only when it is read, so encoding holds one full-size mask
+    at a time rather than all of them (about 100 automatic masks of a 50 MP
+    image would otherwise take 5 GB).
+    """
+
+    def __init__(self, masks: np.ndarray, size: tuple):
+        self.source = np.asarray(masks) > 0
+        self.size = size  # (width, height)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.source), self.size[1], self.size[0])
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.upsample(self.source[index].view(np.uint8)).astype(bool)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def upsample(self, array: np.ndarray) -> np.ndarray:
+        """Nearest-neighbour resize of one 2-D array to the original size."""
+        return np.asarray(Image.fromarray(array).resize(self.size, Image.NEAREST))
+
+
+def _png_bytes(array: np.ndarray) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def encode_masks(masks: np.ndarray, encoding: str, output_dir: str, inline: bool = False) -> dict:
+    """
+    Encode predicted masks for the result payload.
+
+    "png" keeps the original one-file-per-mask layout. Every other encoding
+    produces a single artifact, or is embedded in the result when inline is set.
+    """
+    if encoding not in MASK_ENCODINGS:
+        raise ValueError(f"Unknown mask encoding '{encoding}', expected one of {list(MASK_ENCODINGS)}")
+
+    if not isinstance(masks, RestoredMasks):
+        masks = np.asarray(masks) > 0
+    result = {"maskEncoding": encoding, "maskCount": int(len(masks))}
+
+    if encoding == "png":
+        if inline:
+            result["masks"] = [
+                "data:image/png;base64," + base64.b64encode(_png_bytes(m.view(np.uint8) * 255)).decode()
+                for m in masks
+            ]
+        else:
+            result["masks"] = save_masks(masks, output_dir)
+        return result
+
+    if encoding in ("rle", "polygons"):
+        encoder = encode_rle if encoding == "rle" else encode_polygons
+        data = [encoder(m) for m in masks]
+        if inline:
+            result["masks"] = data
+            return result
+        artifact = f"{output_dir}/masks_{encoding}.json"
+        os.makedirs(output_dir, exist_ok=True)
+        with open(artifact, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+    elif encoding == "bitpacked":
+        height, width = masks.shape[1:]
+        bits = np.empty((len(masks), (height * width + 7) // 8), dtype=np.uint8)
+        for i, mask in enumerate(masks):
+            bits[i] = np.packbits(mask.ravel())
+        buffer = BytesIO()
+        np.savez_compressed(buffer, bits=bits, shape=np.array(masks.shape, dtype=np.int64))
+        if inline:
+            result["masks"] = base64.b64encode(buffer.getvalue()).decode()
+            return result
+        artifact = f"{output_dir}/masks.npz"
+        os.makedirs(output_dir, exist_ok=True)
+        with open(artifact, "wb") as f:
+            f.write(buffer.getvalue())
+    else:  # labelmap
+        if isinstance(masks, RestoredMasks):
+            # Painting then upsampling equals upsampling then painting for nearest-neighbour
+            data = _png_bytes(masks.upsample(build_label_map(masks.source)))
+        else:
+            data = _png_bytes(build_label_map(masks))
+        if inline:
+            result["masks"] = "data:image/png;base64," + base64.b64encode(data).decode()
+            return result
+        artifact = f"{output_dir}/labels.png"
+        os.makedirs(output_dir, exist_ok=True)
+        with open(artifact, "wb") as f:
+            f.write(data)
+
+    result["maskArtifact"] = artifact
+    return result
+
+
+class InputTooLarge(ValueError):
+    """Raised when an input exceeds the byte or pixel caps."""
+
+
+class DecodedImage:
+    """
+    RGB pixels as fed to the model, plus the factors that map them back to
+    the source resolution. scale is (original / decoded) per axis.
+    """
+
+    def __init__(self, image: Image.Image, original_size: tuple, decode_ms: float = 0.0):
+        self.image = image
+        self.original_size = original_size
+        self.decoded_size = image.size
+        self.scale = (original_size[0] / image.width, original_size[1] / image.height)
+        self.decode_ms = decode_ms
+
+    @property
+    def downscaled(self) -> bool:
+        return self.decoded_size != self.original_size
+
+    def to_decoded(self, payload: dict) -> dict:
+        """Map prompt coordinates from original-resolution space to decoded pixels."""
+        if not self.downscaled:
+            return payload
+        sx, sy = self.scale
+        payload = dict(payload)
+        if payload.get("points"):
+            payload["points"] = [[x / sx, y / sy] for x, y in payload["points"]]
+        if payload.get("boxes"):
+            payload["boxes"] = [[x0 / sx, y0 / sy, x1 / sx, y1 / sy] for x0, y0, x1, y1 in payload["boxes"]]
+        return payload
+
+    def to_original(self, masks: np.ndarray, extra: dict) -> tuple:
+        """
+        Masks at original resolution (upsampled lazily, see RestoredMasks) and
+        box/area metadata rescaled to match.
+        """
+        if not self.downscaled:
+            return masks, extra
+        sx, sy = self.scale
+        restored = RestoredMasks(masks, self.original_size)
+        extra = dict(extra)
+        if "boxes" in extra:
+            extra["boxes"] = [[x * sx, y * sy, w * sx, h * sy] for x, y, w, h in extra["boxes"]]
+        if "areas" in extra:
+            extra["areas"] = [int(a * sx * sy) for a in extra["areas"]]
+        return restored, extra
+
+    def describe(self, mask_resolution: str) -> dict:
+        return {
+            "originalSize": list(self.original_size),
+            "decodedSize": list(self.decoded_size),
+            "maskResolution": mask_resolution if self.downscaled else "original",
+            "inputScale": list(self.scale),
+            "decodeMs": round(self.decode_ms, 1),
+        }
+
+
+def decode_image(data: bytes, target_side: int = MODEL_INPUT_SIDE, draft: bool = True) -> DecodedImage:
+    """
+    Decode to RGB at no more than needed for the model input.
+
+    JPEGs much larger than the model input are decoded at a reduced DCT scale
+    (draft mode), which skips most of the IDCT work and never materialises
+    the full-resolution bitmap. Other formats are decoded fully and then
+    reduced by an integer factor so downstream copies stay small.
+    """
+    decode_start = time.perf_counter()
+    image = Image.open(BytesIO(data))
+    original_size = image.size
+    if original_size[0] * original_size[1] > MAX_INPUT_PIXELS:
+        raise InputTooLarge(
+            f"Image is {original_size[0]}x{original_size[1]}, limit is {MAX_INPUT_PIXELS} pixels"
+        )
+
+    factor = max(original_size) // target_side
+    if draft and factor >= 2 and image.format == "JPEG":
+        image.draft("RGB", (math.ceil(original_size[0] / factor), math.ceil(original_size[1] / factor)))
+    image = image.convert("RGB")
+
+    remaining = max(image.size) // target_side
+    if draft and remaining >= 2:
+        image = image.reduce(remaining)
+
+    return DecodedImage(image, original_size, (time.perf_counter() - decode_start) * 1000)
+
+
+def download_bytes(url: str) -> bytes:
+    """Stream a download into memory, refusing anything over MAX_DOWNLOAD_BYTES."""
+    with requests.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        if int(response.headers.get("content-length") or 0) > MAX_DOWNLOAD_BYTES:
+            raise InputTooLarge(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.extend(chunk)
+            if len(buffer) > MAX_DOWNLOAD_BYTES:
+                raise InputTooLarge(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+        return bytes(buffer)
+
+
+def download_image(url: str) -> DecodedImage:
+    """Download image from URL and decode it for the model."""
+    return decode_image(download_bytes(url))
+
+
+def finish_masks(decoded: DecodedImage, masks: np.ndarray, extra: dict, mask_resolution: str) -> tuple:
+    """Apply the requested mask resolution and attach input scale metadata."""
+    if mask_resolution not in ("original", "decoded"):
+        raise ValueError(f"Unknown mask_resolution '{mask_resolution}'")
+    if mask_resolution == "original":
+        masks, extra = decoded.to_original(masks, extra)
+    return masks, {**extra, **decoded.describe(mask_resolution)}
+
+
+async def download_image_async(url: str) -> DecodedImage:
+    """
+    Download through the shared pooled client with byte and wall-time limits,
+    then decode off the event loop.
+    """
+    async def fetch() -> bytes:
+        async with http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            declared = int(response.headers.get("content-length") or 0)
+            if declared > MAX_DOWNLOAD_BYTES:
+                raise InputTooLarge(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer.extend(chunk)
+                if len(buffer) > MAX_DOWNLOAD_BYTES:
+                    raise InputTooLarge(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+            return bytes(buffer)
+
+    try:
+        data = await asyncio.wait_for(fetch(), timeout=DOWNLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Image download exceeded {DOWNLOAD_TIMEOUT}s")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Image download failed: {e}")
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, decode_image, data)
+
+
+async def run_inference(image_np: np.ndarray, payload: dict):
+    """Hand interactive work to the scheduler without blocking the event loop."""
+    if scheduler.pending >= MAX_PENDING_INFERENCE:
+        raise HTTPException(status_code=503, detail="Segmentation queue is full, retry later")
+    return await scheduler.submit_async(
+        image_np,
+        lambda pred, img: run_segmentation(pred, img, payload),
+        PRIORITY_INTERACTIVE,
+        model=payload.get("model")
+    )
+
+
+@app.on_event("startup")
+async def startup_event():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=DOWNLOAD_POOL_SIZE,
+            max_keepalive_connections=DOWNLOAD_POOL_SIZE // 2,
+        ),
+        follow_redirects=True,
+    )
+    asyncio.create_task(expire_sessions_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if http_client is not None:
+        await http_client.aclose()
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -108,10 +923,15 @@ async def health():
     """Health check endpoint for worker status."""
     return HealthResponse(
         status="healthy" if model_loaded else "degraded",
-        models_loaded=["sam2_hiera_large"] if model_loaded else [],
+        models_loaded=list(registry.loaded),
         vram_used_mb=get_vram_usage(),
         vram_total_mb=get_vram_total(),
-        uptime=time.time() - start_time
+        uptime=time.time() - start_time,
+        scheduler_pending=scheduler.pending,
+        models_available=[name for name in SAM2_MODELS if os.path.exists(model_paths(name)[1])],
+        model_memory_mb=round(registry.memory_mb, 1),
+        active_sessions=len(sessions),
+        session_memory_mb=round(session_memory_bytes() / 1024 / 1024, 1)
     )
 
 
@@ -123,46 +943,30 @@ async def segment(request: SegmentRequest):
 
     try:
         # Download and process image
-        image = download_image(request.image_url)
-        image_np = np.array(image)
-
-        if predictor is not None:
-            predictor.set_image(image_np)
-
-            if request.mode == "point" and request.points:
-                point_coords = np.array(request.points)
-                point_labels = np.array(request.labels or [1] * len(request.points))
-                masks, scores, _ = predictor.predict(
-                    point_coords=point_coords,
-                    point_labels=point_labels,
-                    multimask_output=request.multimask_output
-                )
-            elif request.mode == "box" and request.boxes:
-                masks, scores, _ = predictor.predict(
-                    box=np.array(request.boxes[0]),
-                    multimask_output=request.multimask_output
-                )
-            else:
-                # Automatic mode - generate full image mask
-                masks, scores, _ = predictor.predict(
-                    point_coords=None,
-                    point_labels=None,
-                    multimask_output=True
-                )
+        resolve_model_name(request.model)
+        decoded = await download_image_async(request.image_url)
+
+        if SAM2_AVAILABLE:
+            masks, scores, extra = await run_inference(
+                np.asarray(decoded.image), decoded.to_decoded(request.dict())
+            )
 
-            # Save masks
-            output_dir = f"outputs/segment_{int(time.time() * 1000)}"
-            os.makedirs(output_dir, exist_ok=True)
+            # Mask restore and encoding are CPU-only, keep them off both the loop and the scheduler
+            def postprocess():
+                final_masks, final_extra = finish_masks(decoded, masks, extra, request.mask_resolution)
+                encoded = encode_masks(
+                    final_masks,
+                    request.mask_encoding,
+                    f"outputs/segment_{int(time.time() * 1000)}",
+                    inline=request.inline_masks
+                )
+                return {**encoded, **final_extra}
 
-            mask_paths = []
-            for i, mask in enumerate(masks):
-                mask_img = Image.fromarray((mask * 255).astype(np.uint8))
-                mask_path = f"{output_dir}/mask_{i}.png"
-                mask_img.save(mask_path)
-                mask_paths.append(mask_path)
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(None, postprocess)
 
             return {
-                "masks": mask_paths,
+                **encoded,
                 "scores": scores.tolist(),
                 "status": "completed"
             }
@@ -174,10 +978,298 @@ async def segment(request: SegmentRequest):
                 "status": "completed"
             }
 
+    except HTTPException:
+        raise
+    except InputTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/embedding")
+async def embedding(request: EmbeddingRequest):
+    """
+    Return the image embedding as a binary .npz for client-side or
+    out-of-process click decoding with the exported ONNX decoder.
+
+    The embedding is computed on the decoded image, so clicks must be scaled
+    by 1 / X-Input-Scale before decoding.
+    """
+    if not model_loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if request.dtype not in ("float16", "float32"):
+        raise HTTPException(status_code=400, detail="dtype must be float16 or float32")
+    if scheduler.pending >= MAX_PENDING_INFERENCE:
+        raise HTTPException(status_code=503, detail="Segmentation queue is full, retry later")
+
+    try:
+        resolve_model_name(request.model)
+        decoded = await download_image_async(request.image_url)
+        data = await scheduler.submit_async(
+            np.asarray(decoded.image),
+            lambda pred, img: compute_embedding(pred, request.dtype),
+            PRIORITY_INTERACTIVE,
+            model=request.model
+        )
+    except HTTPException:
+        raise
+    except InputTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={
+            "X-Original-Size": f"{decoded.original_size[0]}x{decoded.original_size[1]}",
+            "X-Input-Scale": f"{decoded.scale[0]},{decoded.scale[1]}",
+        },
+    )
+
+
+# ============================================================================
+# Interactive sessions
+# ============================================================================
+
+def tensor_bytes(obj) -> int:
+    """Bytes held by the tensors in a (nested) features structure."""
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(tensor_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(tensor_bytes(v) for v in obj)
+    return 0
+
+
+class InteractiveSession:
+    """
+    One image opened for click-by-click refinement. Holds its own copy of the
+    image features so it survives other requests re-using the predictor, and
+    the previous low-res logits that seed the next refinement.
+    """
+
+    def __init__(self, session_id: str, model: str, decoded: DecodedImage, image_key: str,
+                 features: dict, orig_hw: tuple):
+        self.id = session_id
+        self.model = model
+        self.decoded = decoded
+        self.image_key = image_key
+        self.features = features
+        self.feature_bytes = tensor_bytes(features)
+        self.orig_hw = orig_hw
+        self.points: List[List[float]] = []
+        self.labels: List[int] = []
+        self.box: Optional[List[float]] = None
+        self.logits: Optional[np.ndarray] = None
+        self.clicks = 0
+        self.last_used = time.time()
+        self.lock = asyncio.Lock()
+
+
+# Most recently used last
+sessions: "OrderedDict[str, InteractiveSession]" = OrderedDict()
+
+
+def expire_sessions(now: Optional[float] = None) -> int:
+    """Drop sessions idle longer than SESSION_TTL; returns how many were removed."""
+    now = now or time.time()
+    expired = [sid for sid, sess in sessions.items() if now - sess.last_used > SESSION_TTL]
+    for sid in expired:
+        del sessions[sid]
+    return len(expired)
+
+
+def session_memory_bytes() -> int:
+    return sum(sess.feature_bytes for sess in sessions.values())
+
+
+def get_session(session_id: str) -> InteractiveSession:
+    expire_sessions()
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    session.last_used = time.time()
+    sessions.move_to_end(session_id)
+    return session
+
+
+def open_session_features(predictor: CachedEmbeddingPredictor) -> tuple:
+    """Scheduler task: the image is set, keep a reference to its features."""
+    return predictor.export_features()
+
+
+def refine_session(session: InteractiveSession, points: List[List[float]], labels: List[int],
+                   box: Optional[List[float]], logits: Optional[np.ndarray]):
+    """
+    Scheduler task: decode one click against the session's stored features,
+    feeding back the previous best low-res logits as mask_input. Returns the
+    new best logits rather than storing them, so a failed request leaves the
+    session untouched.
+    """
+    predictor = registry.get(session.model)
+    predictor.use_features(session.image_key, session.features, session.orig_hw)
+
+    first = logits is None
+    decode_start = time.perf_counter()
+    masks, scores, low_res = predictor.predict(
+        point_coords=np.array(points, dtype=np.float32) if points else None,
+        point_labels=np.array(labels, dtype=np.int32) if points else None,
+        box=np.array(box, dtype=np.float32) if box else None,
+        mask_input=logits,
+        # Several candidates only while the prompt is ambiguous
+        multimask_output=first and len(points) == 1 and not box,
+    )
+    decoder_ms = (time.perf_counter() - decode_start) * 1000
+
+    best = int(np.argmax(scores))
+    return masks[best:best + 1], scores[best:best + 1], decoder_ms, low_res[best:best + 1]
+
+
+@app.post("/sessions")
+async def create_session(request: SessionRequest):
+    """Open an image for interactive refinement; the embedding is computed once here."""
+    if not model_loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if scheduler.pending >= MAX_PENDING_INFERENCE:
+        raise HTTPException(status_code=503, detail="Segmentation queue is full, retry later")
+
+    try:
+        model = resolve_model_name(request.model)
+        decoded = await download_image_async(request.image_url)
+        embed_start = time.perf_counter()
+        image_key, features, orig_hw = await scheduler.submit_async(
+            np.asarray(decoded.image),
+            lambda pred, img: open_session_features(pred),
+            PRIORITY_INTERACTIVE,
+            model=model
+        )
+        embed_ms = (time.perf_counter() - embed_start) * 1000
+    except HTTPException:
+        raise
+    except InputTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    decoded.image = None  # only the scale factors are needed from here on
+    expire_sessions()
+    session_id = f"sess_{os.urandom(8).hex()}"
+    session = InteractiveSession(session_id, model, decoded, image_key, features, orig_hw)
+    budget = SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+    while sessions and (len(sessions) >= MAX_SESSIONS or session_memory_bytes() + session.feature_bytes > budget):
+        sessions.popitem(last=False)
+    sessions[session_id] = session
+    return {
+        "sessionId": session_id,
+        "model": model,
+        "embeddingMs": round(embed_ms, 1),
+        "expiresIn": SESSION_TTL,
+        **decoded.describe("original"),
+    }
+
+
+@app.post("/sessions/{session_id}/click")
+async def session_click(session_id: str, request: SessionClickRequest):
+    """
+    Add clicks (original-resolution coordinates) and return the refined mask.
+    Clicks and the latest box accumulate across calls until reset is set; a
+    call that fails leaves them as they were. Calls on one session run one at
+    a time.
+    """
+    session = get_session(session_id)
+    if request.labels and len(request.labels) != len(request.points):
+        raise HTTPException(status_code=400, detail="labels must match points")
+
+    # Held from reading the clicks to committing them, so concurrent clicks on
+    # one session apply in turn instead of overwriting each other
+    async with session.lock:
+        if request.reset:
+            points, labels, box, logits = [], [], None, None
+        else:
+            points, labels, box, logits = session.points, session.labels, session.box, session.logits
+        mapped = session.decoded.to_decoded({"points": request.points, "boxes": [request.box] if request.box else None})
+        points = points + (mapped.get("points") or [])
+        labels = labels + (request.labels or [1] * len(request.points))
+        if mapped.get("boxes"):
+            box = mapped["boxes"][0]
+        if not points and box is None:
+            raise HTTPException(status_code=400, detail="at least one point or a box is required")
+
+        try:
+            masks, scores, decoder_ms, new_logits = await asyncio.wrap_future(scheduler.submit(
+                None,
+                lambda _pred, _img: refine_session(session, points, labels, box, logits),
+                PRIORITY_INTERACTIVE
+            ))
+
+            def postprocess():
+                final_masks, final_extra = finish_masks(session.decoded, masks, {}, request.mask_resolution)
+                encoded = encode_masks(
+                    final_masks,
+                    request.mask_encoding,
+                    f"outputs/{session.id}/click_{session.clicks}",
+                    inline=request.inline_masks
+                )
+                return {**encoded, **final_extra}
+
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(None, postprocess)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        session.points, session.labels, session.box, session.logits = points, labels, box, new_logits
+        session.clicks += 1
+    return {
+        **encoded,
+        "sessionId": session.id,
+        "scores": scores.tolist(),
+        "clicks": len(points),
+        "decoderMs": round(decoder_ms, 2),
+    }
+
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    if sessions.pop(session_id, None) is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"sessionId": session_id, "status": "closed"}
+
+
+async def expire_sessions_loop() -> None:
+    while True:
+        await asyncio.sleep(min(SESSION_TTL, 30))
+        expire_sessions()
+
+
+@app.post("/segment-video")
+async def segment_video_endpoint(request: VideoSegmentRequest):
+    """Queue a video propagation job; masks are appended to masks.ndjson as windows finish."""
+    try:
+        resolve_video_source(request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="at least one prompt is required")
+    job_id = f"job_{int(time.time() * 1000)}_{os.urandom(4).hex()}"
+    job_data = {
+        "id": job_id,
+        "model_id": MODEL_ID,
+        "payload": {"type": "video", **request.dict()}
+    }
+    r.rpush(QUEUE_NAME, json.dumps(job_data))
+    return {"jobId": job_id, "status": "queued", "masksFile": f"outputs/{job_id}/masks.ndjson"}
+
+
 @app.post("/batch")
 async def add_to_batch(request: SegmentRequest):
     """Add a segmentation job to the batch queue."""
@@ -191,21 +1283,454 @@ async def add_to_batch(request: SegmentRequest):
     return {"jobId": job_id, "status": "queued"}
 
 
-def process_queue():
-    """Background queue processor for batch jobs."""
-    global predictor, model_loaded
+# ============================================================================
+# Video propagation
+# ============================================================================
 
-    print(f"[*] Starting SAM 2 worker...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[*] Using device: {device}")
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, falls back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def resolve_video_source(payload: dict) -> str:
+    """
+    The video to open for a job: an http(s) URL, or a path that resolves
+    inside VIDEO_INPUT_DIR. Anything else OpenCV could open (other local
+    files, devices, rtsp, pipelines) is refused.
+    """
+    url, path = payload.get("video_url"), payload.get("video_path")
+    if url:
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError("video_url must be an http(s) URL")
+        return url
+    if path:
+        if not VIDEO_INPUT_DIR:
+            raise ValueError("video_path is disabled; set SAM2_VIDEO_INPUT_DIR or use video_url")
+        root = os.path.realpath(VIDEO_INPUT_DIR)
+        resolved = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
+            raise ValueError(f"video_path must name a file inside {VIDEO_INPUT_DIR}")
+        return resolved
+    raise ValueError("video_url or video_path is required")
+
+
+def iter_video_frames(source: str, info: Optional[dict] = None):
+    """
+    Yield BGR frames one at a time from a file path or URL. If given, info
+    gets "frameCount" (0 when the container doesn't say) once opened.
+    """
+    if cv2 is None:
+        raise ValueError("video segmentation requires opencv-python")
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video '{source}'")
+    if info is not None:
+        info["frameCount"] = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0), 0)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def propagate_window(frames_dir: str, seeds: Dict[int, np.ndarray], prompts: List[dict], emit,
+                     model: Optional[str] = None) -> Dict[int, np.ndarray]:
+    """
+    Propagate masks through one window of JPEG frames.
+
+    seeds are masks carried over from the previous window and are applied at
+    local frame 0; prompts use local frame indices. Each propagated frame is
+    passed to emit(local_idx, {obj_id: mask}). Returns the masks of the last
+    frame so the next window can be seeded from them. All inference state is
+    released before returning.
+    """
+    vp = registry.get_video(model)
+    state = vp.init_state(
+        video_path=frames_dir,
+        offload_video_to_cpu=True,
+        offload_state_to_cpu=True,
+    )
+    last: Dict[int, np.ndarray] = {}
+    try:
+        for obj_id, mask in seeds.items():
+            vp.add_new_mask(state, frame_idx=0, obj_id=obj_id, mask=mask)
+        for prompt in prompts:
+            vp.add_new_points_or_box(
+                state,
+                frame_idx=prompt["frame_idx"],
+                obj_id=prompt["obj_id"],
+                points=np.array(prompt["points"], dtype=np.float32) if prompt.get("points") else None,
+                labels=np.array(prompt.get("labels") or [1] * len(prompt["points"]), dtype=np.int32)
+                if prompt.get("points") else None,
+                box=np.array(prompt["box"], dtype=np.float32) if prompt.get("box") else None,
+            )
+        if not seeds and not prompts:
+            return last
+
+        last_idx = -1
+        for frame_idx, obj_ids, mask_logits in vp.propagate_in_video(state):
+            masks = {int(oid): (mask_logits[i, 0] > 0).cpu().numpy() for i, oid in enumerate(obj_ids)}
+            emit(frame_idx, masks)
+            if frame_idx > last_idx:
+                last_idx, last = frame_idx, masks
+        return last
+    finally:
+        vp.reset_state(state)
+        del state
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def segment_video(source: str, prompts: List[dict], output_dir: str, window: int,
+                  on_window=None, model: Optional[str] = None) -> dict:
+    """
+    Track prompted objects across a video in fixed-size windows.
+
+    Frames are streamed from the source and spilled to a JPEG directory one
+    window at a time, so neither decoded frames nor SAM2's per-frame memory
+    grow with clip length. Consecutive windows overlap by one frame: the last
+    mask of each object seeds the next window. Per-frame RLE masks are
+    appended to masks.ndjson as each window finishes.
+    """
+    import shutil
+    import tempfile
+
+    window = max(2, window)
+    os.makedirs(output_dir, exist_ok=True)
+    ndjson_path = f"{output_dir}/masks.ndjson"
+    frames_written = 0
+    seeds: Dict[int, np.ndarray] = {}
+    buffer: List[np.ndarray] = []
+    window_start = 0  # global index of buffer[0]
+    peak_rss = current_rss_mb()
+    info: dict = {}
+
+    def flush(out, is_last: bool):
+        nonlocal seeds, buffer, window_start, frames_written, peak_rss
+        frames_dir = tempfile.mkdtemp(prefix="sam2_window_")
+        try:
+            for i, frame in enumerate(buffer):
+                cv2.imwrite(f"{frames_dir}/{i:05d}.jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            window_end = window_start + len(buffer)
+            local_prompts = [
+                {**p, "frame_idx": p["frame_idx"] - window_start}
+                for p in prompts
+                if window_start <= p.get("frame_idx", 0) < window_end
+                and not (seeds and p.get("frame_idx", 0) == window_start)
+            ]
+            skip_first = bool(seeds)
+
+            def emit(local_idx: int, masks: Dict[int, np.ndarray]):
+                if skip_first and local_idx == 0:
+                    return  # already emitted as the previous window's last frame
+                out.write(json.dumps({
+                    "frame": window_start + local_idx,
+                    "objects": {str(oid): encode_rle(m) for oid, m in masks.items()},
+                }, separators=(",", ":")) + "\n")
+
+            carry = scheduler.submit(
+                None,
+                lambda _pred, _img: propagate_window(frames_dir, seeds, local_prompts, emit, model),
+                PRIORITY_BATCH
+            ).result()
+            out.flush()
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+
+        frames_written = window_end
+        peak_rss = max(peak_rss, current_rss_mb())
+        if on_window:
+            on_window(frames_written, peak_rss, info.get("frameCount", 0))
+        if not is_last:
+            seeds = carry
+            buffer = buffer[-1:]
+            window_start = window_end - 1
+
+    with open(ndjson_path, "w") as out:
+        for frame in iter_video_frames(source, info):
+            buffer.append(frame)
+            if len(buffer) == window:
+                flush(out, is_last=False)
+        if len(buffer) > (1 if frames_written else 0):
+            flush(out, is_last=True)
+
+    return {
+        "masksFile": ndjson_path,
+        "maskEncoding": "rle",
+        "frames": frames_written,
+        "windowFrames": window,
+        "peakRssMb": round(peak_rss, 1),
+    }
+
+
+def process_video_job(job_id: str, payload: dict, start_ts: float) -> None:
+    """Queue handler for type == "video" jobs."""
+    # Queue jobs bypass the HTTP endpoint, so validate the source here too
+    source = resolve_video_source(payload)
+    output_dir = f"outputs/{job_id}"
+    publish_progress(job_id, 5, "Loading video predictor...")
+    # Loaded by the scheduler thread, which owns the registry
+    scheduler.submit(None, lambda _pred, _img: registry.get_video(payload.get("model")), PRIORITY_BATCH).result()
+
+    def on_window(frames_done: int, peak_rss: float, frame_count: int):
+        # 10..95 over the clip; without a frame count, hold at 10 and report frames
+        progress = 10 + int(85 * min(frames_done / frame_count, 1.0)) if frame_count else 10
+        total = f"/{frame_count}" if frame_count else ""
+        publish_progress(job_id, progress, f"Propagated {frames_done}{total} frames")
+        r.publish(f"job-partial:{job_id}", json.dumps({
+            "jobId": job_id,
+            "framesDone": frames_done,
+            "masksFile": f"{output_dir}/masks.ndjson",
+            "timestamp": int(time.time() * 1000)
+        }))
+
+    result = segment_video(
+        source,
+        payload.get("prompts") or [],
+        output_dir,
+        int(payload.get("window_frames") or VIDEO_WINDOW_FRAMES),
+        on_window=on_window,
+        model=payload.get("model")
+    )
+    duration = int((time.time() - start_ts) * 1000)
+    publish_progress(job_id, 100, "Complete")
+    publish_result(job_id, "completed", {**result, "inputVideoUrl": source, "outputDir": output_dir}, duration=duration)
+    print(f"[+] SAM 2 video job {job_id}: {result['frames']} frames in {duration}ms")
+
+
+def benchmark_video(source: str, prompts_json: str, window: int, model: Optional[str]) -> None:
+    """Propagate through a clip and print RSS after every window."""
+    prompts = json.loads(prompts_json)
+    scheduler.start()
+    wall_start = time.time()
+
+    def on_window(frames_done: int, peak_rss: float, frame_count: int):
+        print(f"frames={frames_done:>6} rss={current_rss_mb():>8.1f}MB peak={peak_rss:>8.1f}MB "
+              f"elapsed={time.time() - wall_start:>6.1f}s")
+
+    result = segment_video(source, prompts, "outputs/bench_video", window, on_window=on_window, model=model)
+    print(json.dumps(result))
+
+
+# ============================================================================
+# ONNX prompt encoder / mask decoder
+# ============================================================================
+
+class SAM2DecoderOnnxModule(torch.nn.Module):
+    """
+    Prompt encoder + mask decoder with the image embedding as an input, in a
+    form torch.onnx.export can trace. Point embedding is written without
+    data-dependent indexing so the number of points can be a dynamic axis.
+
+    Point coordinates are in model-input space (1024x1024, pixel centres at
+    +0.5 applied here); labels follow SAM: 1 fg, 0 bg, 2/3 box corners,
+    -1 padding. Outputs low-res (256x256) mask logits and IoU predictions.
+    """
+
+    def __init__(self, model, multimask_output: bool = True):
+        super().__init__()
+        self.prompt_encoder = model.sam_prompt_encoder
+        self.mask_decoder = model.sam_mask_decoder
+        self.image_size = model.image_size
+        self.multimask_output = multimask_output
+
+    def _embed_points(self, point_coords: torch.Tensor, point_labels: torch.Tensor) -> torch.Tensor:
+        point_coords = (point_coords + 0.5) / self.image_size
+        point_embedding = self.prompt_encoder.pe_layer._pe_encoding(point_coords)
+        point_labels = point_labels.unsqueeze(-1).expand_as(point_embedding)
+
+        point_embedding = point_embedding * (point_labels != -1)
+        point_embedding = point_embedding + self.prompt_encoder.not_a_point_embed.weight * (point_labels == -1)
+        for i in range(self.prompt_encoder.num_point_embeddings):
+            point_embedding = point_embedding + self.prompt_encoder.point_embeddings[i].weight * (point_labels == i)
+        return point_embedding
+
+    def _embed_masks(self, mask_input: torch.Tensor, has_mask_input: torch.Tensor) -> torch.Tensor:
+        mask_embedding = has_mask_input * self.prompt_encoder.mask_downscaling(mask_input)
+        no_mask = self.prompt_encoder.no_mask_embed.weight.reshape(1, -1, 1, 1)
+        return mask_embedding + (1 - has_mask_input) * no_mask
+
+    def forward(self, image_embed, high_res_feats_0, high_res_feats_1,
+                point_coords, point_labels, mask_input, has_mask_input):
+        sparse = self._embed_points(point_coords, point_labels)
+        dense = self._embed_masks(mask_input, has_mask_input)
+        low_res_masks, iou_predictions, _, _ = self.mask_decoder(
+            image_embeddings=image_embed,
+            image_pe=self.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse,
+            dense_prompt_embeddings=dense,
+            multimask_output=self.multimask_output,
+            repeat_image=False,
+            high_res_features=[high_res_feats_0, high_res_feats_1],
+        )
+        return low_res_masks, iou_predictions
+
+
+ONNX_INPUT_NAMES = [
+    "image_embed", "high_res_feats_0", "high_res_feats_1",
+    "point_coords", "point_labels", "mask_input", "has_mask_input",
+]
+
+
+def export_decoder_onnx(output_path: str, model_name: Optional[str] = None,
+                        multimask_output: bool = True, opset: int = 17) -> None:
+    """Export a registry model's prompt encoder and mask decoder to ONNX."""
+    if not SAM2_AVAILABLE:
+        raise RuntimeError("SAM2 is not available, nothing to export")
+    sam2_model = registry.get(model_name).model
+
+    module = SAM2DecoderOnnxModule(sam2_model, multimask_output).cpu().eval()
+    embed_side = sam2_model.image_size // 16
+    dummy = (
+        torch.randn(1, 256, embed_side, embed_side),
+        torch.randn(1, 32, embed_side * 4, embed_side * 4),
+        torch.randn(1, 64, embed_side * 2, embed_side * 2),
+        torch.randint(0, sam2_model.image_size, (1, 2, 2), dtype=torch.float),
+        torch.tensor([[1, -1]], dtype=torch.float),
+        torch.zeros(1, 1, embed_side * 4, embed_side * 4),
+        torch.zeros(1),
+    )
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            dummy,
+            output_path,
+            input_names=ONNX_INPUT_NAMES,
+            output_names=["low_res_masks", "iou_predictions"],
+            dynamic_axes={"point_coords": {1: "num_points"}, "point_labels": {1: "num_points"}},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    print(f"[+] Exported SAM2 decoder to {output_path}")
+
+
+def pack_embedding(features: dict, orig_hw: tuple, dtype: str = "float16") -> bytes:
+    """
+    Serialise the cached image features as an uncompressed .npz (readable by
+    numpy and npy loaders in the browser). float16 halves the size with no
+    visible effect on decoded masks.
+    """
+    if dtype not in ("float16", "float32"):
+        raise ValueError("dtype must be float16 or float32")
+    arrays = {
+        "image_embed": features["image_embed"],
+        "high_res_feats_0": features["high_res_feats"][0],
+        "high_res_feats_1": features["high_res_feats"][1],
+    }
+    buffer = BytesIO()
+    np.savez(
+        buffer,
+        **{name: t.detach().float().cpu().numpy().astype(dtype) for name, t in arrays.items()},
+        orig_hw=np.array(orig_hw, dtype=np.int32),
+    )
+    return buffer.getvalue()
+
+
+class OnnxMaskDecoder:
+    """
+    CPU click decoder for an exported graph and a packed embedding.
+    Only needs numpy, Pillow and onnxruntime, so it can run in a process
+    without torch or in a client that mirrors this logic.
+    """
+
+    def __init__(self, onnx_path: str, image_size: int = MODEL_INPUT_SIDE, threads: int = 1):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.image_size = image_size
+
+    @staticmethod
+    def load_embedding(data: bytes) -> dict:
+        with np.load(BytesIO(data)) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    def decode(self, embedding: dict, points: List[List[float]], labels: List[int],
+               mask_input: Optional[np.ndarray] = None):
+        """Return (masks at original resolution, iou scores, low-res logits)."""
+        orig_h, orig_w = (int(v) for v in embedding["orig_hw"])
+        coords = np.array(points, dtype=np.float32) * np.array(
+            [self.image_size / orig_w, self.image_size / orig_h], dtype=np.float32
+        )
+        # Trailing padding point, as in the SAM prompt encoder when no box is given
+        coords = np.concatenate([coords, np.zeros((1, 2), dtype=np.float32)])[None]
+        point_labels = np.array(list(labels) + [-1], dtype=np.float32)[None]
+
+        has_mask = mask_input is not None
+        if mask_input is None:
+            mask_input = np.zeros((1, 1, self.image_size // 4, self.image_size // 4), dtype=np.float32)
+
+        low_res, iou = self.session.run(None, {
+            "image_embed": embedding["image_embed"].astype(np.float32),
+            "high_res_feats_0": embedding["high_res_feats_0"].astype(np.float32),
+            "high_res_feats_1": embedding["high_res_feats_1"].astype(np.float32),
+            "point_coords": coords,
+            "point_labels": point_labels,
+            "mask_input": mask_input.astype(np.float32),
+            "has_mask_input": np.array([1.0 if has_mask else 0.0], dtype=np.float32),
+        })
+        masks = np.stack([
+            np.asarray(Image.fromarray(logits).resize((orig_w, orig_h), Image.BILINEAR)) > 0
+            for logits in low_res[0]
+        ])
+        return masks, iou[0], low_res
+
+
+def compute_embedding(predictor: CachedEmbeddingPredictor, dtype: str) -> bytes:
+    """Scheduler task: the image is already set, package its features."""
+    return pack_embedding(predictor._features, predictor._orig_hw[-1], dtype)
+
+
+def benchmark_decoder(image_path: str, onnx_path: str, runs: int, model_name: Optional[str]) -> None:
+    """Compare per-click latency of the PyTorch predictor and the ONNX decoder."""
+    if not SAM2_AVAILABLE:
+        print("[!] SAM2 is not available, nothing to benchmark")
+        return
+    predictor = registry.get(model_name)
+
+    image_np = np.array(Image.open(image_path).convert("RGB"))
+    height, width = image_np.shape[:2]
+    predictor.set_image(image_np)
+    embedding = OnnxMaskDecoder.load_embedding(compute_embedding(predictor, "float32"))
+    decoder = OnnxMaskDecoder(onnx_path)
+    point, label = [[width / 2, height / 2]], [1]
+
+    def time_it(fn) -> List[float]:
+        fn()  # warmup
+        timings = []
+        for _ in range(runs):
+            run_start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - run_start) * 1000)
+        return sorted(timings)
+
+    torch_ms = time_it(lambda: predictor.predict(
+        point_coords=np.array(point), point_labels=np.array(label), multimask_output=True
+    ))
+    onnx_ms = time_it(lambda: decoder.decode(embedding, point, label))
+    print(f"{'decoder':<10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, timings in (("pytorch", torch_ms), ("onnx-cpu", onnx_ms)):
+        print(f"{name:<10} {timings[len(timings) // 2]:>8.2f} {timings[int(len(timings) * 0.95)]:>8.2f}")
+
+
+def load_model() -> None:
+    """Warm the registry with the default model, loaded on the scheduler thread that owns it."""
+    global model_loaded
+
+    print(f"[*] Using device: {registry.device}")
 
     if SAM2_AVAILABLE:
         try:
-            checkpoint = os.getenv("SAM2_CHECKPOINT_PATH", "checkpoints/sam2_hiera_large.pt")
-            model_cfg = "sam2_hiera_l.yaml"
-            print(f"[*] Loading SAM2 from {checkpoint}...")
-            sam2_model = build_sam2(model_cfg, checkpoint, device=device)
-            predictor = SAM2ImagePredictor(sam2_model)
+            scheduler.submit(None, lambda _pred, _img: registry.get(DEFAULT_MODEL), PRIORITY_INTERACTIVE).result()
             model_loaded = True
             print(f"[+] SAM 2 loaded successfully. VRAM: {get_vram_usage():.0f}MB")
         except Exception as e:
@@ -214,6 +1739,12 @@ def process_queue():
     else:
         print("[!] Running in mock mode (SAM2 not installed)")
 
+
+def process_queue():
+    """Background queue processor for batch jobs."""
+    print(f"[*] Starting SAM 2 worker...")
+    load_model()
+
     print(f"[*] Listening for jobs on {QUEUE_NAME}...")
 
     while True:
@@ -235,68 +1766,54 @@ def process_queue():
                     job_id = job["id"]
                     payload = job["payload"]
 
+                    if payload.get("type") == "video":
+                        print(f"[*] Processing SAM 2 video job {job_id}")
+                        process_video_job(job_id, payload, start_ts)
+                        continue
+
                     print(f"[*] Processing SAM 2 job {job_id}")
                     publish_progress(job_id, 0, "Starting segmentation...")
 
                     # Download image
                     publish_progress(job_id, 10, "Downloading image...")
                     image_url = payload.get("image_url", "")
-                    image = download_image(image_url)
-                    image_np = np.array(image)
+                    decoded = download_image(image_url)
+                    image_np = np.asarray(decoded.image)
 
                     publish_progress(job_id, 30, "Preparing model...")
 
                     output_dir = f"outputs/{job_id}"
                     os.makedirs(output_dir, exist_ok=True)
 
-                    if predictor is not None:
-                        publish_progress(job_id, 40, "Setting image...")
-                        predictor.set_image(image_np)
-
+                    if SAM2_AVAILABLE and model_loaded:
                         publish_progress(job_id, 60, "Running inference...")
-
-                        mode = payload.get("mode", "automatic")
-                        points = payload.get("points")
-                        labels = payload.get("labels")
-                        boxes = payload.get("boxes")
-                        multimask = payload.get("multimask_output", False)
-
-                        if mode == "point" and points:
-                            point_coords = np.array(points)
-                            point_labels = np.array(labels or [1] * len(points))
-                            masks, scores, _ = predictor.predict(
-                                point_coords=point_coords,
-                                point_labels=point_labels,
-                                multimask_output=multimask
-                            )
-                        elif mode == "box" and boxes:
-                            masks, scores, _ = predictor.predict(
-                                box=np.array(boxes[0]),
-                                multimask_output=multimask
-                            )
-                        else:
-                            masks, scores, _ = predictor.predict(
-                                point_coords=None,
-                                point_labels=None,
-                                multimask_output=True
-                            )
+                        decoded_payload = decoded.to_decoded(payload)
+                        masks, scores, extra = scheduler.submit(
+                            image_np,
+                            lambda pred, img: run_segmentation(pred, img, decoded_payload),
+                            PRIORITY_BATCH,
+                            model=payload.get("model")
+                        ).result()
 
                         publish_progress(job_id, 80, "Saving masks...")
-
-                        mask_paths = []
-                        for i, mask in enumerate(masks):
-                            mask_img = Image.fromarray((mask * 255).astype(np.uint8))
-                            mask_path = f"{output_dir}/mask_{i}.png"
-                            mask_img.save(mask_path)
-                            mask_paths.append(mask_path)
+                        masks, extra = finish_masks(
+                            decoded, masks, extra, payload.get("mask_resolution", "original")
+                        )
+                        encoded = encode_masks(
+                            masks,
+                            payload.get("mask_encoding", "png"),
+                            output_dir,
+                            inline=payload.get("inline_masks", False)
+                        )
 
                         duration = int((time.time() - start_ts) * 1000)
                         publish_progress(job_id, 100, "Complete")
                         publish_result(job_id, "completed", {
-                            "masks": mask_paths,
+                            **encoded,
                             "scores": scores.tolist(),
                             "inputImageUrl": image_url,
-                            "outputDir": output_dir
+                            "outputDir": output_dir,
+                            **extra
                         }, duration=duration)
                     else:
                         # Mock mode
@@ -305,7 +1822,7 @@ def process_queue():
 
                         mock_mask_path = f"{output_dir}/mask_0.png"
                         # Create a simple gradient mask for demo
-                        mock_mask = Image.new("L", (image.width, image.height), 128)
+                        mock_mask = Image.new("L", decoded.original_size, 128)
                         mock_mask.save(mock_mask_path)
 
                         duration = int((time.time() - start_ts) * 1000)
@@ -345,7 +1862,233 @@ def run_queue_processor():
     thread.start()
 
 
-if __name__ == "__main__":
+def benchmark_automatic(image_path: str, runs: int, model_name: Optional[str]) -> None:
+    """Print time-per-image for every automatic preset on a local image."""
+    if not SAM2_AVAILABLE:
+        print("[!] SAM2 is not available, nothing to benchmark")
+        return
+    predictor = registry.get(model_name)
+
+    image_np = np.array(Image.open(image_path).convert("RGB"))
+    predictor.set_image(image_np)  # embedding is shared by every preset
+
+    print(f"{'preset':<10} {'ms/image':>10} {'masks':>7}")
+    for preset in AMG_PRESETS:
+        options = resolve_amg_options(preset)
+        timings = []
+        for _ in range(runs):
+            run_start = time.time()
+            masks, _, _ = generate_automatic_masks(predictor, image_np, options)
+            timings.append((time.time() - run_start) * 1000)
+        print(f"{preset:<10} {sum(timings) / len(timings):>10.1f} {len(masks):>7}")
+
+
+def benchmark_encodings(count: int, size: int, runs: int) -> None:
+    """Compare encode time and bytes per mask for every encoding on synthetic masks."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:size, :size]
+    masks = np.zeros((count, size, size), dtype=bool)
+    for i in range(count):
+        cy, cx = rng.integers(0, size, 2)
+        ry, rx = rng.integers(size // 40 + 1, size // 4, 2)
+        masks[i] = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 <= 1
+    float_masks = masks.astype(np.float32)  # what predictor.predict returns
+
+    encodings = [e for e in MASK_ENCODINGS if e != "polygons" or cv2 is not None]
+    print(f"{count} masks at {size}x{size}")
+    print(f"{'encoding':<10} {'ms/mask':>9} {'bytes/mask':>11}")
+    for encoding in encodings:
+        out_dir = f"outputs/bench_encodings/{encoding}"
+        timings = []
+        for _ in range(runs):
+            run_start = time.time()
+            result = encode_masks(float_masks, encoding, out_dir)
+            timings.append((time.time() - run_start) * 1000)
+        files = result.get("masks") if encoding == "png" else [result["maskArtifact"]]
+        total_bytes = sum(os.path.getsize(f) for f in files)
+        print(f"{encoding:<10} {sum(timings) / len(timings) / count:>9.2f} {total_bytes / count:>11.0f}")
+
+
+async def load_test(base_url: str, image_url: str, concurrency: int, total: int) -> None:
+    """
+    Fire concurrent /segment requests while probing /health, and report how
+    long the health probe takes while the worker is busy.
+    """
+    def percentile(values: List[float], pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    segment_ms: List[float] = []
+    health_ms: List[float] = []
+    failures = 0
+    done = asyncio.Event()
+    gate = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        async def one_segment():
+            nonlocal failures
+            async with gate:
+                req_start = time.perf_counter()
+                response = await client.post("/segment", json={"image_url": image_url, "mode": "automatic"})
+                segment_ms.append((time.perf_counter() - req_start) * 1000)
+                if response.status_code != 200:
+                    failures += 1
+
+        async def probe_health():
+            while not done.is_set():
+                req_start = time.perf_counter()
+                await client.get("/health")
+                health_ms.append((time.perf_counter() - req_start) * 1000)
+                await asyncio.sleep(0.1)
+
+        probe = asyncio.create_task(probe_health())
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(one_segment() for _ in range(total)))
+        wall = time.perf_counter() - wall_start
+        done.set()
+        await probe
+
+    print(f"{total} /segment requests, concurrency {concurrency}, {failures} non-200, {wall:.1f}s wall")
+    print(f"/segment ms  p50={percentile(segment_ms, 0.5):.0f} p95={percentile(segment_ms, 0.95):.0f}")
+    print(f"/health  ms  p50={percentile(health_ms, 0.5):.1f} p95={percentile(health_ms, 0.95):.1f} "
+          f"max={max(health_ms, default=0):.1f} ({len(health_ms)} probes)")
+
+
+def _decode_probe(data: bytes, draft: bool, conn) -> None:
+    import resource
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    decoded = decode_image(data, draft=draft)
+    np.asarray(decoded.image)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((decoded.decode_ms, decoded.image.size, (peak - baseline) / 1024))
+    conn.close()
+
+
+def benchmark_decode(image_path: str, runs: int) -> None:
+    """Compare full decode against draft/reduced decode: time and peak RSS growth."""
+    import multiprocessing
+
+    with open(image_path, "rb") as f:
+        data = f.read()
+    ctx = multiprocessing.get_context("fork")  # each probe starts from the same baseline RSS
+
+    print(f"{image_path}: {len(data) / 1024 / 1024:.1f} MB")
+    print(f"{'decode':<8} {'ms':>8} {'peak +MB':>9} {'size':>12}")
+    for label, draft in (("full", False), ("reduced", True)):
+        timings, rss = [], []
+        for _ in range(runs):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_decode_probe, args=(data, draft, child))
+            proc.start()
+            decode_ms, size, rss_mb = parent.recv()
+            proc.join()
+            timings.append(decode_ms)
+            rss.append(rss_mb)
+        print(f"{label:<8} {sum(timings) / runs:>8.1f} {max(rss):>9.1f} {size[0]:>6}x{size[1]:<5}")
+
+
+def benchmark_models(image_path: str, runs: int) -> None:
+    """
+    Reference latency table for every available checkpoint on this device:
+    load time, image encoder (set_image) and a single-click decode.
+    """
+    if not SAM2_AVAILABLE:
+        print("[!] SAM2 is not available, nothing to benchmark")
+        return
+
+    image_np = np.array(Image.open(image_path).convert("RGB"))
+    height, width = image_np.shape[:2]
+    point = np.array([[width / 2, height / 2]])
+
+    print(f"Device: {registry.device}, image {width}x{height}, {runs} runs")
+    print("| model | load s | resident MB | encode ms | click ms |")
+    print("|---|---|---|---|---|")
+    for name in SAM2_MODELS:
+        if not os.path.exists(model_paths(name)[1]):
+            continue
+        predictor = registry.get(name)
+        encode, click = [], []
+        for _ in range(runs):
+            run_start = time.perf_counter()
+            predictor.inner.set_image(image_np)  # bypass the embedding cache
+            encode.append((time.perf_counter() - run_start) * 1000)
+            run_start = time.perf_counter()
+            predictor.predict(point_coords=point, point_labels=np.array([1]), multimask_output=True)
+            click.append((time.perf_counter() - run_start) * 1000)
+        print(f"| {name} | {registry.load_seconds[name]:.1f} | "
+              f"{registry._sizes.get(name, 0) / 1024 / 1024:.0f} | "
+              f"{sorted(encode)[len(encode) // 2]:.0f} | {sorted(click)[len(click) // 2]:.1f} |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAM2 Segmentation Worker")
+    parser.add_argument("--benchmark-automatic", metavar="IMAGE",
+                        help="Time each automatic mask preset on IMAGE and exit")
+    parser.add_argument("--benchmark-encodings", action="store_true",
+                        help="Compare mask output encodings on synthetic masks and exit")
+    parser.add_argument("--mask-count", type=int, default=64, help="Masks for --benchmark-encodings")
+    parser.add_argument("--mask-size", type=int, default=1024, help="Mask side for --benchmark-encodings")
+    parser.add_argument("--runs", type=int, default=3, help="Benchmark repetitions")
+    parser.add_argument("--model", choices=list(SAM2_MODELS), default=None,
+                        help="Registry model for exports and benchmarks (default: SAM2_DEFAULT_MODEL)")
+    parser.add_argument("--benchmark-models", metavar="IMAGE",
+                        help="Print a latency table for every available checkpoint and exit")
+    parser.add_argument("--export-onnx", metavar="PATH",
+                        help="Export the prompt encoder + mask decoder to ONNX and exit")
+    parser.add_argument("--single-mask", action="store_true",
+                        help="Export a single-mask decoder instead of the 3-mask multimask graph")
+    parser.add_argument("--benchmark-decoder", nargs=2, metavar=("IMAGE", "ONNX"),
+                        help="Compare PyTorch and ONNX click-decode latency and exit")
+    parser.add_argument("--benchmark-decode", metavar="IMAGE",
+                        help="Compare full and reduced-resolution decoding of IMAGE and exit")
+    parser.add_argument("--benchmark-video", metavar="VIDEO",
+                        help="Propagate --video-prompts through VIDEO, print RSS per window and exit")
+    parser.add_argument("--video-prompts", default='[{"obj_id": 1, "frame_idx": 0, "points": [[100, 100]]}]',
+                        help="JSON list of prompts for --benchmark-video")
+    parser.add_argument("--window-frames", type=int, default=VIDEO_WINDOW_FRAMES,
+                        help="Frames per propagation window")
+    parser.add_argument("--load-test", metavar="BASE_URL",
+                        help="Load-test a running worker at BASE_URL and exit")
+    parser.add_argument("--image-url", help="Image URL used by --load-test")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests for --load-test")
+    parser.add_argument("--requests", type=int, default=32, help="Total requests for --load-test")
+    args = parser.parse_args()
+
+    if args.load_test:
+        if not args.image_url:
+            parser.error("--load-test requires --image-url")
+        asyncio.run(load_test(args.load_test, args.image_url, args.concurrency, args.requests))
+        return
+
+    if args.export_onnx:
+        export_decoder_onnx(args.export_onnx, args.model, multimask_output=not args.single_mask)
+        return
+    if args.benchmark_decoder:
+        benchmark_decoder(args.benchmark_decoder[0], args.benchmark_decoder[1], max(args.runs, 20), args.model)
+        return
+    if args.benchmark_automatic:
+        benchmark_automatic(args.benchmark_automatic, args.runs, args.model)
+        return
+    if args.benchmark_models:
+        benchmark_models(args.benchmark_models, args.runs)
+        return
+    if args.benchmark_encodings:
+        benchmark_encodings(args.mask_count, args.mask_size, args.runs)
+        return
+    if args.benchmark_decode:
+        benchmark_decode(args.benchmark_decode, args.runs)
+        return
+    if args.benchmark_video:
+        benchmark_video(args.benchmark_video, args.video_prompts, args.window_frames, args.model)
+        return
+
+    scheduler.start()
     run_queue_processor()
     print(f"[*] Starting FastAPI server on port {PORT}...")
     uvicorn.run(app, host="0.0.0.0", port=PORT)
+
+
+if __name__ == "__main__":
+    main()
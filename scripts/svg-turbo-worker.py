@@ -6,22 +6,80 @@ Provides bitmap to vector conversion via potrace/vtracer with real-time progress
 import time
 import json
 import os
+import argparse
+import asyncio
+import functools
+import gzip
+import hashlib
+import math
+import multiprocessing
+import queue
+import re
+import resource
+import signal
 import subprocess
 import tempfile
 import redis
-from typing import Optional
-from fastapi import FastAPI, HTTPException
+import numpy as np
+from io import BytesIO
+from typing import List, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from PIL import Image
 import uvicorn
 import threading
+import zipfile
 import requests
 from pathlib import Path
 
+from uploads import receive_upload
+
+# In-process tracing backends (Python bindings), preferred over the CLI tools
+try:
+    import vtracer as vtracer_lib
+    VTRACER_PY_AVAILABLE = hasattr(vtracer_lib, "convert_raw_image_to_svg")
+except ImportError:
+    vtracer_lib = None
+    VTRACER_PY_AVAILABLE = False
+
+try:
+    # pypotrace or potracer, both expose potrace.Bitmap(...).trace()
+    import potrace as potrace_lib
+    POTRACE_PY_AVAILABLE = hasattr(potrace_lib, "Bitmap")
+except ImportError:
+    potrace_lib = None
+    POTRACE_PY_AVAILABLE = False
+
 # Configuration
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 MODEL_ID = "svg-turbo/vectorize"
 QUEUE_NAME = "batch-generation-queue"
 PORT = int(os.getenv("SVG_TURBO_PORT", "8008"))
+BACKEND = os.getenv("SVG_TURBO_BACKEND", "auto")  # auto, inprocess, subprocess
+TRACE_WORKERS = int(os.getenv("SVG_TURBO_WORKERS", "0"))  # 0 = container CPU quota
+JOB_TIMEOUT = float(os.getenv("SVG_TURBO_JOB_TIMEOUT", "120"))  # seconds per trace
+TILE_SIZE = int(os.getenv("SVG_TURBO_TILE_SIZE", "1024"))
+TILE_OVERLAP = int(os.getenv("SVG_TURBO_TILE_OVERLAP", "32"))
+MAX_MEGAPIXELS = float(os.getenv("SVG_TURBO_MAX_MEGAPIXELS", "400"))
+VERIFY_OPTIMIZED = os.getenv("SVG_TURBO_VERIFY_OPTIMIZED", "0") == "1"  # render-compare (needs cairosvg)
+VISUAL_TOLERANCE = float(os.getenv("SVG_TURBO_VISUAL_TOLERANCE", "1.0"))  # mean gray-level diff
+INLINE_MAX_BYTES = int(os.getenv("SVG_TURBO_INLINE_MAX_KB", "64")) * 1024  # larger results go by reference
+ARTIFACT_TTL = int(os.getenv("SVG_TURBO_ARTIFACT_TTL", "3600"))  # seconds
+ARTIFACT_PREFIX = "svg-turbo:artifact:"
+CACHE_DIR = os.getenv("SVG_TURBO_CACHE_DIR", "cache/vectorize")
+CACHE_MAX_MB = float(os.getenv("SVG_TURBO_CACHE_MAX_MB", "512"))  # 0 disables the cache
+BATCH_MAX_ITEMS = int(os.getenv("SVG_TURBO_BATCH_MAX_ITEMS", "1000"))
+BATCH_ARCHIVE_MAX_BYTES = int(float(os.getenv("SVG_TURBO_BATCH_ARCHIVE_MAX_MB", "2048")) * 1024 * 1024)
+ARCHIVE_ENTRY_MAX_MB = float(os.getenv("SVG_TURBO_ARCHIVE_ENTRY_MAX_MB", "64"))  # also caps batch URL downloads
+BATCH_ITEM_MAX_BYTES = int(ARCHIVE_ENTRY_MAX_MB * 1024 * 1024)
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+
+# Posters and scans legitimately exceed PIL's decompression-bomb default
+Image.MAX_IMAGE_PIXELS = int(MAX_MEGAPIXELS * 1_000_000)
 
 # Initialize Redis
 r = redis.from_url(REDIS_URL)
@@ -30,6 +88,9 @@ app = FastAPI(title="SVG-Turbo Vectorization Worker", version="1.0.0")
 start_time = time.time()
 
 
+# The CLI probes run on first use rather than at import: spawned trace workers
+# re-import this module and should only pay for the tools they actually call.
+@functools.lru_cache(maxsize=None)
 def check_potrace() -> bool:
     """Check if potrace is available."""
     try:
@@ -39,6 +100,7 @@ def check_potrace() -> bool:
         return False
 
 
+@functools.lru_cache(maxsize=None)
 def check_vtracer() -> bool:
     """Check if vtracer is available."""
     try:
@@ -48,6 +110,7 @@ def check_vtracer() -> bool:
         return False
 
 
+@functools.lru_cache(maxsize=None)
 def check_imagemagick() -> bool:
     """Check if ImageMagick convert is available."""
     try:
@@ -57,25 +120,54 @@ def check_imagemagick() -> bool:
         return False
 
 
-POTRACE_AVAILABLE = check_potrace()
-VTRACER_AVAILABLE = check_vtracer()
-IMAGEMAGICK_AVAILABLE = check_imagemagick()
-
-
-class VectorizeRequest(BaseModel):
-    image_url: str
+class VectorizeOptions(BaseModel):
     mode: str = "trace"  # trace, centerline, polygon
     output_format: str = "svg"
     color_mode: str = "binary"  # color, grayscale, binary
     threshold: int = 128
     smoothing: int = 50
     simplification: int = 50
+    tile_size: Optional[int] = None  # opt-in tile side in pixels, output is seam-split (see vectorize_tiled)
+    colors: Optional[int] = None  # color mode: quantize to K colors before tracing
+    quantize_method: str = "median-cut"  # median-cut, kmeans
+    despeckle: int = 1  # majority-filter passes after quantizing (0 = off)
+
+
+class VectorizeRequest(VectorizeOptions):
+    image_url: str
+
+
+class VectorizeBatchRequest(VectorizeOptions):
+    image_urls: List[str]
+    output: str = "ndjson"  # ndjson, zip
 
 
 class HealthResponse(BaseModel):
     status: str
     tools_available: list
     uptime: float
+    trace_workers: int = 0
+    pending_traces: int = 0
+    cache: dict = {}
+    tiling: dict = {}
+
+
+OPTION_DEFAULTS = {
+    "mode": "trace",
+    "color_mode": "binary",
+    "threshold": 128,
+    "smoothing": 50,
+    "simplification": 50,
+    "tile_size": None,
+    "colors": None,
+    "quantize_method": "median-cut",
+    "despeckle": 1,
+}
+
+
+def job_options(payload: dict) -> dict:
+    """Tracing options from a request or queue payload, defaults filled in."""
+    return {key: payload.get(key, default) for key, default in OPTION_DEFAULTS.items()}
 
 
 def publish_progress(job_id: str, progress: int, message: str = "") -> None:
@@ -101,35 +193,172 @@ def publish_result(job_id: str, status: str, data: Optional[dict] = None, error:
     r.publish(f"job-results:{job_id}", json.dumps(result))
 
 
-def download_image(url: str) -> bytes:
-    """Download image from URL."""
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
-    return response.content
+def store_svg_artifact(svg_content: str) -> dict:
+    """
+    Store a gzip-compressed SVG under a content-addressed Redis key with a
+    TTL and return the reference that goes into the published result.
+    """
+    raw = svg_content.encode("utf-8")
+    artifact_id = hashlib.sha256(raw).hexdigest()[:32]
+    compressed = gzip.compress(raw, compresslevel=6)
+    r.set(f"{ARTIFACT_PREFIX}{artifact_id}", compressed, ex=ARTIFACT_TTL)
+    return {
+        "svgRef": artifact_id,
+        "svgRefUrl": f"/artifacts/{artifact_id}",
+        "svgBytes": len(raw),
+        "svgCompressedBytes": len(compressed),
+        "expiresIn": ARTIFACT_TTL,
+    }
+
+
+def svg_result_fields(svg_content: str) -> dict:
+    """svgContent inline when small, otherwise a reference to a stored artifact."""
+    size = len(svg_content.encode("utf-8"))
+    if size <= INLINE_MAX_BYTES:
+        return {"svgContent": svg_content, "svgBytes": size}
+    return store_svg_artifact(svg_content)
+
+
+def download_image(url: str, max_bytes: Optional[int] = None) -> bytes:
+    """Download image from URL, streamed and refused once past max_bytes if given."""
+    with requests.get(url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length", "")
+        if max_bytes and length.isdigit() and int(length) > max_bytes:
+            raise ValueError(f"{url} is larger than {max_bytes / 1024 / 1024:g} MB")
+        data = bytearray()
+        for chunk in response.iter_content(1024 * 1024):
+            data += chunk
+            if max_bytes and len(data) > max_bytes:
+                raise ValueError(f"{url} is larger than {max_bytes / 1024 / 1024:g} MB")
+        return bytes(data)
+
+
+def load_gray(image_data: bytes) -> np.ndarray:
+    """Decode to an 8-bit grayscale array, compositing transparency onto white."""
+    img = Image.open(BytesIO(image_data))
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return np.asarray(img.convert("L"))
+
+
+def binarize(gray: np.ndarray, threshold: int) -> np.ndarray:
+    """Foreground mask: pixels darker than threshold (0-255)."""
+    return gray < threshold
+
+
+def _xy(point) -> Tuple[float, float]:
+    # pypotrace returns tuples, potracer returns objects with x/y
+    return (point.x, point.y) if hasattr(point, "x") else (point[0], point[1])
+
+
+def potrace_inverts() -> bool:
+    """
+    Whether the potrace binding fills False pixels rather than True ones.
+
+    potracer follows image convention (True = white) and pypotrace traces
+    True, and neither says which it is, so trace a square in an empty field
+    once: if the outline reaches the bitmap border, the background was filled.
+    """
+    bitmap = np.zeros((32, 32), dtype=bool)
+    bitmap[8:24, 8:24] = True
+    points = []
+    for curve in potrace_lib.Bitmap(bitmap).trace(turdsize=0):
+        points.append(_xy(curve.start_point))
+        points.extend(_xy(segment.end_point) for segment in curve)
+    return not points or any(min(x, y) < 4 or max(x, y) > 28 for x, y in points)
+
+
+if POTRACE_PY_AVAILABLE:
+    try:
+        POTRACE_PY_INVERTS = potrace_inverts()
+    except Exception as e:
+        print(f"[!] potrace bindings failed a probe trace, disabling: {e}")
+        POTRACE_PY_AVAILABLE = POTRACE_PY_INVERTS = False
+else:
+    POTRACE_PY_INVERTS = False
+
+
+def potrace_path_to_svg(path, width: int, height: int) -> str:
+    """Serialise a potrace path as one even-odd filled SVG path (holes included)."""
+    d = []
+    for curve in path:
+        x, y = _xy(curve.start_point)
+        d.append(f"M{x:.2f},{y:.2f}")
+        for segment in curve:
+            ex, ey = _xy(segment.end_point)
+            if segment.is_corner:
+                cx, cy = _xy(segment.c)
+                d.append(f"L{cx:.2f},{cy:.2f}L{ex:.2f},{ey:.2f}")
+            else:
+                (ax, ay), (bx, by) = _xy(segment.c1), _xy(segment.c2)
+                d.append(f"C{ax:.2f},{ay:.2f} {bx:.2f},{by:.2f} {ex:.2f},{ey:.2f}")
+        d.append("Z")
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}">\n'
+        f'<path fill="#000000" fill-rule="evenodd" d="{"".join(d)}"/>\n'
+        f'</svg>\n'
+    )
+
+
+def trace_potrace_inprocess(image_data: bytes, options: dict) -> str:
+    """Trace with the potrace Python bindings on an in-memory bitmap."""
+    foreground = binarize(load_gray(image_data), options.get("threshold", 128))
+    height, width = foreground.shape
+    # smoothing 0-100 maps onto potrace's corner threshold alphamax (0 = sharp, 1.334 = smoothest)
+    alphamax = max(0.0, min(100, options.get("smoothing", 50))) / 100 * 1.3334
+    path = potrace_lib.Bitmap(~foreground if POTRACE_PY_INVERTS else foreground).trace(
+        turdsize=2,
+        alphamax=alphamax,
+        opticurve=True,
+        opttolerance=0.2,
+    )
+    return potrace_path_to_svg(path, width, height)
+
+
+def trace_vtracer_inprocess(image_data: bytes, options: dict) -> str:
+    """Trace with the vtracer Python bindings directly from the encoded bytes."""
+    color_mode = options.get("color_mode", "binary")
+    img = Image.open(BytesIO(image_data))
+    img_format = (img.format or "png").lower()
+
+    if color_mode == "grayscale":
+        # vtracer has no grayscale mode: trace a gray image in color mode
+        buffer = BytesIO()
+        img.convert("LA" if "A" in img.getbands() else "L").save(buffer, format="PNG")
+        image_data, img_format = buffer.getvalue(), "png"
+
+    return vtracer_lib.convert_raw_image_to_svg(
+        image_data,
+        img_format=img_format,
+        colormode="binary" if color_mode == "binary" else "color",
+    )
 
 
 def vectorize_with_potrace(image_path: str, output_path: str, options: dict) -> str:
     """Use potrace for bitmap to SVG conversion."""
-    threshold = options.get("threshold", 50)
+    threshold = options.get("threshold", 128)
     smoothing = options.get("smoothing", 5)
 
     # First convert to PBM (potrace input format) using ImageMagick
     pbm_path = image_path.rsplit(".", 1)[0] + ".pbm"
 
-    if IMAGEMAGICK_AVAILABLE:
+    if check_imagemagick():
         subprocess.run([
             "convert", image_path,
-            "-threshold", f"{threshold}%",
+            "-threshold", f"{threshold * 100 / 255:.1f}%",
             "-type", "bilevel",
             pbm_path
         ], check=True, capture_output=True)
     else:
-        # Fallback: try to use PIL for conversion
-        from PIL import Image
-        img = Image.open(image_path).convert("L")
-        # Apply threshold
-        img = img.point(lambda x: 255 if x > threshold * 255 / 100 else 0, "1")
-        img.save(pbm_path)
+        # Fallback: threshold with NumPy; PBM stores foreground (black) as 1
+        with open(image_path, "rb") as f:
+            foreground = binarize(load_gray(f.read()), threshold)
+        Image.fromarray(~foreground).convert("1").save(pbm_path)
 
     # Run potrace
     subprocess.run([
@@ -172,13 +401,11 @@ def vectorize_with_vtracer(image_path: str, output_path: str, options: dict) ->
         return f.read()
 
 
-def vectorize_simple(image_path: str, output_path: str) -> str:
+def vectorize_simple(image_data: bytes) -> str:
     """Simple fallback vectorization - creates placeholder SVG."""
     # Read image dimensions
     try:
-        from PIL import Image
-        img = Image.open(image_path)
-        width, height = img.size
+        width, height = Image.open(BytesIO(image_data)).size
     except Exception:
         width, height = 100, 100
 
@@ -191,27 +418,1007 @@ def vectorize_simple(image_path: str, output_path: str) -> str:
   </text>
 </svg>'''
 
-    with open(output_path, "w") as f:
-        f.write(svg_content)
-
     return svg_content
 
 
+def _run_cli_backend(fn, image_data: bytes, options: dict) -> str:
+    """Run a subprocess backend, which needs the input and output on disk."""
+    with tempfile.TemporaryDirectory(prefix="svg_turbo_") as tmp_dir:
+        image_path = os.path.join(tmp_dir, "input.png")
+        with open(image_path, "wb") as f:
+            f.write(image_data)
+        return fn(image_path, os.path.join(tmp_dir, "output.svg"), options)
+
+
+def select_backend(color_mode: str) -> str:
+    """
+    Pick a backend for the job. vtracer handles color, potrace the rest, and
+    in-process bindings win over the CLI tools unless SVG_TURBO_BACKEND says
+    otherwise.
+    """
+    use_py = BACKEND in ("auto", "inprocess")
+    use_cli = BACKEND in ("auto", "subprocess")
+    vtracer_py, vtracer_cli = use_py and VTRACER_PY_AVAILABLE, use_cli and check_vtracer()
+    potrace_py, potrace_cli = use_py and POTRACE_PY_AVAILABLE, use_cli and check_potrace()
+
+    if color_mode == "color" and (vtracer_py or vtracer_cli):
+        return "vtracer-py" if vtracer_py else "vtracer"
+    if potrace_py or potrace_cli:
+        return "potrace-py" if potrace_py else "potrace"
+    if vtracer_py or vtracer_cli:
+        return "vtracer-py" if vtracer_py else "vtracer"
+    return "placeholder"
+
+
+BACKENDS = {
+    "vtracer-py": lambda data, options: trace_vtracer_inprocess(data, options),
+    "potrace-py": lambda data, options: trace_potrace_inprocess(data, options),
+    "vtracer": lambda data, options: _run_cli_backend(vectorize_with_vtracer, data, options),
+    "potrace": lambda data, options: _run_cli_backend(vectorize_with_potrace, data, options),
+    "placeholder": lambda data, options: vectorize_simple(data),
+}
+
+
+def vectorize_bytes(image_data: bytes, options: dict, backend: Optional[str] = None) -> Tuple[str, str]:
+    """Vectorize encoded image bytes; returns (svg_content, backend used)."""
+    backend = backend or select_backend(options.get("color_mode", "binary"))
+    return BACKENDS[backend](image_data, options), backend
+
+
+# ---------------------------------------------------------------------------
+# SVG output optimizer
+# ---------------------------------------------------------------------------
+
+_NUMBER = r"[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?"
+_PATH_TOKEN = re.compile(rf"[MmLlHhVvCcSsQqTtAaZz]|{_NUMBER}")
+_TRANSLATE = re.compile(rf"^\s*translate\(\s*({_NUMBER})(?:[\s,]+({_NUMBER}))?\s*\)\s*$")
+_ATTR = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+_SVG_TOKEN = re.compile(r"<!--.*?-->|<[^>]+>|[^<]+", re.S)
+_ARITY = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+
+
+def precision_for(simplification: int) -> int:
+    """simplification 0-100 -> decimals kept in path data (3 .. 0)."""
+    return max(0, 3 - max(0, min(100, simplification)) * 3 // 100)
+
+
+def _fmt(value: float, decimals: int) -> str:
+    text = f"{value:.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = "-" + text[2:]
+    return "0" if text in ("-0", "") else text
+
+
+class _PathWriter:
+    """Compact path data: implicit command repeats and minimal separators."""
+
+    def __init__(self):
+        self.out = []
+        self.last_cmd = None
+        self.last_num = None
+
+    def emit(self, cmd: str, numbers: List[str]) -> None:
+        implicit = cmd == self.last_cmd or (cmd == "l" and self.last_cmd == "m")
+        if not implicit or not numbers:
+            self.out.append(cmd)
+            self.last_num = None
+        self.last_cmd = cmd
+        for number in numbers:
+            prev = self.last_num
+            if prev is not None and not number.startswith("-") and not (
+                number.startswith(".") and "." in prev and "e" not in prev
+            ):
+                self.out.append(" ")
+            self.out.append(number)
+            self.last_num = number
+
+    def text(self) -> str:
+        return "".join(self.out)
+
+
+def optimize_path_data(d: str, decimals: int, dx: float = 0.0, dy: float = 0.0, writer: Optional[_PathWriter] = None) -> str:
+    """
+    Rewrite path data as relative commands at the given precision, with an
+    optional translate baked into the opening moveto. Deltas are taken from
+    the already-rounded position, so rounding error never accumulates.
+    """
+    writer = writer or _PathWriter()
+    tokens = _PATH_TOKEN.findall(d)
+    # Starting at the translate makes a leading relative moveto absolute, as the spec says
+    cx, cy, sx, sy = dx, dy, dx, dy  # exact current point and subpath start
+    ex = ey = esx = esy = 0.0  # emitted (rounded) current point and subpath start
+    first = True
+    i = 0
+    cmd = None
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+        elif cmd is None:
+            break
+        lower = cmd.lower()
+        arity = _ARITY[lower]
+        if lower == "z":
+            writer.emit("z", [])
+            cx, cy, ex, ey = sx, sy, esx, esy
+            cmd = None
+            continue
+        args = [float(t) for t in tokens[i:i + arity]]
+        i += arity
+        if len(args) < arity:
+            break
+        rel = cmd.islower()
+
+        def absolute(x, y):
+            return (cx + x, cy + y) if rel else (x + dx, y + dy)
+
+        def delta(x, y):
+            rx, ry = round(x - ex, decimals), round(y - ey, decimals)
+            return rx, ry
+
+        if lower == "m":
+            x, y = absolute(*args)
+            if first:
+                ex, ey = round(x, decimals), round(y, decimals)
+                writer.emit("M", [_fmt(ex, decimals), _fmt(ey, decimals)])
+                first = False
+            else:
+                rx, ry = delta(x, y)
+                writer.emit("m", [_fmt(rx, decimals), _fmt(ry, decimals)])
+                ex, ey = ex + rx, ey + ry
+            cx, cy, sx, sy, esx, esy = x, y, x, y, ex, ey
+            cmd = "l" if rel else "L"  # implicit lineto after moveto
+            continue
+
+        if lower in ("l", "t"):
+            x, y = absolute(*args)
+            rx, ry = delta(x, y)
+            if lower == "l" and rx == 0:
+                writer.emit("v", [_fmt(ry, decimals)])
+            elif lower == "l" and ry == 0:
+                writer.emit("h", [_fmt(rx, decimals)])
+            else:
+                writer.emit(lower, [_fmt(rx, decimals), _fmt(ry, decimals)])
+        elif lower == "h":
+            x, y = (cx + args[0]) if rel else (args[0] + dx), cy
+            rx, ry = delta(x, y)
+            writer.emit("h", [_fmt(rx, decimals)])
+            ry = 0.0
+        elif lower == "v":
+            x, y = cx, (cy + args[0]) if rel else (args[0] + dy)
+            rx, ry = delta(x, y)
+            writer.emit("v", [_fmt(ry, decimals)])
+            rx = 0.0
+        elif lower == "a":
+            x, y = absolute(args[5], args[6])
+            rx, ry = delta(x, y)
+            writer.emit("a", [_fmt(args[0], decimals), _fmt(args[1], decimals), _fmt(args[2], decimals),
+                              "1" if args[3] else "0", "1" if args[4] else "0",
+                              _fmt(rx, decimals), _fmt(ry, decimals)])
+        else:
+            # c, s, q: control points and end point, all relative to the segment start
+            points = [absolute(args[k], args[k + 1]) for k in range(0, arity, 2)]
+            numbers = []
+            for px, py in points:
+                px, py = delta(px, py)
+                numbers += [_fmt(px, decimals), _fmt(py, decimals)]
+            writer.emit(lower, numbers)
+            x, y = points[-1]
+            rx, ry = delta(x, y)
+        cx, cy = x, y
+        ex, ey = ex + rx, ey + ry
+    return writer.text()
+
+
+def path_bounds(d: str, dx: float = 0.0, dy: float = 0.0) -> Tuple[Optional[tuple], bool]:
+    """
+    (min_x, min_y, max_x, max_y) over every end and control point of path
+    data, which contains the drawn area of lines and Beziers, and whether it
+    has arcs (whose bulge the box can miss). Box is None for empty data.
+    """
+    tokens = _PATH_TOKEN.findall(d)
+    xs, ys = [], []
+    cx, cy, sx, sy = dx, dy, dx, dy
+    ctrl, arcs = None, False  # previous control point, for s/t reflection
+    i, cmd, prev = 0, None, None
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+        elif cmd is None:
+            break
+        lower = cmd.lower()
+        if lower == "z":
+            cx, cy, cmd, prev = sx, sy, None, "z"
+            continue
+        arity = _ARITY[lower]
+        args = [float(t) for t in tokens[i:i + arity]]
+        i += arity
+        if len(args) < arity:
+            break
+        ox, oy = (cx, cy) if cmd.islower() else (dx, dy)
+        if lower == "h":
+            points = [(args[0] + ox, cy)]
+        elif lower == "v":
+            points = [(cx, args[0] + oy)]
+        elif lower == "a":
+            points, arcs = [(args[5] + ox, args[6] + oy)], True
+        else:
+            points = [(args[k] + ox, args[k + 1] + oy) for k in range(0, arity, 2)]
+        if lower in ("s", "t"):
+            smooth = ctrl is not None and prev in (("c", "s") if lower == "s" else ("q", "t"))
+            points.insert(0, (2 * cx - ctrl[0], 2 * cy - ctrl[1]) if smooth else (cx, cy))
+        ctrl = points[-2] if lower in ("c", "s", "q", "t") else None
+        for x, y in points:
+            xs.append(x)
+            ys.append(y)
+        cx, cy = points[-1]
+        if lower == "m":
+            sx, sy = cx, cy
+            cmd = "l" if cmd == "m" else "L"
+        prev = lower
+    if not xs:
+        return None, arcs
+    return (min(xs), min(ys), max(xs), max(ys)), arcs
+
+
+def _disjoint(a: tuple, b: tuple) -> bool:
+    """Boxes that at most touch; fills inside them can't overlap"""
+    return a[2] <= b[0] or b[2] <= a[0] or a[3] <= b[1] or b[3] <= a[1]
+
+
+def _path_key(attrs: dict) -> tuple:
+    return tuple(sorted((k, v) for k, v in attrs.items() if k not in ("d", "transform")))
+
+
+def _is_noop_group(attrs: dict) -> bool:
+    match = _TRANSLATE.match(attrs.get("transform", "")) if "transform" in attrs else None
+    other = {k for k in attrs if k != "transform"}
+    return not other and (
+        "transform" not in attrs or (match and float(match.group(1)) == 0 and float(match.group(2) or 0) == 0)
+    )
+
+
+def optimize_svg(svg: str, simplification: int = 50) -> Tuple[str, dict]:
+    """
+    Single streaming pass over the SVG tokens (no DOM): path data is rounded
+    and made relative, consecutive sibling paths with identical paint
+    attributes are merged (which keeps z-order), pure translates are baked
+    into path data, and attribute-less/empty groups and whitespace are dropped.
+
+    Paths are only merged when their bounding boxes are disjoint: overlapping
+    subpaths in one path can cancel under the fill rule and punch holes.
+    Every rewritten path is checked against the original's bounds, and kept
+    verbatim if they differ by more than the rounding allows.
+    """
+    run_start = time.perf_counter()
+    decimals = precision_for(simplification)
+    tolerance = 2 * 10 ** -decimals + 1e-9  # s/t reflected controls carry up to 1.5 units of rounding
+    out = []
+    groups = []  # per open <g>: (dropped?, index of its open tag in out)
+    pending_attrs, pending_data, pending_boxes = None, [], []
+    paths_in = paths_out = rejected = 0
+
+    def flush() -> None:
+        nonlocal pending_attrs, pending_data, pending_boxes, paths_out
+        if pending_data:
+            attrs = " ".join(f'{k}="{v}"' for k, v in pending_attrs.items() if k not in ("d", "transform"))
+            out.append(f'<path d="{"".join(pending_data)}"{" " + attrs if attrs else ""}/>')
+            paths_out += 1
+        pending_attrs, pending_data, pending_boxes = None, [], []
+
+    for token in _SVG_TOKEN.findall(svg):
+        if not token.startswith("<"):
+            if token.strip():
+                flush()
+                out.append(token)
+            continue
+
+        if token.startswith("<path") and token.endswith("/>"):
+            paths_in += 1
+            attrs = dict(_ATTR.findall(token))
+            dx = dy = 0.0
+            if "transform" in attrs:
+                match = _TRANSLATE.match(attrs["transform"])
+                if not match:
+                    # Anything but a translate can't be baked into the data
+                    flush()
+                    out.append(token)
+                    paths_out += 1
+                    continue
+                dx, dy = float(match.group(1)), float(match.group(2) or 0)
+            data = optimize_path_data(attrs.get("d", ""), decimals, dx, dy)
+            box, arcs = path_bounds(attrs.get("d", ""), dx, dy)
+            new_box, _ = path_bounds(data)
+            if (box is None) != (new_box is None) or (
+                box is not None and max(abs(a - b) for a, b in zip(box, new_box)) > tolerance
+            ):
+                flush()
+                out.append(token)
+                paths_out += 1
+                rejected += 1
+                continue
+            mergeable = (
+                pending_data and _path_key(attrs) == _path_key(pending_attrs) and box is not None and not arcs
+                and all(other is not None and _disjoint(box, other) for other in pending_boxes)
+            )
+            if not mergeable:
+                flush()
+                pending_attrs = attrs
+            pending_data.append(data)
+            pending_boxes.append(None if arcs else box)
+            continue
+
+        flush()
+        if token.startswith("<g") and not token.endswith("/>"):
+            drop = _is_noop_group(dict(_ATTR.findall(token)))
+            groups.append((drop, len(out)))
+            if not drop:
+                out.append(token)
+        elif token.startswith("</g") and groups:
+            drop, index = groups.pop()
+            if drop:
+                continue
+            if len(out) == index + 1:
+                out.pop()  # empty group
+            else:
+                out.append(token)
+        else:
+            out.append(token)
+    flush()
+
+    optimized = "".join(out)
+    return optimized, {
+        "bytesIn": len(svg),
+        "bytesOut": len(optimized),
+        "bytesSaved": len(svg) - len(optimized),
+        "pathsIn": paths_in,
+        "pathsOut": paths_out,
+        "pathsRejected": rejected,
+        "precision": decimals,
+        "optimizeMs": round((time.perf_counter() - run_start) * 1000, 2),
+    }
+
+
+def render_svg(svg: str, width: int, height: int) -> Optional[np.ndarray]:
+    """Rasterise to grayscale for visual comparisons; None without cairosvg."""
+    try:
+        import cairosvg
+    except (ImportError, OSError):
+        return None
+    png = cairosvg.svg2png(bytestring=svg.encode(), output_width=width, output_height=height,
+                           background_color="white")
+    return np.asarray(Image.open(BytesIO(png)).convert("L"))
+
+
+def visual_difference(original: str, optimized: str, width: int, height: int) -> Optional[float]:
+    """Mean absolute gray-level difference (0-255) between two renders."""
+    before, after = render_svg(original, width, height), render_svg(optimized, width, height)
+    if before is None:
+        return None
+    return float(np.abs(before.astype(np.int16) - after.astype(np.int16)).mean())
+
+
+def optimize_traced(svg: str, options: dict, size: Tuple[int, int]) -> Tuple[str, dict]:
+    """Optimize a trace, falling back to the original if verification fails."""
+    optimized, stats = optimize_svg(svg, options.get("simplification", 50))
+    if VERIFY_OPTIMIZED:
+        diff = visual_difference(svg, optimized, *size)
+        stats["visualDiff"] = diff
+        if diff is not None and diff > VISUAL_TOLERANCE:
+            return svg, {**stats, "bytesOut": len(svg), "bytesSaved": 0, "rejected": True}
+    return optimized, stats
+
+
+# ---------------------------------------------------------------------------
+# Color quantization pre-pass
+# ---------------------------------------------------------------------------
+
+QUANTIZE_SAMPLE = 65536  # pixels used to build the palette
+QUANTIZE_CHUNK = 1 << 20  # pixels per nearest-color block
+
+
+def median_cut_palette(pixels: np.ndarray, colors: int) -> np.ndarray:
+    """Median cut over (N, 3) uint8 pixels: split the box with the widest channel."""
+    boxes = [pixels]
+    while len(boxes) < colors:
+        scores = [int((b.max(0).astype(int) - b.min(0)).max()) * len(b) if len(b) > 1 else -1 for b in boxes]
+        index = int(np.argmax(scores))
+        if scores[index] <= 0:
+            break
+        box = boxes.pop(index)
+        channel = int(np.argmax(box.max(0).astype(int) - box.min(0)))
+        order = np.argsort(box[:, channel], kind="stable")
+        half = len(box) // 2
+        boxes += [box[order[:half]], box[order[half:]]]
+    return np.array([b.mean(0) for b in boxes], dtype=np.float32)
+
+
+def nearest_color(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Palette index per pixel, in chunks so the (N, K) distance matrix stays small."""
+    labels = np.empty(len(pixels), dtype=np.uint8)
+    palette_sq = (palette ** 2).sum(1)
+    for start in range(0, len(pixels), QUANTIZE_CHUNK):
+        block = pixels[start:start + QUANTIZE_CHUNK].astype(np.float32)
+        # |p - c|^2 without the per-pixel |p|^2 term, which doesn't change the argmin
+        labels[start:start + len(block)] = np.argmin(palette_sq - 2 * block @ palette.T, axis=1)
+    return labels
+
+
+def kmeans_palette(pixels: np.ndarray, colors: int, iterations: int = 8) -> np.ndarray:
+    """Lloyd iterations seeded with the median-cut palette."""
+    centers = median_cut_palette(pixels, colors)
+    values = pixels.astype(np.float32)
+    for _ in range(iterations):
+        labels = nearest_color(pixels, centers)
+        counts = np.bincount(labels, minlength=len(centers))
+        used = counts > 0
+        for channel in range(3):
+            sums = np.bincount(labels, weights=values[:, channel], minlength=len(centers))
+            centers[used, channel] = sums[used] / counts[used]
+    return centers
+
+
+def despeckle_labels(labels: np.ndarray, passes: int) -> np.ndarray:
+    """
+    3x3 majority filter on the label image. A pixel only changes to a label
+    that strictly outnumbers every other one around it; any tie for the top
+    keeps the pixel's own label, so the result doesn't depend on palette order.
+    """
+    for _ in range(passes):
+        padded = np.pad(labels, 1, mode="edge")
+        height, width = labels.shape
+        best, best_count = labels.copy(), np.zeros(labels.shape, dtype=np.uint8)
+        tied = np.zeros(labels.shape, dtype=bool)
+        for k in np.unique(labels):
+            hit = (padded == k).view(np.uint8)
+            count = (labels == k).view(np.uint8).copy()
+            for dy in range(3):
+                for dx in range(3):
+                    count += hit[dy:dy + height, dx:dx + width]
+            better = count > best_count
+            tied &= ~better
+            tied |= count == best_count
+            best[better] = k
+            best_count[better] = count[better]
+        labels = np.where(tied, labels, best)
+    return labels
+
+
+def quantize_array(rgb: np.ndarray, colors: int, method: str = "median-cut", despeckle: int = 1,
+                   mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Reduce an (H, W, 3) uint8 image to at most `colors` colors (2-256)."""
+    colors = max(2, min(256, colors))
+    height, width = rgb.shape[:2]
+    flat = rgb.reshape(-1, 3)
+    candidates = flat[mask.reshape(-1)] if mask is not None else flat
+    if len(candidates) == 0:
+        return rgb
+    rng = np.random.default_rng(0)
+    sample = candidates[rng.choice(len(candidates), QUANTIZE_SAMPLE)] if len(candidates) > QUANTIZE_SAMPLE else candidates
+
+    palette = kmeans_palette(sample, colors) if method == "kmeans" else median_cut_palette(sample, colors)
+    labels = nearest_color(flat, palette).reshape(height, width)
+    if despeckle:
+        labels = despeckle_labels(labels, despeckle)
+    return np.clip(np.rint(palette), 0, 255).astype(np.uint8)[labels]
+
+
+def quantize_image_bytes(image_data: bytes, options: dict) -> bytes:
+    """Quantize an encoded image per options; alpha is carried through unchanged."""
+    img = Image.open(BytesIO(image_data))
+    has_alpha = "A" in img.getbands() or "transparency" in img.info
+    pixels = np.asarray(img.convert("RGBA" if has_alpha else "RGB"))
+    alpha = pixels[..., 3] if has_alpha else None
+    quantized = quantize_array(
+        np.ascontiguousarray(pixels[..., :3]), options["colors"],
+        options.get("quantize_method", "median-cut"), options.get("despeckle", 1),
+        mask=alpha > 0 if alpha is not None else None,
+    )
+    if alpha is not None:
+        quantized = np.dstack([quantized, alpha])
+    buffer = BytesIO()
+    Image.fromarray(quantized).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def trace_job(image_data: bytes, options: dict, backend: Optional[str] = None) -> Tuple[str, str, dict]:
+    """What a pool worker runs: quantize, trace, optimize. Returns (svg, backend, stats)."""
+    stats = {}
+    if options.get("color_mode") == "color" and options.get("colors"):
+        run_start = time.perf_counter()
+        image_data = quantize_image_bytes(image_data, options)
+        stats["quantizeMs"] = round((time.perf_counter() - run_start) * 1000, 2)
+
+    run_start = time.perf_counter()
+    svg, backend = vectorize_bytes(image_data, options, backend)
+    stats["traceMs"] = round((time.perf_counter() - run_start) * 1000, 2)
+    if options.get("optimize", True) and backend != "placeholder":
+        svg, optimize_stats = optimize_traced(svg, options, Image.open(BytesIO(image_data)).size)
+        stats.update(optimize_stats)
+    return svg, backend, stats
+
+
+def cpu_quota() -> int:
+    """
+    CPUs this container may use: the cgroup CPU quota if one is set, else the
+    scheduler affinity mask. os.cpu_count() reports the host and oversubscribes.
+    """
+    limit = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            limit = int(quota) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                limit = quota / period
+        except (OSError, ValueError):
+            pass
+
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+
+    if limit is not None:
+        available = min(available, math.ceil(limit))
+    return max(1, available)
+
+
+class TraceTimeout(TimeoutError):
+    """A trace ran past the per-job timeout and its worker was killed."""
+
+
+def _trace_worker(conn) -> None:
+    """Worker process loop: trace jobs received on conn until it closes."""
+    # Own process group so a timeout also kills potrace/vtracer CLI children
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn.send("ready")
+    while True:
+        try:
+            image_data, options, backend = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, trace_job(image_data, options, backend)))
+        except Exception as e:
+            try:
+                conn.send((False, e))
+            except Exception:
+                # Unpicklable exception: send its message instead
+                conn.send((False, RuntimeError(str(e))))
+
+
+class _TraceSlot:
+    """One worker process and the pipe used to talk to it."""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.process = None
+        self.conn = None
+
+    def ensure_started(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            return
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_trace_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # Wait out spawn + imports so they don't count against the job timeout
+        parent_conn.recv()
+        self.conn = parent_conn
+
+    def kill(self) -> None:
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+
+class TracePool:
+    """
+    Fixed set of tracing processes shared by /vectorize and the queue worker.
+
+    Unlike ProcessPoolExecutor, each job runs on a process we own, so a trace
+    that exceeds the timeout is killed (with its CLI children) and only that
+    worker is respawned; other in-flight jobs are unaffected.
+    """
+
+    def __init__(self, workers: int, timeout: float = JOB_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.jobs = queue.Queue()
+        self.ctx = multiprocessing.get_context("spawn")
+        self.slots = [_TraceSlot(self.ctx) for _ in range(workers)]
+        self.busy = 0
+        self.lock = threading.Lock()
+        for slot in self.slots:
+            slot.ensure_started()
+            threading.Thread(target=self._serve, args=(slot,), daemon=True).start()
+
+    def pending(self) -> int:
+        return self.jobs.qsize() + self.busy
+
+    def submit(self, image_data: bytes, options: dict, backend: Optional[str] = None) -> Future:
+        """Queue a trace; the Future resolves to (svg_content, backend, stats)."""
+        # Chosen here so workers never probe the CLI tools themselves
+        backend = backend or select_backend(options.get("color_mode", "binary"))
+        future = Future()
+        self.jobs.put((future, (image_data, options, backend)))
+        return future
+
+    def run(self, image_data: bytes, options: dict, backend: Optional[str] = None) -> Tuple[str, str, dict]:
+        return self.submit(image_data, options, backend).result()
+
+    def close(self) -> None:
+        """Stop the serving threads and kill the worker processes."""
+        for _ in self.slots:
+            self.jobs.put((None, None))
+        for slot in self.slots:
+            slot.kill()
+
+    def _serve(self, slot: _TraceSlot) -> None:
+        while True:
+            future, args = self.jobs.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self.lock:
+                self.busy += 1
+            try:
+                slot.ensure_started()
+                slot.conn.send(args)
+                if slot.conn.poll(self.timeout):
+                    ok, value = slot.conn.recv()
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                else:
+                    slot.kill()
+                    future.set_exception(TraceTimeout(f"Trace exceeded {self.timeout:g}s and was killed"))
+            except (EOFError, OSError) as e:
+                # Worker died mid-job (OOM kill, segfault in a binding)
+                slot.kill()
+                future.set_exception(RuntimeError(f"Trace worker crashed: {e}"))
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+
+trace_pool: Optional[TracePool] = None
+
+
+def get_trace_pool() -> TracePool:
+    global trace_pool
+    if trace_pool is None:
+        trace_pool = TracePool(TRACE_WORKERS or cpu_quota())
+    return trace_pool
+
+
+def svg_body(svg: str) -> str:
+    """Content between the root <svg ...> tag and </svg>."""
+    start = svg.index(">", svg.index("<svg")) + 1
+    return svg[start:svg.rindex("</svg>")]
+
+
+def iter_tiles(width: int, height: int, tile_size: int, overlap: int):
+    """Yield (core box, padded box) per tile; boxes are (left, top, right, bottom)."""
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            core = (left, top, min(left + tile_size, width), min(top + tile_size, height))
+            padded = (
+                max(core[0] - overlap, 0), max(core[1] - overlap, 0),
+                min(core[2] + overlap, width), min(core[3] + overlap, height),
+            )
+            yield core, padded
+
+
+def vectorize_tiled(image_data: bytes, options: dict, pool: TracePool,
+                    tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> Tuple[str, str, dict]:
+    """
+    Trace a large image as overlapping tiles in parallel and stitch one SVG.
+
+    Each tile is traced with `overlap` pixels of context on every side, so
+    curves near a seam see the same neighbourhood as a single-pass trace.
+    The tile's paths are then clipped to its core box (plus a 1px bleed so
+    anti-aliased edges don't leave hairlines) and translated into place;
+    shapes crossing a seam are drawn by both tiles and meet exactly there.
+
+    The result renders like a single pass but is not the same document:
+    paths are not stitched across seams, so every shape crossing one is
+    split into a piece per tile, and each tile still carries the geometry
+    its clip hides. Expect a larger SVG (about 1.75x single-pass on the
+    --benchmark-tiled drawing) and no whole-shape editing across seams.
+    Tiling is therefore opt-in per request until paths are stitched.
+
+    Memory stays bounded: the image is decoded once at 1 byte/pixel for
+    binary/grayscale, at most two tiles per worker are in flight, and each
+    worker only ever holds a tile.
+    """
+    color_mode = options.get("color_mode", "binary")
+    backend = select_backend(color_mode)
+    if color_mode == "color" and options.get("colors"):
+        # One palette for the whole image, or tiles would disagree on colors at seams
+        img = Image.open(BytesIO(quantize_image_bytes(image_data, options)))
+        img.load()
+        options = {**options, "colors": None}
+    elif color_mode == "color":
+        img = Image.open(BytesIO(image_data))
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    else:
+        # Flattened gray is all potrace/vtracer need for these modes
+        img = Image.fromarray(load_gray(image_data))
+    width, height = img.size
+
+    def encode_tile(box) -> bytes:
+        buffer = BytesIO()
+        img.crop(box).save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+    parts = [
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}">\n'
+    ]
+    in_flight = deque()
+    stats = {"tiles": 0}
+
+    def collect_one() -> None:
+        index, core, padded, future = in_flight.popleft()
+        tile_svg, _, tile_stats = future.result()
+        stats["tiles"] += 1
+        for key, value in tile_stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "precision":
+                stats[key] = stats.get(key, 0) + value
+        left, top = max(core[0] - 1, 0), max(core[1] - 1, 0)
+        right, bottom = min(core[2] + 1, width), min(core[3] + 1, height)
+        parts.append(
+            f'<clipPath id="tile{index}"><rect x="{left}" y="{top}" '
+            f'width="{right - left}" height="{bottom - top}"/></clipPath>\n'
+            f'<g clip-path="url(#tile{index})"><g transform="translate({padded[0]},{padded[1]})">'
+            f'{svg_body(tile_svg)}</g></g>\n'
+        )
+
+    try:
+        for index, (core, padded) in enumerate(iter_tiles(width, height, tile_size, overlap)):
+            if len(in_flight) >= pool.workers * 2:
+                collect_one()
+            in_flight.append((index, core, padded, pool.submit(encode_tile(padded), options, backend)))
+        while in_flight:
+            collect_one()
+    finally:
+        for *_, future in in_flight:
+            future.cancel()
+
+    parts.append("</svg>\n")
+    return "".join(parts), backend, stats
+
+
+def vectorize_image(image_data: bytes, options: dict, pool: Optional[TracePool] = None) -> Tuple[str, str, dict]:
+    """
+    Trace (and optimize) in one pass, or tiled only when the caller set
+    tile_size; tiled results report stats["tiles"] and are seam-split (see
+    vectorize_tiled).
+    """
+    pool = pool or get_trace_pool()
+    tile_size = options.get("tile_size")
+    if tile_size and select_backend(options.get("color_mode", "binary")) != "placeholder":
+        return vectorize_tiled(image_data, options, pool, tile_size)
+    return pool.run(image_data, options)
+
+
+def normalize_options(options: dict) -> dict:
+    """The options that change the output, with defaults filled in."""
+    color_mode = str(options.get("color_mode") or "binary").lower()
+    tile_size = options.get("tile_size")
+    colors = int(options["colors"]) if options.get("colors") and color_mode == "color" else None
+    return {
+        "color_mode": color_mode,
+        "threshold": int(options.get("threshold", 128)),
+        "smoothing": int(options.get("smoothing", 50)),
+        "simplification": int(options.get("simplification", 50)),
+        "colors": colors,
+        # Only read when quantizing; otherwise they must not split the cache
+        "quantize_method": options.get("quantize_method", "median-cut") if colors else None,
+        "despeckle": int(options.get("despeckle", 1)) if colors else None,
+        # None and 0 both trace in one pass
+        "tile_size": int(tile_size or 0),
+        "optimize": bool(options.get("optimize", True)),
+        # A different tracer gives a different SVG for the same settings
+        "backend": select_backend(color_mode),
+    }
+
+
+def result_cache_key(image_data: bytes, options: dict) -> str:
+    digest = hashlib.sha256(image_data)
+    digest.update(json.dumps(normalize_options(options), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of traced SVGs on disk under a byte budget, with in-flight
+    deduplication: a request whose key is already being traced waits on
+    that trace instead of starting its own.
+
+    Entries are gzip JSON files; recency is kept in memory and mirrored in
+    file mtimes so the order survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size, oldest first
+        self.total = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.shared = 0
+        if max_bytes > 0:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            for path in sorted(self.dir.glob("*.json.gz"), key=lambda p: p.stat().st_mtime):
+                self.entries[path.name[:-len(".json.gz")]] = path.stat().st_size
+                self.total += path.stat().st_size
+            self._evict()
+
+    def _path(self, key: str) -> Path:
+        return self.dir / f"{key}.json.gz"
+
+    def _evict(self) -> None:
+        while self.total > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            self._path(key).unlink(missing_ok=True)
+
+    def _load(self, key: str) -> Optional[Tuple[str, str, dict]]:
+        try:
+            entry = json.loads(gzip.decompress(self._path(key).read_bytes()))
+        except (OSError, ValueError):
+            # Evicted underneath us or corrupt: drop it and trace again
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+            return None
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass  # evicted since the read; the entry we hold is still good
+        return entry["svg"], entry["backend"], entry["stats"]
+
+    def _store(self, key: str, value: Tuple[str, str, dict]) -> None:
+        svg, backend, stats = value
+        data = gzip.compress(json.dumps({"svg": svg, "backend": backend, "stats": stats}).encode(), compresslevel=6)
+        if len(data) > self.max_bytes:
+            return
+        tmp = self._path(key).with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, self._path(key))
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self._evict()
+
+    def get_or_compute(self, key: str, compute) -> Tuple[str, str, dict]:
+        """Cached result, the result of an identical in-flight job, or compute()."""
+        if self.max_bytes <= 0:
+            return compute()
+
+        with self.lock:
+            cached = key in self.entries
+            if cached:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif key in self.inflight:
+                future, owner = self.inflight[key], False
+                self.shared += 1
+            else:
+                future, owner = Future(), True
+                self.inflight[key] = future
+                self.misses += 1
+
+        if cached:
+            value = self._load(key)
+            if value is not None:
+                svg, backend, stats = value
+                return svg, backend, {**stats, "cache": "hit"}
+            return self.get_or_compute(key, compute)
+
+        if not owner:
+            svg, backend, stats = future.result()
+            return svg, backend, {**stats, "cache": "shared"}
+
+        try:
+            value = compute()
+            self._store(key, value)
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+        svg, backend, stats = value
+        return svg, backend, {**stats, "cache": "miss"}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "inflight": len(self.inflight),
+            }
+
+
+result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    # Created on first use, not at import, so spawned trace workers never scan or evict it
+    global result_cache
+    if result_cache is None:
+        result_cache = ResultCache(CACHE_DIR, int(CACHE_MAX_MB * 1024 * 1024))
+    return result_cache
+
+
+def vectorize_cached(image_data: bytes, options: dict) -> Tuple[str, str, dict]:
+    """vectorize_image behind the result cache; stats["cache"] says where it came from."""
+    return get_result_cache().get_or_compute(
+        result_cache_key(image_data, options),
+        lambda: vectorize_image(image_data, options),
+    )
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health():
     """Health check endpoint for worker status."""
     tools = []
-    if POTRACE_AVAILABLE:
+    if check_potrace():
         tools.append("potrace")
-    if VTRACER_AVAILABLE:
+    if check_vtracer():
         tools.append("vtracer")
-    if IMAGEMAGICK_AVAILABLE:
+    if check_imagemagick():
         tools.append("imagemagick")
+    if VTRACER_PY_AVAILABLE:
+        tools.append("vtracer-py")
+    if POTRACE_PY_AVAILABLE:
+        tools.append("potrace-py")
 
     return HealthResponse(
         status="healthy" if tools else "degraded",
         tools_available=tools,
-        uptime=time.time() - start_time
+        uptime=time.time() - start_time,
+        trace_workers=trace_pool.workers if trace_pool else 0,
+        pending_traces=trace_pool.pending() if trace_pool else 0,
+        cache=get_result_cache().snapshot(),
+        tiling={
+            # Only when a request sets tile_size: output is larger and split at tile seams
+            "optIn": True,
+            "overlap": TILE_OVERLAP,
+            "seamSplit": True,
+        }
     )
 
 
@@ -219,49 +1426,219 @@ async def health():
 async def vectorize(request: VectorizeRequest):
     """Direct vectorization endpoint for synchronous requests."""
     try:
-        # Download image
-        image_data = download_image(request.image_url)
-
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            tmp.write(image_data)
-            tmp_path = tmp.name
+        # Download image off the event loop
+        image_data = await asyncio.to_thread(download_image, request.image_url)
 
         # Create output path
         output_dir = Path("outputs/vectorize")
         output_dir.mkdir(parents=True, exist_ok=True)
-        output_path = str(output_dir / f"{int(time.time() * 1000)}.svg")
+        output_path = str(output_dir / f"{int(time.time() * 1000)}_{os.urandom(2).hex()}.svg")
 
         # Vectorize
-        options = {
-            "threshold": request.threshold,
-            "smoothing": request.smoothing,
-            "color_mode": request.color_mode,
-        }
-
-        if request.color_mode == "color" and VTRACER_AVAILABLE:
-            svg_content = vectorize_with_vtracer(tmp_path, output_path, options)
-        elif POTRACE_AVAILABLE:
-            svg_content = vectorize_with_potrace(tmp_path, output_path, options)
-        elif VTRACER_AVAILABLE:
-            svg_content = vectorize_with_vtracer(tmp_path, output_path, options)
-        else:
-            svg_content = vectorize_simple(tmp_path, output_path)
-
-        # Cleanup
-        os.unlink(tmp_path)
+        options = job_options(request.dict())
+        svg_content, backend, stats = await asyncio.to_thread(vectorize_cached, image_data, options)
+        await asyncio.to_thread(Path(output_path).write_text, svg_content)
 
         return {
             "status": "completed",
             "svgUrl": output_path,
             "svgContent": svg_content,
-            "inputImageUrl": request.image_url
+            "inputImageUrl": request.image_url,
+            "backend": backend,
+            "stats": stats
         }
 
+    except TraceTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def run_batch(items, options: dict):
+    """
+    Vectorize (index, name, load) items with at most two per trace worker in
+    flight, yielding each result as it finishes. load() is blocking and is
+    only called once the item is scheduled, so inputs are never all resident.
+    """
+    limit = get_trace_pool().workers * 2
+    items = iter(items)
+    pending = set()
+
+    async def one(index: int, name: str, load) -> dict:
+        job_start = time.time()
+        try:
+            image_data = await asyncio.to_thread(load)
+            svg_content, backend, stats = await asyncio.to_thread(vectorize_cached, image_data, options)
+            return {"index": index, "name": name, "status": "completed", "backend": backend,
+                    "stats": stats, "svgContent": svg_content,
+                    "duration": int((time.time() - job_start) * 1000)}
+        except Exception as e:
+            return {"index": index, "name": name, "status": "failed", "error": str(e),
+                    "duration": int((time.time() - job_start) * 1000)}
+
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < limit:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    pending.add(asyncio.ensure_future(one(*item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Client went away: don't keep tracing for nobody
+        for task in pending:
+            task.cancel()
+
+
+async def ndjson_stream(results):
+    async for result in results:
+        yield json.dumps(result) + "\n"
+
+
+class _ZipSink:
+    """Write-only stream for ZipFile; drained after every entry."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def zip_stream(results):
+    """Stream a ZIP of <index>_<name>.svg files plus manifest.json, entry by entry."""
+    sink = _ZipSink()
+    manifest = []
+    # An unseekable sink makes ZipFile write data descriptors instead of seeking back
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        async for result in results:
+            svg_content = result.pop("svgContent", None)
+            if svg_content is not None:
+                result["file"] = f"{result['index']:04d}_{Path(result['name']).stem or 'image'}.svg"
+                archive.writestr(result["file"], svg_content)
+            manifest.append(result)
+            yield sink.drain()
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+
+def stream_batch(items, options: dict, output: str, cleanup=None) -> StreamingResponse:
+    results = run_batch(items, options)
+    if output == "zip":
+        body, media_type = zip_stream(results), "application/zip"
+        headers = {"Content-Disposition": 'attachment; filename="vectorized.zip"'}
+    else:
+        body, media_type, headers = ndjson_stream(results), "application/x-ndjson", {}
+
+    # Runs after the response ends, whether or not the body was ever iterated
+    background = BackgroundTask(cleanup) if cleanup else None
+    return StreamingResponse(body, media_type=media_type, headers=headers, background=background)
+
+
+@app.post("/vectorize/batch")
+async def vectorize_batch(request: VectorizeBatchRequest):
+    """Vectorize a list of image URLs, streaming results as each one finishes."""
+    if request.output not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="output must be ndjson or zip")
+    if len(request.image_urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} images per batch")
+
+    items = (
+        (index, Path(url.split("?")[0]).name or f"image{index}", lambda url=url: download_image(url, BATCH_ITEM_MAX_BYTES))
+        for index, url in enumerate(request.image_urls)
+    )
+    return stream_batch(items, job_options(request.dict()), request.output)
+
+
+@app.post("/vectorize/batch/upload")
+async def vectorize_batch_upload(request: Request):
+    """
+    Vectorize every image in an uploaded ZIP archive, streaming results.
+
+    Multipart form: "file" is the archive, "options" a JSON object with the
+    same fields as /vectorize (minus image_url) and "output" ndjson or zip.
+    The archive is streamed to a temp file, 413 once it passes
+    SVG_TURBO_BATCH_ARCHIVE_MAX_MB, and entries are decompressed one at a
+    time as they are scheduled.
+    """
+    fd, spool_path = tempfile.mkstemp(prefix="svg_turbo_batch_", suffix=".zip")
+    os.close(fd)
+    spool = Path(spool_path)
+    form = {}
+    await receive_upload(request, spool, max_bytes=BATCH_ARCHIVE_MAX_BYTES, fields=form)
+    output = form.get("output", "ndjson")
+    try:
+        if output not in ("ndjson", "zip"):
+            raise HTTPException(status_code=400, detail="output must be ndjson or zip")
+        try:
+            trace_options = job_options(VectorizeOptions(**json.loads(form.get("options", "{}"))).dict())
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid options: {e}")
+        try:
+            archive = zipfile.ZipFile(spool)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Upload is not a ZIP archive")
+    except HTTPException:
+        spool.unlink(missing_ok=True)
+        raise
+
+    entries = [
+        info for info in archive.infolist()
+        if not info.is_dir() and Path(info.filename).suffix.lower() in IMAGE_EXTENSIONS
+        and not Path(info.filename).name.startswith(".")
+    ]
+    if len(entries) > BATCH_MAX_ITEMS:
+        archive.close()
+        spool.unlink(missing_ok=True)
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} images per batch")
+
+    def read_entry(info: zipfile.ZipInfo) -> bytes:
+        if info.file_size > BATCH_ITEM_MAX_BYTES:
+            raise ValueError(f"{info.filename} is larger than {ARCHIVE_ENTRY_MAX_MB:g} MB uncompressed")
+        return archive.read(info)
+
+    def cleanup() -> None:
+        archive.close()
+        spool.unlink(missing_ok=True)
+
+    items = (
+        (index, Path(info.filename).name, lambda info=info: read_entry(info))
+        for index, info in enumerate(entries)
+    )
+    return stream_batch(items, trace_options, output, cleanup)
+
+
+@app.get("/artifacts/{artifact_id}")
+async def get_artifact(artifact_id: str, request: Request):
+    """Serve a stored SVG; gzip as-is when the client accepts it."""
+    compressed = await asyncio.to_thread(r.get, f"{ARTIFACT_PREFIX}{artifact_id}")
+    if compressed is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired")
+
+    headers = {"ETag": f'"{artifact_id}"', "Cache-Control": f"private, max-age={ARTIFACT_TTL}", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(content=compressed, media_type="image/svg+xml",
+                        headers={**headers, "Content-Encoding": "gzip"})
+    return Response(content=gzip.decompress(compressed), media_type="image/svg+xml", headers=headers)
+
+
 @app.post("/batch")
 async def add_to_batch(request: VectorizeRequest):
     """Add a vectorization job to the batch queue."""
@@ -277,8 +1654,6 @@ async def add_to_batch(request: VectorizeRequest):
 
 def process_queue() -> None:
     """Background queue processor for batch jobs."""
-    print(f"[*] Starting SVG-Turbo vectorization worker...")
-    print(f"[*] Tools available: potrace={POTRACE_AVAILABLE}, vtracer={VTRACER_AVAILABLE}, imagemagick={IMAGEMAGICK_AVAILABLE}")
     print(f"[*] Listening for jobs on {QUEUE_NAME}...")
 
     while True:
@@ -307,37 +1682,19 @@ def process_queue() -> None:
                     publish_progress(job_id, 10, "Downloading image...")
                     image_data = download_image(payload["image_url"])
 
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                        tmp.write(image_data)
-                        tmp_path = tmp.name
-
                     publish_progress(job_id, 30, "Preparing for conversion...")
 
                     output_dir = Path(f"outputs/{job_id}")
                     output_dir.mkdir(parents=True, exist_ok=True)
                     output_path = str(output_dir / "result.svg")
 
-                    options = {
-                        "threshold": payload.get("threshold", 128),
-                        "smoothing": payload.get("smoothing", 50),
-                        "color_mode": payload.get("color_mode", "binary"),
-                    }
+                    options = job_options(payload)
 
                     publish_progress(job_id, 50, "Converting to vector...")
 
-                    color_mode = payload.get("color_mode", "binary")
-
-                    if color_mode == "color" and VTRACER_AVAILABLE:
-                        svg_content = vectorize_with_vtracer(tmp_path, output_path, options)
-                    elif POTRACE_AVAILABLE:
-                        svg_content = vectorize_with_potrace(tmp_path, output_path, options)
-                    elif VTRACER_AVAILABLE:
-                        svg_content = vectorize_with_vtracer(tmp_path, output_path, options)
-                    else:
-                        svg_content = vectorize_simple(tmp_path, output_path)
-
-                    # Cleanup temp file
-                    os.unlink(tmp_path)
+                    svg_content, backend, stats = vectorize_cached(image_data, options)
+                    with open(output_path, "w") as f:
+                        f.write(svg_content)
 
                     publish_progress(job_id, 90, "Finalizing...")
 
@@ -345,9 +1702,11 @@ def process_queue() -> None:
                     publish_progress(job_id, 100, "Complete")
                     publish_result(job_id, "completed", {
                         "svgUrl": output_path,
-                        "svgContent": svg_content,
+                        **svg_result_fields(svg_content),
                         "inputImageUrl": payload["image_url"],
-                        "outputDir": str(output_dir)
+                        "outputDir": str(output_dir),
+                        "backend": backend,
+                        "stats": stats
                     }, duration=duration)
 
                     print(f"[+] Vectorization job {job_id} complete in {duration}ms")
@@ -375,13 +1734,459 @@ def process_queue() -> None:
             time.sleep(5)
 
 
-def run_queue_processor() -> None:
-    """Start the queue processor in a background thread."""
-    thread = threading.Thread(target=process_queue, daemon=True)
-    thread.start()
+def run_queue_processor(consumers: int = 1) -> None:
+    """Start queue processor threads; one per trace worker keeps the pool busy."""
+    for _ in range(consumers):
+        thread = threading.Thread(target=process_queue, daemon=True)
+        thread.start()
 
 
-if __name__ == "__main__":
-    run_queue_processor()
+def make_test_icon(size: int = 64) -> bytes:
+    """A small black-on-white glyph (ring plus bar) encoded as PNG."""
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    glyph = ((r < size * 0.4) & (r > size * 0.25)) | (np.abs(xx - size / 2) < size * 0.06)
+    buffer = BytesIO()
+    Image.fromarray(np.where(glyph, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def benchmark_overhead(size: int, runs: int) -> None:
+    """Per-job wall time of every available backend on a small icon."""
+    icon = make_test_icon(size)
+    available = {
+        "vtracer-py": VTRACER_PY_AVAILABLE,
+        "potrace-py": POTRACE_PY_AVAILABLE,
+        "vtracer": check_vtracer(),
+        "potrace": check_potrace(),
+    }
+    print(f"{size}x{size} icon, {runs} jobs per backend")
+    print(f"{'backend':<16} {'ms/job':>8} {'svg bytes':>10}")
+    for backend, ok in available.items():
+        if not ok:
+            continue
+        for color_mode in ("binary", "color") if backend.startswith("vtracer") else ("binary",):
+            options = {"threshold": 128, "smoothing": 50, "color_mode": color_mode}
+            vectorize_bytes(icon, options, backend)  # warmup
+            run_start = time.perf_counter()
+            for _ in range(runs):
+                svg, _ = vectorize_bytes(icon, options, backend)
+            ms = (time.perf_counter() - run_start) * 1000 / runs
+            label = backend if color_mode == "binary" else f"{backend}/color"
+            print(f"{label:<16} {ms:>8.2f} {len(svg):>10}")
+
+
+def make_test_drawing(size: int = 768, seed: int = 0) -> bytes:
+    """Line-art-like test image: many overlapping rings, enough work to trace."""
+    rng = np.random.default_rng(seed)
+    ink = np.zeros((size, size), dtype=bool)
+    rings = max(60, size * size // 250_000)  # constant density for big posters
+    for cy, cx, radius in rng.uniform([0, 0, 10], [size, size, 90], (rings, 3)):
+        # Only touch the ring's bounding box
+        top, left = max(int(cy - radius), 0), max(int(cx - radius), 0)
+        yy, xx = np.mgrid[top:min(int(cy + radius) + 1, size), left:min(int(cx + radius) + 1, size)]
+        r = np.hypot(yy - cy, xx - cx)
+        ink[top:top + r.shape[0], left:left + r.shape[1]] ^= (r < radius) & (r > radius * 0.7)
+    buffer = BytesIO()
+    Image.fromarray(np.where(ink, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def benchmark_scaling(max_workers: int, jobs: int, size: int) -> None:
+    """Trace throughput through TracePool with 1..max_workers processes."""
+    image = make_test_drawing(size)
+    options = {"threshold": 128, "smoothing": 50, "color_mode": "binary"}
+    backend = select_backend("binary")
+    print(f"{jobs} x {size}x{size} traces with {backend}, CPU quota {cpu_quota()}")
+    print(f"{'workers':>7} {'jobs/s':>8} {'speedup':>8}")
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        pool = TracePool(workers)
+        # Warm every worker so spawn/import time is excluded
+        for future in [pool.submit(image, options, backend) for _ in range(workers)]:
+            future.result()
+        run_start = time.perf_counter()
+        for future in [pool.submit(image, options, backend) for _ in range(jobs)]:
+            future.result()
+        rate = jobs / (time.perf_counter() - run_start)
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>8.2f} {rate / baseline:>7.2f}x")
+        pool.close()
+
+
+def _tiled_probe(image_data: bytes, options: dict, workers: int, tile_size: int, conn) -> None:
+    pool = TracePool(workers)
+    run_start = time.perf_counter()
+    if tile_size:
+        svg, _, _ = vectorize_tiled(image_data, options, pool, tile_size)
+    else:
+        svg, _, _ = pool.run(image_data, options)
+    seconds = time.perf_counter() - run_start
+    pool.close()
+    # ru_maxrss is KB on Linux; children are reaped by close()
+    parent_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    worker_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    conn.send((svg, seconds, parent_mb, worker_mb))
+
+
+def benchmark_tiled(size: int, tile_size: int, workers: int) -> None:
+    """Single-pass vs tiled trace of a large drawing: time, peak RSS, output, pixel diff."""
+    image_data = make_test_drawing(size)
+    options = {"threshold": 128, "smoothing": 50, "color_mode": "binary"}
+    ctx = multiprocessing.get_context("fork")  # each probe starts from the same baseline RSS
+    print(f"{size}x{size} drawing, backend {select_backend('binary')}, {workers} workers")
+    print(f"{'mode':<14} {'s':>7} {'parent MB':>10} {'worker MB':>10} {'svg KB':>8}")
+    rendered = {}
+    for label, tiles in (("single-pass", 0), (f"tiled {tile_size}", tile_size)):
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=_tiled_probe, args=(image_data, options, workers, tiles, child))
+        proc.start()
+        svg, seconds, parent_mb, worker_mb = parent.recv()
+        proc.join()
+        print(f"{label:<14} {seconds:>7.2f} {parent_mb:>10.0f} {worker_mb:>10.0f} {len(svg) / 1024:>8.0f}")
+        rendered[label] = render_svg(svg, size, size)
+
+    single, tiled = rendered.values()
+    if single is None:
+        print("(install cairosvg to compare renders)")
+    else:
+        diff = np.abs(single.astype(np.int16) - tiled.astype(np.int16))
+        print(f"render diff: mean {diff.mean():.3f}, pixels >64 off: {(diff > 64).mean() * 100:.3f}%")
+
+
+def benchmark_optimize(size: int) -> None:
+    """Bytes saved, optimizer time and visual drift per backend and simplification."""
+    samples = {"icon": make_test_icon(), "drawing": make_test_drawing(size)}
+    backends = [name for name, ok in (
+        ("vtracer-py", VTRACER_PY_AVAILABLE), ("potrace-py", POTRACE_PY_AVAILABLE),
+        ("vtracer", check_vtracer()), ("potrace", check_potrace()),
+    ) if ok]
+    print(f"{'input':<8} {'backend':<18} {'simp':>4} {'KB in':>8} {'KB out':>8} {'saved':>6} "
+          f"{'ms':>7} {'paths':>11} {'diff':>6}")
+    for sample, image_data in samples.items():
+        width, height = Image.open(BytesIO(image_data)).size
+        for backend in backends:
+            for color_mode in ("binary", "color") if backend.startswith("vtracer") else ("binary",):
+                svg, _ = vectorize_bytes(image_data, {"threshold": 128, "color_mode": color_mode}, backend)
+                for simplification in (0, 50, 100):
+                    optimized, stats = optimize_svg(svg, simplification)
+                    diff = visual_difference(svg, optimized, width, height)
+                    label = backend if color_mode == "binary" else f"{backend}/color"
+                    print(f"{sample:<8} {label:<18} {simplification:>4} {stats['bytesIn'] / 1024:>8.1f} "
+                          f"{stats['bytesOut'] / 1024:>8.1f} {stats['bytesSaved'] / stats['bytesIn']:>6.0%} "
+                          f"{stats['optimizeMs']:>7.1f} {stats['pathsIn']:>5}->{stats['pathsOut']:<5} "
+                          f"{'n/a' if diff is None else f'{diff:.2f}':>6}")
+
+
+def make_test_photo(size: int = 512, seed: int = 0) -> bytes:
+    """Photo-like RGB test image: smooth gradients, soft blobs and sensor noise."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size] / size
+    rgb = np.stack([xx, yy, 1 - (xx + yy) / 2], axis=-1) * 160
+    for cy, cx, radius in rng.uniform([0, 0, 0.05], [1, 1, 0.25], (12, 3)):
+        blob = np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+        rgb += blob[..., None] * rng.uniform(-90, 90, 3)
+    rgb += rng.normal(0, 6, rgb.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def benchmark_quantize(size: int, method: str) -> None:
+    """Trace time, path count and SVG size of color tracing as K varies."""
+    backend = select_backend("color")
+    image_data = make_test_photo(size)
+    print(f"{size}x{size} photo, {backend}, {method}")
+    print(f"{'K':>5} {'quant ms':>9} {'trace ms':>9} {'paths':>7} {'svg KB':>8}")
+    for colors in (None, 64, 32, 16, 8, 4):
+        options = {"color_mode": "color", "colors": colors, "quantize_method": method, "optimize": False}
+        svg, _, stats = trace_job(image_data, options, backend)
+        print(f"{colors or 'raw':>5} {stats.get('quantizeMs', 0):>9.1f} {stats['traceMs']:>9.1f} "
+              f"{svg.count('<path'):>7} {len(svg) / 1024:>8.1f}")
+
+
+# ---------------------------------------------------------------------------
+# Benchmark corpus and regression suite
+# ---------------------------------------------------------------------------
+
+def make_test_logo(size: int = 512, seed: int = 0) -> bytes:
+    """Flat-color logo: a few anti-aliased shapes on white (drawn at 4x, downsampled)."""
+    from PIL import ImageDraw
+
+    rng = np.random.default_rng(seed)
+    big = size * 4
+    img = Image.new("RGB", (big, big), "white")
+    draw = ImageDraw.Draw(img)
+    palette = [tuple(int(c) for c in rng.integers(0, 200, 3)) for _ in range(4)]
+    for k in range(10):
+        x0, y0 = rng.integers(0, big * 3 // 4, 2)
+        extent = int(rng.integers(big // 8, big // 3))
+        box = [int(x0), int(y0), int(x0) + extent, int(y0) + extent]
+        shape = k % 3
+        if shape == 0:
+            draw.ellipse(box, fill=palette[k % 4])
+        elif shape == 1:
+            draw.rounded_rectangle(box, radius=extent // 5, fill=palette[k % 4])
+        else:
+            draw.polygon([(box[0], box[3]), ((box[0] + box[2]) // 2, box[1]), (box[2], box[3])], fill=palette[k % 4])
+    buffer = BytesIO()
+    img.resize((size, size), Image.LANCZOS).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_test_scan(width: int, height: int, seed: int = 0) -> bytes:
+    """Scanned-page stand-in: off-white paper with grain and rows of glyph-like strokes."""
+    rng = np.random.default_rng(seed)
+    page = (232 + rng.normal(0, 5, (height, width))).astype(np.float32)
+    margin, line_height = width // 12, max(24, height // 80)
+    for top in range(margin, height - margin - line_height, line_height * 2):
+        left = margin
+        while left < width - margin - line_height:
+            glyph_w = int(rng.integers(line_height // 3, line_height))
+            stroke = max(2, line_height // 8)
+            cell = page[top:top + line_height, left:left + glyph_w]
+            cell[:, :stroke] = 30  # stem
+            cell[rng.integers(0, line_height - stroke):, :][:stroke] = 30  # bar
+            if rng.random() < 0.5:
+                cell[:, -stroke:] = 30
+            left += glyph_w + int(rng.integers(stroke, line_height))
+    buffer = BytesIO()
+    Image.fromarray(np.clip(page, 0, 255).astype(np.uint8)).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def benchmark_corpus(scan_megapixels: float) -> dict:
+    """Deterministic inputs (fixed seeds) so reports from different runs compare."""
+    scan_width = int(math.sqrt(scan_megapixels * 1_000_000 * 3 / 4))
+    return {
+        "icon-64": make_test_icon(64),
+        "lineart-1024": make_test_drawing(1024),
+        "logo-512": make_test_logo(512),
+        "photo-512": make_test_photo(512),
+        f"scan-{scan_megapixels:g}mp": make_test_scan(scan_width, scan_width * 4 // 3),
+    }
+
+
+def benchmark_cases(corpus: dict) -> List[dict]:
+    """Every available backend x color mode over the corpus; tiled pool runs for scans."""
+    backends = [name for name, ok in (
+        ("potrace", check_potrace()), ("vtracer", check_vtracer()),
+        ("potrace-py", POTRACE_PY_AVAILABLE), ("vtracer-py", VTRACER_PY_AVAILABLE),
+    ) if ok]
+    cases = []
+    for name in corpus:
+        is_color = name.startswith(("logo", "photo"))
+        is_scan = name.startswith("scan")
+        for backend in backends:
+            if backend.startswith("vtracer"):
+                modes = ["binary", "color"] if is_color else ["binary"]
+            else:
+                modes = ["binary"]
+            for color_mode in modes:
+                options = {**OPTION_DEFAULTS, "color_mode": color_mode}
+                cases.append({"case": f"{name}/{backend}/{color_mode}", "input": name,
+                              "backend": backend, "options": options, "tiled": False})
+                if color_mode == "color" and name.startswith("photo"):
+                    cases.append({"case": f"{name}/{backend}/color-k16", "input": name, "backend": backend,
+                                  "options": {**options, "colors": 16}, "tiled": False})
+        if is_scan:
+            cases.append({"case": f"{name}/tiled/binary", "input": name, "backend": select_backend("binary"),
+                          "options": {**OPTION_DEFAULTS, "tile_size": TILE_SIZE}, "tiled": True})
+    return cases
+
+
+def _current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def count_subpaths(svg: str) -> int:
+    """Movetos across all path data: comparable whether shapes share a <path> (potrace, merged) or not"""
+    return sum(len(re.findall(r"[Mm]", d)) for d in re.findall(r'\sd="([^"]*)"', svg))
+
+
+def _suite_probe(image_data: bytes, case: dict, conn) -> None:
+    """Run one case in a fresh fork and report wall time, peak RSS growth and output."""
+    try:
+        baseline_mb = _current_rss_mb()
+        run_start = time.perf_counter()
+        if case["tiled"]:
+            pool = TracePool(cpu_quota())
+            svg, _, stats = vectorize_tiled(image_data, case["options"], pool, case["options"]["tile_size"])
+            pool.close()
+        else:
+            svg, _, stats = trace_job(image_data, case["options"], case["backend"])
+        wall_ms = (time.perf_counter() - run_start) * 1000
+        # ru_maxrss is KB on Linux; CLI tools and pool workers are reaped children
+        peak_mb = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline_mb,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        )
+        conn.send({"status": "ok", "wall_ms": wall_ms, "peak_rss_mb": peak_mb,
+                   "paths": count_subpaths(svg), "svg_bytes": len(svg.encode("utf-8"))})
+    except Exception as e:
+        conn.send({"status": "failed", "error": str(e)})
+
+
+def run_benchmark_suite(runs: int, scan_megapixels: float, only: Optional[str] = None) -> dict:
+    """Run every case `runs` times; wall time is the median, RSS the max."""
+    import platform
+
+    corpus = benchmark_corpus(scan_megapixels)
+    ctx = multiprocessing.get_context("fork")
+    results = []
+    for case in benchmark_cases(corpus):
+        if only and only not in case["case"]:
+            continue
+        samples = []
+        for _ in range(runs):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_suite_probe, args=(corpus[case["input"]], case, child))
+            proc.start()
+            child.close()  # so recv() sees EOF if the probe dies without sending
+            try:
+                samples.append(parent.recv())
+            except EOFError:
+                proc.join()
+                samples.append({"status": "failed", "error": f"probe died (exit code {proc.exitcode})"})
+            parent.close()
+            proc.join()
+        ok = [sample for sample in samples if sample["status"] == "ok"]
+        entry = {key: case[key] for key in ("case", "input", "backend", "tiled")}
+        entry["color_mode"] = case["options"]["color_mode"]
+        if not ok:
+            entry.update(status="failed", error=samples[0]["error"])
+        else:
+            walls = sorted(sample["wall_ms"] for sample in ok)
+            entry.update(
+                status="ok",
+                wall_ms=round(walls[len(walls) // 2], 2),
+                wall_ms_runs=[round(wall, 2) for wall in walls],
+                peak_rss_mb=round(max(sample["peak_rss_mb"] for sample in ok), 1),
+                paths=ok[0]["paths"],
+                svg_bytes=ok[0]["svg_bytes"],
+            )
+        results.append(entry)
+        print(f"{entry['case']:<40} " + (
+            f"{entry['wall_ms']:>10.1f} ms {entry['peak_rss_mb']:>8.1f} MB "
+            f"{entry['paths']:>7} paths {entry['svg_bytes'] / 1024:>9.1f} KB"
+            if entry["status"] == "ok" else f"FAILED: {entry['error']}"
+        ))
+
+    return {
+        "schema": 1,
+        "meta": {
+            "timestamp": int(time.time()),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpu_quota": cpu_quota(),
+            "runs": runs,
+            "scan_megapixels": scan_megapixels,
+            "tools": {
+                "potrace": check_potrace(), "vtracer": check_vtracer(),
+                "potrace-py": POTRACE_PY_AVAILABLE, "vtracer-py": VTRACER_PY_AVAILABLE,
+            },
+        },
+        "results": results,
+    }
+
+
+def compare_reports(current: dict, baseline: dict, time_tolerance: float, size_tolerance: float) -> List[str]:
+    """Print per-case deltas against a baseline report; returns the regressed cases."""
+    previous = {entry["case"]: entry for entry in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<40} {'wall':>9} {'rss':>9} {'paths':>9} {'bytes':>9}")
+    for entry in current["results"]:
+        before = previous.get(entry["case"])
+        if before is None or before.get("status") != "ok" or entry["status"] != "ok":
+            status = "new" if before is None else f"{before.get('status')} -> {entry['status']}"
+            print(f"{entry['case']:<40} {status}")
+            if before is not None and before.get("status") == "ok" and entry["status"] != "ok":
+                regressions.append(entry["case"])
+            continue
+
+        def delta(key: str) -> float:
+            return (entry[key] - before[key]) / before[key] if before[key] else 0.0
+
+        flags = []
+        # Ignore sub-5ms swings on tiny inputs; they are timer and scheduler noise
+        if delta("wall_ms") > time_tolerance and entry["wall_ms"] - before["wall_ms"] > 5:
+            flags.append("slower")
+        if delta("svg_bytes") > size_tolerance:
+            flags.append("larger")
+        if flags:
+            regressions.append(entry["case"])
+        print(f"{entry['case']:<40} {delta('wall_ms'):>+9.1%} {delta('peak_rss_mb'):>+9.1%} "
+              f"{delta('paths'):>+9.1%} {delta('svg_bytes'):>+9.1%} {' '.join(flags)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SVG-Turbo Vectorization Worker")
+    parser.add_argument("--benchmark-overhead", action="store_true",
+                        help="Time per-job overhead of each backend on a small icon and exit")
+    parser.add_argument("--icon-size", type=int, default=64, help="Icon side for --benchmark-overhead")
+    parser.add_argument("--runs", type=int, default=50, help="Jobs per backend")
+    parser.add_argument("--benchmark-scaling", action="store_true",
+                        help="Measure trace throughput with 1..N pool workers and exit")
+    parser.add_argument("--max-workers", type=int, default=0, help="N for --benchmark-scaling (default: CPU quota)")
+    parser.add_argument("--jobs", type=int, default=32, help="Traces per step of --benchmark-scaling")
+    parser.add_argument("--size", type=int, default=768, help="Test image side for the benchmarks")
+    parser.add_argument("--benchmark-tiled", action="store_true",
+                        help="Compare single-pass and tiled tracing of a large image and exit")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="Tile side for --benchmark-tiled")
+    parser.add_argument("--benchmark-optimize", action="store_true",
+                        help="Report SVG optimizer savings and visual drift and exit")
+    parser.add_argument("--benchmark-quantize", action="store_true",
+                        help="Report color trace time, paths and size as K varies and exit")
+    parser.add_argument("--quantize-method", default="median-cut", choices=["median-cut", "kmeans"])
+    parser.add_argument("--benchmark-suite", action="store_true",
+                        help="Run the corpus x backend x mode suite, write a JSON report and exit")
+    parser.add_argument("--report", default="svg-turbo-benchmark.json", help="Where --benchmark-suite writes its report")
+    parser.add_argument("--compare", help="Baseline report; exit 1 if any case regressed beyond tolerance")
+    parser.add_argument("--time-tolerance", type=float, default=0.20, help="Allowed wall-time growth (fraction)")
+    parser.add_argument("--size-tolerance", type=float, default=0.05, help="Allowed SVG size growth (fraction)")
+    parser.add_argument("--scan-megapixels", type=float, default=24, help="Size of the huge-scan corpus entry")
+    parser.add_argument("--only", help="Run only suite cases whose name contains this")
+    args = parser.parse_args()
+
+    if args.benchmark_overhead:
+        benchmark_overhead(args.icon_size, args.runs)
+        return
+    if args.benchmark_scaling:
+        benchmark_scaling(args.max_workers or cpu_quota(), args.jobs, args.size)
+        return
+    if args.benchmark_tiled:
+        benchmark_tiled(args.size, args.tile_size, args.max_workers or cpu_quota())
+        return
+    if args.benchmark_optimize:
+        benchmark_optimize(args.size)
+        return
+    if args.benchmark_quantize:
+        benchmark_quantize(args.size, args.quantize_method)
+        return
+    if args.benchmark_suite:
+        report = run_benchmark_suite(args.runs, args.scan_megapixels, args.only)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[+] Report written to {args.report}")
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare_reports(report, json.load(f), args.time_tolerance, args.size_tolerance)
+            if regressions:
+                print(f"[!] {len(regressions)} regression(s): {', '.join(regressions)}")
+                raise SystemExit(1)
+        return
+
+    print("[*] Starting SVG-Turbo vectorization worker...")
+    print(f"[*] Tools available: potrace={check_potrace()}, vtracer={check_vtracer()}, imagemagick={check_imagemagick()}")
+    print(f"[*] In-process bindings: potrace={POTRACE_PY_AVAILABLE}, vtracer={VTRACER_PY_AVAILABLE} (backend={BACKEND})")
+    pool = get_trace_pool()
+    print(f"[*] Trace pool: {pool.workers} processes, {JOB_TIMEOUT:.0f}s job timeout")
+    run_queue_processor(pool.workers)
     print(f"[*] Starting FastAPI server on port {PORT}...")
     uvicorn.run(app, host="0.0.0.0", port=PORT)
+
+
+if __name__ == "__main__":
+    main()
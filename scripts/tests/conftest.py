@@ -0,0 +1,38 @@
+"""
+Shared setup for the worker script tests
+
+Run from the repository root with: python -m pytest scripts/tests
+
+The workers are standalone scripts with hyphenated names, so they are loaded
+by path; shared modules (job_store, uploads) import normally once scripts/
+is on sys.path.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+
+def load_worker(filename: str):
+    """Import scripts/<filename> once per session under an importable name."""
+    name = filename.removesuffix(".py").replace("-", "_")
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, SCRIPTS_DIR / filename)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except ImportError as e:
+            del sys.modules[name]
+            pytest.skip(f"{filename} needs {e.name}")
+    return sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def sam2_worker():
+    return load_worker("sam2-worker.py")
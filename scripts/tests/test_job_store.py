@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from job_store import JobStore, PendingLimitExceeded
+
+
+def artifact(root, name: str, size: int = 1000):
+    path = root / name
+    path.write_bytes(b"\0" * size)
+    return path
+
+
+def make_store(root, **kwargs) -> JobStore:
+    kwargs = {"ttl_seconds": 60, "max_pending": 0, "quota_bytes": 0, "log": lambda message: None, **kwargs}
+    return JobStore(roots=[root], **kwargs)
+
+
+def test_finished_jobs_expire_after_ttl(tmp_path):
+    store = make_store(tmp_path)
+    for job_id, status in (("done", "completed"), ("running", "processing")):
+        store[job_id] = {"status": status}
+        store.add_artifact(job_id, artifact(tmp_path, job_id))
+
+    assert store.collect()["expired"] == 0
+    store._finished_at["done"] = time.time() - 120
+    result = store.collect()
+
+    assert result["expired"] == 1 and result["reclaimedBytes"] == 1000
+    assert "done" not in store and not (tmp_path / "done").exists()
+    assert "running" in store and (tmp_path / "running").exists()
+
+
+def test_quota_evicts_least_recently_used_first(tmp_path):
+    store = make_store(tmp_path, quota_bytes=2500)
+    for job_id in ("a", "b", "c"):
+        store[job_id] = {"status": "completed"}
+        store.add_artifact(job_id, artifact(tmp_path, job_id))
+    store._accessed_at.update(a=3, b=1, c=2)
+
+    result = store.collect()
+
+    assert result["evicted"] == 1 and result["diskBytes"] == 2000
+    assert sorted(store) == ["a", "c"]
+
+
+def test_shared_artifact_outlives_its_first_owner(tmp_path):
+    store = make_store(tmp_path)
+    stems = artifact(tmp_path, "stems")
+    for job_id in ("source", "duplicate"):
+        store[job_id] = {"status": "completed"}
+        store.add_artifact(job_id, stems)
+    store.collect()
+    store._finished_at["source"] = time.time() - 120
+
+    store.collect()
+
+    assert "source" not in store and stems.exists()
+
+
+def test_orphans_are_removed_once_older_than_ttl(tmp_path):
+    store = make_store(tmp_path)
+    old, fresh = artifact(tmp_path, "old"), artifact(tmp_path, "fresh")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+
+    assert store.collect()["orphans"] == 1
+    assert not old.exists() and fresh.exists()
+
+
+def test_reserved_slots_count_against_the_pending_cap(tmp_path):
+    store = make_store(tmp_path, max_pending=2)
+    release = store.reserve_pending()
+    store["queued"] = {"status": "queued"}
+    with pytest.raises(PendingLimitExceeded):
+        store.reserve_pending()
+    release()
+    release()  # idempotent
+    store.reserve_pending()
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+import pytest
+import torch
+
+
+class FakeImagePredictor:
+    """Stands in for SAM2ImagePredictor; counts image encoder runs."""
+
+    def __init__(self):
+        self.model = object()
+        self.encodes = 0
+        self._is_image_set = False
+        self._features = None
+        self._orig_hw = []
+
+    def set_image(self, image_np):
+        self.encodes += 1
+        self._is_image_set = True
+        self._features = {"image_embed": float(image_np.mean())}
+        self._orig_hw = [image_np.shape[:2]]
+
+    def predict(self, **kwargs):
+        return np.zeros((1, 8, 8), dtype=bool), np.ones(1, dtype=np.float32), None
+
+
+class FakeMaskGenerator:
+    """Drives the predictor like SAM2AutomaticMaskGenerator does for the single full-image crop."""
+
+    def __init__(self, model, output_mode, **options):
+        self.predictor = None
+
+    def generate(self, image_np):
+        height, width = image_np.shape[:2]
+        self.predictor.set_image(image_np[0:height, 0:width])
+        self.predictor.reset_predictor()
+        return []
+
+
+@pytest.fixture
+def scheduler(sam2_worker, monkeypatch):
+    inner = FakeImagePredictor()
+    predictor = sam2_worker.CachedEmbeddingPredictor(inner)
+    monkeypatch.setattr(sam2_worker.registry, "get", lambda name=None: predictor)
+    monkeypatch.setattr(sam2_worker, "SAM2AutomaticMaskGenerator", FakeMaskGenerator, raising=False)
+    scheduler = sam2_worker.InferenceScheduler()
+    scheduler.start()
+    return scheduler, inner
+
+
+def image(seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+
+
+def test_automatic_task_encodes_once(sam2_worker, scheduler):
+    scheduler, inner = scheduler
+    masks, _, extra = scheduler.submit(
+        image(),
+        lambda pred, img: sam2_worker.run_segmentation(pred, img, {"mode": "automatic"}),
+    ).result(timeout=10)
+    assert inner.encodes == 1
+    assert masks.shape == (0, 32, 48)
+    assert extra["preset"] == "balanced"
+
+
+def test_tasks_on_same_pixels_reuse_embedding(sam2_worker, scheduler):
+    scheduler, inner = scheduler
+    payloads = [{"mode": "automatic"}, {"mode": "point", "points": [[4, 4]]}, {"mode": "automatic"}]
+    for payload in payloads:
+        scheduler.submit(
+            image(), lambda pred, img, payload=payload: sam2_worker.run_segmentation(pred, img, payload)
+        ).result(timeout=10)
+    assert inner.encodes == 1
+
+    scheduler.submit(image(1), lambda pred, img: None).result(timeout=10)
+    assert inner.encodes == 2
+
+
+def small_masks(count: int = 3) -> np.ndarray:
+    """Overlapping rectangles of clearly different areas at decoded resolution (16x12)."""
+    masks = np.zeros((count, 12, 16), dtype=bool)
+    for i in range(count):
+        masks[i, i:12 - i, 2 * i:16 - i] = True
+    return masks
+
+
+@pytest.mark.parametrize("encoding", ["rle", "bitpacked", "labelmap"])
+def test_restored_masks_encode_like_full_resolution(sam2_worker, encoding, tmp_path):
+    restored = sam2_worker.RestoredMasks(small_masks(), (40, 30))
+    eager = np.stack(list(restored))
+    assert eager.shape == restored.shape == (3, 30, 40)
+    lazy_result = sam2_worker.encode_masks(restored, encoding, str(tmp_path), inline=True)
+    eager_result = sam2_worker.encode_masks(eager, encoding, str(tmp_path), inline=True)
+    assert lazy_result == eager_result
+
+
+def test_to_original_rescales_metadata(sam2_worker):
+    decoded = sam2_worker.DecodedImage(Image.new("RGB", (16, 12)), (40, 30))
+    masks, extra = decoded.to_original(small_masks(1), {"boxes": [[0, 0, 16, 12]], "areas": [192]})
+    assert masks[0].shape == (30, 40) and masks[0].all()
+    assert extra == {"boxes": [[0.0, 0.0, 40.0, 30.0]], "areas": [1200]}
+
+
+def test_concurrent_clicks_on_one_session_both_commit(sam2_worker, scheduler, monkeypatch):
+    scheduler, _ = scheduler
+    monkeypatch.setattr(sam2_worker, "scheduler", scheduler)
+    monkeypatch.setattr(
+        sam2_worker, "refine_session",
+        lambda session, points, labels, box, logits: (
+            np.zeros((1, 12, 16), dtype=bool), np.ones(1, dtype=np.float32), 0.0, np.zeros((1, 4, 4))
+        ),
+    )
+    decoded = sam2_worker.DecodedImage(Image.new("RGB", (16, 12)), (16, 12))
+    session = sam2_worker.InteractiveSession("s1", "large", decoded, "key", {}, (12, 16))
+    monkeypatch.setitem(sam2_worker.sessions, session.id, session)
+
+    async def click_twice():
+        return await asyncio.gather(*(
+            sam2_worker.session_click(session.id, sam2_worker.SessionClickRequest(points=[[x, 1]]))
+            for x in (2, 8)
+        ))
+
+    results = asyncio.run(click_twice())
+    assert sorted(result["clicks"] for result in results) == [1, 2]
+    assert session.points == [[2, 1], [8, 1]] and session.clicks == 2
+
+
+def test_video_predictor_shares_the_registry_budget(sam2_worker, monkeypatch, tmp_path):
+    checkpoint = tmp_path / "model.pt"
+    checkpoint.write_bytes(b"\0" * 1024)
+    monkeypatch.setattr(sam2_worker, "SAM2_AVAILABLE", True)
+    monkeypatch.setattr(sam2_worker, "model_paths", lambda name: ("cfg.yaml", str(checkpoint)))
+    # 256 float32 weights = 1 KB per model; the budget fits one
+    monkeypatch.setattr(sam2_worker, "build_sam2", lambda *a, **k: torch.nn.Linear(16, 16, bias=False),
+                        raising=False)
+    monkeypatch.setattr(sam2_worker, "build_sam2_video_predictor",
+                        lambda *a, **k: torch.nn.Linear(16, 16, bias=False), raising=False)
+    monkeypatch.setattr(sam2_worker, "SAM2ImagePredictor", lambda model: FakeImagePredictor(), raising=False)
+
+    registry = sam2_worker.ModelRegistry(budget_mb=1.5 / 1024)
+    registry.get("large")
+    video = registry.get_video("large")
+    assert registry.loaded == ["large:video"]
+    assert registry.get_video("large") is video
+    registry.get("large")
+    assert registry.loaded == ["large"]
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (7, 5), (32, 48)])
+def test_rle_round_trip(sam2_worker, shape):
+    rng = np.random.default_rng(sum(shape))
+    for mask in (rng.random(shape) > 0.5, np.ones(shape, dtype=bool), np.zeros(shape, dtype=bool)):
+        rle = sam2_worker.encode_rle(mask)
+        assert rle["size"] == list(shape)
+        np.testing.assert_array_equal(sam2_worker.decode_rle(rle), mask)
+
+
+def test_bitpacked_round_trip(sam2_worker, tmp_path):
+    masks = np.random.default_rng(0).random((3, 7, 5)) > 0.5
+    encoded = sam2_worker.encode_masks(masks, "bitpacked", str(tmp_path), inline=True)
+    data = np.load(BytesIO(base64.b64decode(encoded["masks"])))
+    count, height, width = data["shape"]
+    unpacked = np.unpackbits(data["bits"], axis=1)[:, :height * width].reshape(count, height, width)
+    np.testing.assert_array_equal(unpacked.astype(bool), masks)
+
+
+def test_labelmap_paints_smaller_masks_on_top(sam2_worker, tmp_path):
+    masks = small_masks()
+    encoded = sam2_worker.encode_masks(masks, "labelmap", str(tmp_path), inline=True)
+    labels = np.asarray(Image.open(BytesIO(base64.b64decode(encoded["masks"].split(",", 1)[1]))))
+    for i in range(len(masks)):
+        # Mask i is largest-first, so every pixel it covers shows i or a later (smaller) mask
+        assert (labels[masks[i]] >= i + 1).all()
+    assert (labels[~masks.any(axis=0)] == 0).all()
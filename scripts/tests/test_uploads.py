@@ -0,0 +1,82 @@
+import hashlib
+
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from uploads import receive_upload  # noqa: E402
+
+BOUNDARY = "test-boundary"
+MAX_BYTES = 1024
+
+
+def multipart(payload: bytes, **form) -> bytes:
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in form.items()
+    ]
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="clip.wav"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + payload + b"\r\n"
+    )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        hasher, fields = hashlib.sha256(), {}
+        filename, written = await receive_upload(
+            request, tmp_path / "upload.bin", max_bytes=MAX_BYTES, hasher=hasher, fields=fields
+        )
+        return {"filename": filename, "written": written, "sha256": hasher.hexdigest(), "fields": fields}
+
+    return TestClient(app)
+
+
+def post(client, body, **headers):
+    headers = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}", **headers}
+    return client.post("/upload", content=body, headers=headers)
+
+
+def test_upload_is_streamed_to_disk_with_form_fields(client, tmp_path):
+    payload = bytes(range(256)) * 3
+    response = post(client, multipart(payload, output="zip"))
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "filename": "clip.wav",
+        "written": len(payload),
+        "sha256": hashlib.sha256(payload).hexdigest(),
+        "fields": {"output": "zip"},
+    }
+    assert (tmp_path / "upload.bin").read_bytes() == payload
+
+
+def test_declared_oversize_upload_is_refused_up_front(client, tmp_path):
+    response = post(client, multipart(b"x" * 10), **{"Content-Length": str(MAX_BYTES * 1024)})
+
+    assert response.status_code == 413
+    assert not (tmp_path / "upload.bin").exists()
+
+
+def test_oversize_upload_is_refused_while_parsing(client, tmp_path):
+    body = multipart(b"x" * (MAX_BYTES + 1))
+    # Chunked, so there is no Content-Length to check up front
+    response = post(client, (body[i:i + 256] for i in range(0, len(body), 256)))
+
+    assert response.status_code == 413
+    assert not (tmp_path / "upload.bin").exists()
+
+
+def test_missing_file_field_is_a_bad_request(client, tmp_path):
+    body = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="output"\r\n\r\nzip\r\n--{BOUNDARY}--\r\n'
+    response = post(client, body.encode())
+
+    assert response.status_code == 400
+    assert not (tmp_path / "upload.bin").exists()
@@ -0,0 +1,130 @@
+"""
+Streaming multipart uploads for the workers
+
+Shared by audio-processor-worker.py, audio-processor.py and
+svg-turbo-worker.py. Declaring an
+UploadFile parameter makes Starlette spool the whole request body to a
+temporary file before the handler runs, so a size cap checked afterwards
+only applies once the upload has landed on disk (and it is then copied a
+second time). receive_upload reads request.stream() through python-multipart
+instead: the file part goes straight to its destination, hashed on the way
+if asked, and the request is refused as soon as it passes the cap.
+"""
+
+import asyncio
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "1024")) * 1024 * 1024)
+MULTIPART_OVERHEAD = 64 * 1024  # boundaries, part headers and small form fields
+
+
+def upload_too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes // (1024 * 1024)} MB")
+
+
+async def receive_upload(request: Request, dest, field: str = "file",
+                         max_bytes: int = MAX_UPLOAD_BYTES, hasher=None,
+                         fields: Optional[dict] = None) -> Tuple[str, int]:
+    """
+    Stream multipart field `field` of request to dest, feeding hasher if
+    given. Returns (client filename, bytes written). 413 up front when
+    Content-Length already exceeds the cap, or as soon as the part does;
+    no file is left behind on any error. Plain form fields are decoded into
+    fields when it is given, up to MULTIPART_OVERHEAD bytes in total.
+    """
+    dest = Path(dest)
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise upload_too_large(max_bytes)
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    part = {"field": b"", "value": b"", "headers": {}, "target": False, "name": None, "data": []}
+    found = {"filename": None, "form_bytes": 0}
+    received = []
+
+    def on_part_begin():
+        part.update(field=b"", value=b"", headers={}, target=False, name=None, data=[])
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if options.get(b"name") == field.encode() and found["filename"] is None:
+            part["target"] = True
+            found["filename"] = options.get(b"filename", b"").decode("utf-8", "replace")
+        elif fields is not None and b"filename" not in options:
+            part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part["target"]:
+            received.append(bytes(data[start:end]))
+        elif part["name"] is not None:
+            found["form_bytes"] += end - start
+            if found["form_bytes"] > MULTIPART_OVERHEAD:
+                raise HTTPException(status_code=413, detail="Form fields are too large")
+            part["data"].append(bytes(data[start:end]))
+
+    def on_part_end():
+        if part["name"] is not None:
+            fields[part["name"]] = b"".join(part["data"]).decode("utf-8", "replace")
+        part["target"] = False
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    written = 0
+    try:
+        with open(dest, "wb") as out:
+            def sink(chunks):
+                for chunk in chunks:
+                    out.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+
+            async for body in request.stream():
+                try:
+                    parser.write(body)
+                except FormParserError as e:
+                    raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+                if received:
+                    chunks = received[:]
+                    received.clear()
+                    written += sum(len(chunk) for chunk in chunks)
+                    if written > max_bytes:
+                        raise upload_too_large(max_bytes)
+                    await asyncio.to_thread(sink, chunks)
+            parser.finalize()
+        if found["filename"] is None:
+            raise HTTPException(status_code=400, detail=f"Missing file field '{field}'")
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return found["filename"], written
@@ -28,7 +28,12 @@ export interface SegmentationResult {
 
 export interface VectorizationResult {
   svgUrl: string;
-  svgContent: string;
+  svgContent?: string; // inline when small; otherwise fetch svgRefUrl
+  svgRef?: string;
+  svgRefUrl?: string; // worker-relative, served gzip-encoded
+  svgBytes?: number;
+  svgCompressedBytes?: number;
+  expiresIn?: number; // seconds
   inputImageUrl: string;
 }
 